@@ -2,204 +2,2222 @@
 """
 Latency Simulator with HTTP server for Cloud Run compatibility
 Supports custom latency via LATENCY_MS env variable (in milliseconds)
+and named latency distributions via LATENCY_DIST (pre-generated sample tables).
+Latency, distribution and error rate can be changed live through /admin/config
+(SIM_ADMIN_TOKEN), and per request with the X-Sim-Latency header.
+LATENCY_SCHEDULE / LATENCY_TRACE_FILE vary the target over time (monotonic clock).
+/payload serves bodies of PAYLOAD_SIZE (or ?size=) from one shared buffer or PAYLOAD_FILE.
+/stream sends a chunked (SSE-style) response: TTFB, then chunks every STREAM_INTERVAL_MS.
+SIM_CONCURRENCY emulates Cloud Run containerConcurrency: excess requests queue or get 429/503.
+DOWNSTREAM_URLS fans each request out to other services over pooled keep-alive connections.
+BURN_RATIO spends that share of each delay in calibrated CPU work instead of sleeping.
+FAULTS injects seeded, reproducible failures: 5xx, resets, truncated bodies, hangs, slow writes.
+
+Serving engine is selected via SIM_ENGINE:
+  threaded - one thread per connection (default)
+  asyncio  - single event loop, delays use non-blocking asyncio.sleep
+  single   - legacy single-threaded HTTPServer (requests are serialized)
+SIM_WORKERS > 1 forks a pool of engine processes sharing the port via SO_REUSEPORT.
+
+Connections are persistent (HTTP/1.1 keep-alive) unless SIM_KEEPALIVE=false;
+SIM_IDLE_TIMEOUT and SIM_MAX_REQUESTS_PER_CONN bound how long they are reused.
 """
 import time
 import os
 from datetime import datetime
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from email.utils import formatdate
+from http import HTTPStatus
+from http.server import HTTPServer, ThreadingHTTPServer, BaseHTTPRequestHandler
+import asyncio
+import multiprocessing
+import signal
+import sys
 import threading
 import socket
 import random
+import string
+import collections
+import urllib.parse
+import math
+import re
+import bisect
+import json
+import hmac
+import itertools
+import http.client
+import concurrent.futures
+import struct
+from array import array
+
+ENGINES = ('threaded', 'asyncio', 'single')
+
+# Smaller thread stacks so the threaded engine can hold thousands of
+# sleeping requests without reserving 8MB of address space per thread
+THREAD_STACK_SIZE = 256 * 1024
+
+# Listen backlog - the socketserver default of 5 drops bursts of connections
+LISTEN_BACKLOG = 4096
+
+
+def log(message):
+    """Print a log line with timestamp"""
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    print(f"[{timestamp}] {message}")
+
+
+DISTRIBUTIONS = ('uniform', 'fixed', 'exponential', 'lognormal', 'pareto', 'bimodal', 'percentiles', 'empirical')
+
+
+class LatencyDistribution:
+    """Pre-generated latency samples (ms), drawing one is a single table lookup"""
+    
+    def __init__(self, name, latency_ms, samples, description):
+        self.name = name
+        self.latency_ms = latency_ms
+        self.samples = samples
+        self.size = len(samples)
+        self.description = description
+    
+    def draw(self):
+        """Return one latency sample in milliseconds"""
+        return self.samples[int(random.random() * self.size)]
+    
+    def percentile(self, q):
+        """Percentile (0-100) of the sample table"""
+        ordered = sorted(self.samples)
+        return ordered[min(self.size - 1, int(q / 100 * self.size))]
+
+
+def parse_percentiles(spec):
+    """Parse 'p50=200,p95=3000,p99=8000' into sorted (quantile, ms) points"""
+    points = []
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        key, _, value = item.partition('=')
+        points.append((float(key.strip().lstrip('pP')) / 100, float(value)))
+    if not points:
+        raise ValueError(f"No percentile targets in '{spec}'")
+    points.sort()
+    # Anchor the ends so every quantile in [0, 1] can be interpolated
+    if points[0][0] > 0:
+        points.insert(0, (0.0, points[0][1] / 2))
+    if points[-1][0] < 1:
+        points.append((1.0, points[-1][1]))
+    return points
+
+
+def load_histogram(path):
+    """
+    Load an empirical latency histogram
+    
+    Each line is 'upper_bound_ms,count' (header and # comments are skipped).
+    Returns (quantile, ms) points of the cumulative distribution.
+    """
+    buckets = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            bound, _, count = line.partition(',')
+            try:
+                buckets.append((float(bound), float(count)))
+            except ValueError:
+                continue  # header row
+    buckets.sort()
+    total = sum(count for _, count in buckets)
+    if total <= 0:
+        raise ValueError(f"Histogram {path} has no samples")
+    
+    points = [(0.0, 0.0)]
+    cumulative = 0.0
+    for bound, count in buckets:
+        cumulative += count
+        points.append((cumulative / total, bound))
+    return points
+
+
+def inverse_cdf(points, q):
+    """Linear interpolation of the value at quantile q between (quantile, ms) points"""
+    for (q0, v0), (q1, v1) in zip(points, points[1:]):
+        if q <= q1:
+            if q1 == q0:
+                return v1
+            return v0 + (v1 - v0) * (q - q0) / (q1 - q0)
+    return points[-1][1]
+
+
+def build_distribution(name, latency_ms, options):
+    """
+    Pre-generate the sample table for a named distribution
+    
+    Args:
+        name: One of DISTRIBUTIONS
+        latency_ms: Base latency (median for lognormal, minimum for pareto,
+            fast path for bimodal)
+        options: Dict of distribution parameters (see distribution_options_from_env)
+    """
+    size = int(options.get('table_size', 65536))
+    max_ms = float(options.get('max_ms', 60000))
+    rng = random.Random(options.get('seed'))
+    
+    if name == 'uniform':
+        values = (latency_ms * (1 + rng.uniform(-0.1, 0.1)) for _ in range(size))
+        description = f"{latency_ms}ms ±10%"
+    elif name == 'fixed':
+        values = (latency_ms for _ in range(size))
+        description = f"{latency_ms}ms fixed"
+    elif name == 'exponential':
+        # Memoryless service times, the 'M' of an M/M/c queue
+        values = (rng.expovariate(1 / max(latency_ms, 1)) for _ in range(size))
+        description = f"exponential mean {latency_ms}ms"
+    elif name == 'lognormal':
+        sigma = float(options.get('sigma', 0.5))
+        mu = math.log(max(latency_ms, 1))
+        values = (rng.lognormvariate(mu, sigma) for _ in range(size))
+        description = f"lognormal median {latency_ms}ms σ={sigma:g}"
+    elif name == 'pareto':
+        alpha = float(options.get('alpha', 2.5))
+        values = (latency_ms * rng.paretovariate(alpha) for _ in range(size))
+        description = f"pareto min {latency_ms}ms α={alpha:g}"
+    elif name == 'bimodal':
+        slow_ms = float(options.get('slow_ms', 4000))
+        slow_ratio = float(options.get('slow_ratio', 0.05))
+        values = (
+            (slow_ms if rng.random() < slow_ratio else latency_ms) * (1 + rng.uniform(-0.1, 0.1))
+            for _ in range(size)
+        )
+        description = f"{latency_ms}ms, {slow_ratio*100:g}% slow path at {slow_ms:g}ms"
+    elif name in ('percentiles', 'empirical'):
+        if name == 'percentiles':
+            spec = options.get('percentiles', 'p50=200,p95=3000,p99=8000')
+            points = parse_percentiles(spec)
+            description = f"percentiles {spec}"
+        else:
+            path = options.get('histogram_file')
+            if not path:
+                raise ValueError("LATENCY_HISTOGRAM_FILE is required for the empirical distribution")
+            points = load_histogram(path)
+            description = f"empirical {os.path.basename(path)}"
+        # Stratified quantiles hit the targets exactly, then shuffle for random draws
+        values = [inverse_cdf(points, (i + 0.5) / size) for i in range(size)]
+        rng.shuffle(values)
+    else:
+        raise ValueError(f"Unknown latency distribution '{name}' (expected one of: {', '.join(DISTRIBUTIONS)})")
+    
+    samples = array('d', (min(max_ms, max(0.0, v)) for v in values))
+    return LatencyDistribution(name, latency_ms, samples, description)
+
+
+def distribution_options_from_env():
+    """Collect LATENCY_* distribution parameters from the environment"""
+    env_names = {
+        'sigma': 'LATENCY_SIGMA',
+        'alpha': 'LATENCY_PARETO_ALPHA',
+        'slow_ms': 'LATENCY_SLOW_MS',
+        'slow_ratio': 'LATENCY_SLOW_RATIO',
+        'percentiles': 'LATENCY_PERCENTILES',
+        'histogram_file': 'LATENCY_HISTOGRAM_FILE',
+        'max_ms': 'LATENCY_MAX_MS',
+        'table_size': 'LATENCY_TABLE_SIZE',
+        'seed': 'LATENCY_SEED',
+    }
+    return {key: os.environ[env] for key, env in env_names.items() if os.getenv(env)}
+
+
+DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+_NUM = r'(\d+(?:\.\d+)?)'
+_DUR = r'(\d+(?:\.\d+)?(?:ms|s|m|h))'
+SCHEDULE_PHRASES = {
+    'step': re.compile(rf'^(?:step to\s+)?{_NUM}\s*ms\s+for\s+{_DUR}$'),
+    'ramp': re.compile(rf'^ramp to\s+{_NUM}\s*ms\s+over\s+{_DUR}$'),
+    'hold': re.compile(rf'^hold\s+{_DUR}$'),
+    'recover': re.compile(rf'^recover(?:\s+over\s+{_DUR})?$'),
+    'sine': re.compile(rf'^sine\s+{_NUM}\s*-\s*{_NUM}\s*ms\s+period\s+{_DUR}\s+for\s+{_DUR}$'),
+}
+
+
+def parse_duration(text):
+    """Parse '500ms', '30s', '5m' or '1h' into seconds"""
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)(ms|s|m|h)', text.strip())
+    if not match:
+        raise ValueError(f"Invalid duration '{text}'")
+    return float(match.group(1)) * DURATION_UNITS[match.group(2)]
+
+
+class LatencySchedule:
+    """
+    Piecewise latency target over time since the schedule started
+    
+    Segments are (start, duration, from_ms, to_ms, period): linear between
+    from_ms and to_ms, or a sine wave between them when period is set.
+    After the last segment the final level is held, unless repeat is set.
+    """
+    
+    def __init__(self, segments, repeat, description):
+        self.segments = segments
+        self.starts = [segment[0] for segment in segments]
+        self.total = segments[-1][0] + segments[-1][1] if segments else 0
+        self.repeat = repeat and self.total > 0
+        self.description = description
+    
+    def evaluate(self, elapsed):
+        """Return (segment index, target latency ms) at elapsed seconds"""
+        if self.repeat:
+            elapsed %= self.total
+        
+        index = max(0, bisect.bisect_right(self.starts, elapsed) - 1)
+        start, duration, from_ms, to_ms, period = self.segments[index]
+        offset = min(elapsed - start, duration)
+        if elapsed >= self.total:
+            # Past the end: hold the final level
+            index = len(self.segments)
+        
+        if period:
+            phase = math.sin(2 * math.pi * offset / period)
+            return index, from_ms + (to_ms - from_ms) * (phase + 1) / 2
+        if duration <= 0:
+            return index, to_ms
+        return index, from_ms + (to_ms - from_ms) * offset / duration
+
+
+def parse_schedule(spec):
+    """
+    Parse a schedule such as '100ms for 5m, ramp to 4000ms over 2m, hold 10m, recover'
+    
+    Phrases: '<X>ms for <D>' (step), 'ramp to <X>ms over <D>', 'hold <D>',
+    'recover [over <D>]' (back to the first level), 'sine <lo>-<hi>ms period <P> for <D>'
+    and a trailing 'repeat' to loop.
+    """
+    phrases = [phrase.strip().lower() for phrase in spec.split(',') if phrase.strip()]
+    repeat = bool(phrases) and phrases[-1] == 'repeat'
+    if repeat:
+        phrases.pop()
+    
+    segments = []
+    t = 0.0
+    first_ms = None
+    current_ms = 0.0
+    for phrase in phrases:
+        for kind, pattern in SCHEDULE_PHRASES.items():
+            match = pattern.match(phrase)
+            if match:
+                break
+        else:
+            raise ValueError(f"Cannot parse schedule phrase '{phrase}'")
+        
+        groups = match.groups()
+        if kind == 'step':
+            target, duration = float(groups[0]), parse_duration(groups[1])
+            segments.append((t, duration, target, target, None))
+        elif kind == 'ramp':
+            target, duration = float(groups[0]), parse_duration(groups[1])
+            segments.append((t, duration, current_ms, target, None))
+        elif kind == 'hold':
+            target, duration = current_ms, parse_duration(groups[0])
+            segments.append((t, duration, target, target, None))
+        elif kind == 'recover':
+            target = first_ms if first_ms is not None else current_ms
+            duration = parse_duration(groups[0]) if groups[0] else 0.0
+            segments.append((t, duration, current_ms, target, None))
+        else:
+            low, high = float(groups[0]), float(groups[1])
+            period, duration = parse_duration(groups[2]), parse_duration(groups[3])
+            segments.append((t, duration, low, high, period))
+            # Continue from where the wave ends
+            target = low + (high - low) * (math.sin(2 * math.pi * duration / period) + 1) / 2
+        
+        if first_ms is None:
+            first_ms = segments[-1][2]
+        current_ms = target
+        t += duration
+    
+    if not segments:
+        raise ValueError("Empty latency schedule")
+    return LatencySchedule(segments, repeat, spec)
+
+
+def load_trace(path, speed=1.0):
+    """
+    Load a CSV latency trace of 'offset_seconds,latency_ms' rows
+    
+    The trace is replayed as linear ramps between points, speed compresses
+    time (speed=60 plays one hour of trace in one minute).
+    """
+    points = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            offset, _, latency = line.partition(',')
+            try:
+                points.append((float(offset) / speed, float(latency)))
+            except ValueError:
+                continue  # header row
+    if not points:
+        raise ValueError(f"Trace {path} has no points")
+    points.sort()
+    
+    origin = points[0][0]
+    segments = [
+        (t0 - origin, t1 - t0, v0, v1, None)
+        for (t0, v0), (t1, v1) in zip(points, points[1:])
+    ] or [(0.0, 0.0, points[0][1], points[0][1], None)]
+    return LatencySchedule(segments, False, f"trace {os.path.basename(path)} at {speed:g}x")
+
+
+SIZE_UNITS = {'': 1, 'b': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+
+
+def parse_size(text):
+    """Parse '512', '64k', '10m' or '1g' (binary units) into bytes"""
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)\s*([kmgb]?)b?', text.strip().lower())
+    if not match:
+        raise ValueError(f"Invalid size '{text}'")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+
+def parse_size_distribution(spec):
+    """
+    Parse '64k' or weighted sizes '1k:80,100k:15,10m:5'
+    
+    Returns:
+        (sizes, cumulative weights) for random.choices
+    """
+    sizes, cum_weights = [], []
+    total = 0.0
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        size, _, weight = item.partition(':')
+        total += float(weight) if weight else 1.0
+        sizes.append(parse_size(size))
+        cum_weights.append(total)
+    if not sizes:
+        raise ValueError(f"No payload sizes in '{spec}'")
+    return sizes, cum_weights
+
+
+class Payload:
+    """Response body of `size` bytes streamed from the shared payload source"""
+    __slots__ = ('size',)
+    
+    def __init__(self, size):
+        self.size = size
+    
+    def __len__(self):
+        return self.size
+
+
+# One incompressible 1 MiB buffer shared by every response; larger bodies
+# are sent as repeated memoryview slices of it, never built per request
+PAYLOAD_CHUNK = memoryview(random.Random(0).randbytes(1024 * 1024))
+
+# Optional file sent with sendfile() instead (PAYLOAD_FILE), checked by run_server()
+payload_file = None
+payload_file_size = 0
+
+
+def open_payload_file(path):
+    """Use a file on disk as the payload source for zero-copy sendfile()"""
+    global payload_file, payload_file_size
+    payload_file_size = os.path.getsize(path)
+    if not payload_file_size:
+        raise ValueError(f"Payload file {path} is empty")
+    payload_file = path
+
+
+def send_payload(sock, size):
+    """Write a payload body to a blocking socket"""
+    remaining = size
+    if payload_file is not None:
+        # A file object per body: sendfile() moves (and without zero-copy support
+        # reads from) the file position, which concurrent bodies must not share
+        with open(payload_file, 'rb') as f:
+            while remaining:
+                count = min(remaining, payload_file_size)
+                sock.sendfile(f, 0, count)
+                remaining -= count
+        return
+    while remaining:
+        count = min(remaining, len(PAYLOAD_CHUNK))
+        sock.sendall(PAYLOAD_CHUNK[:count])
+        remaining -= count
+
+
+async def send_payload_async(writer, size):
+    """Write a payload body on the asyncio engine"""
+    remaining = size
+    if payload_file is not None:
+        loop = asyncio.get_running_loop()
+        # Per body, as in send_payload(): coroutines interleave between sendfile() steps
+        with open(payload_file, 'rb') as f:
+            while remaining:
+                count = min(remaining, payload_file_size)
+                await loop.sendfile(writer.transport, f, 0, count)
+                remaining -= count
+        return
+    while remaining:
+        count = min(remaining, len(PAYLOAD_CHUNK))
+        writer.write(PAYLOAD_CHUNK[:count])
+        await writer.drain()
+        remaining -= count
+
+
+def payload_chunks(size):
+    """
+    A payload body as buffers, for writers that must see every byte (the slow fault)
+    
+    Same bytes as send_payload(): PAYLOAD_FILE repeated, or the shared chunk.
+    """
+    remaining = size
+    if payload_file is None:
+        while remaining:
+            count = min(remaining, len(PAYLOAD_CHUNK))
+            yield PAYLOAD_CHUNK[:count]
+            remaining -= count
+        return
+    with open(payload_file, 'rb') as f:
+        while remaining:
+            chunk = f.read(min(remaining, len(PAYLOAD_CHUNK)))
+            if not chunk:
+                f.seek(0)
+                continue
+            yield chunk
+            remaining -= len(chunk)
+
+
+class Stream:
+    """Response body sent as `count` chunks, `interval` seconds apart"""
+    __slots__ = ('chunk', 'count', 'interval')
+    
+    def __init__(self, chunk, count, interval):
+        self.chunk = chunk
+        self.count = count
+        self.interval = interval
+    
+    def frame(self, chunked):
+        """Wire bytes of one chunk, framed once and reused for the whole stream"""
+        if chunked:
+            return f"{len(self.chunk):x}\r\n".encode('latin-1') + self.chunk + b"\r\n"
+        return self.chunk
+
+
+# Last chunk of a chunked transfer-encoding body
+CHUNKED_TERMINATOR = b'0\r\n\r\n'
+
+# Longest stream accepted from ?duration_ms= (Cloud Run's maximum request timeout)
+STREAM_MAX_DURATION_MS = 3600000
+
+
+def build_stream(query, active):
+    """
+    Build a Stream from /stream query parameters
+    
+    interval_ms, duration_ms (first to last chunk), chunk_size and
+    format=sse|raw, defaulting to the STREAM_* settings. ttfb_ms is applied
+    by pick_latency() and only validated here.
+    
+    Raises:
+        ValueError: a negative, non-finite or unparsable parameter
+    """
+    if 'ttfb_ms' in query:
+        checked_delay_ms(query['ttfb_ms'][0], active.max_latency_ms, 'ttfb_ms')
+    interval_ms = checked_delay_ms(query.get('interval_ms', [active.stream_interval_ms])[0],
+                                   active.max_latency_ms, 'interval_ms')
+    duration_ms = checked_delay_ms(query.get('duration_ms', [active.stream_duration_ms])[0],
+                                   STREAM_MAX_DURATION_MS, 'duration_ms')
+    chunk_size = min(parse_size(str(query.get('chunk_size', [active.stream_chunk_size])[0])), len(PAYLOAD_CHUNK))
+    count = int(duration_ms // interval_ms) + 1 if interval_ms > 0 else 1
+    if query.get('format', ['sse'])[0] == 'raw':
+        return 'application/octet-stream', Stream(PAYLOAD_CHUNK[:chunk_size].tobytes(), count, interval_ms / 1000)
+    token = (b'tok ' * (chunk_size // 4 + 1))[:chunk_size]
+    return 'text/event-stream', Stream(b'data: ' + token + b'\n\n', count, interval_ms / 1000)
+
+
+def send_stream(wfile, stream, chunked, complete=True):
+    """Write a stream with blocking sleeps, returns the seconds spent sleeping"""
+    frame = stream.frame(chunked)
+    slept = 0.0
+    for i in range(stream.count):
+        if i:
+            sleep_start = time.perf_counter()
+            time.sleep(stream.interval)
+            slept += time.perf_counter() - sleep_start
+        wfile.write(frame)
+    if chunked and complete:
+        wfile.write(CHUNKED_TERMINATOR)
+    return slept
+
+
+async def send_stream_async(writer, stream, chunked, complete=True):
+    """Write a stream on the asyncio engine, returns the seconds spent sleeping"""
+    frame = stream.frame(chunked)
+    slept = 0.0
+    for i in range(stream.count):
+        if i:
+            sleep_start = time.perf_counter()
+            await asyncio.sleep(stream.interval)
+            slept += time.perf_counter() - sleep_start
+        writer.write(frame)
+        await writer.drain()
+    if chunked and complete:
+        writer.write(CHUNKED_TERMINATOR)
+    return slept
+
+
+# Fault codes stored in FaultPlan tables; 0 means no fault
+FAULTS = ('error', 'reset', 'truncate', 'hang', 'slow')
+FAULT_ERROR, FAULT_RESET, FAULT_TRUNCATE, FAULT_HANG, FAULT_SLOW = range(1, len(FAULTS) + 1)
+
+
+def parse_faults(spec):
+    """Parse fault rates: 'reset:0.01,hang:0.002' or an already parsed dict"""
+    if isinstance(spec, dict):
+        items = spec.items()
+    else:
+        items = [part.split(':', 1) for part in spec.split(',') if part.strip()]
+    rates = {}
+    for item in items:
+        if len(item) != 2:
+            raise ValueError(f"Invalid fault {':'.join(item)!r}, expected name:rate")
+        name, rate = item[0].strip().lower(), float(item[1])
+        if name not in FAULTS:
+            raise ValueError(f"Unknown fault {name!r}, expected one of {', '.join(FAULTS)}")
+        if not 0 <= rate <= 1:
+            raise ValueError(f"Fault rate for {name} must be between 0 and 1")
+        rates[name] = rate
+    if sum(rates.values()) > 1:
+        raise ValueError("Fault rates add up to more than 1")
+    return rates
+
+
+class FaultPlan:
+    """
+    Pre-drawn fault decisions, consumed in request order
+    
+    The table is generated once from a seeded RNG, so each worker replays the
+    same fault sequence for the same seed and settings; per request the cost
+    is a counter step and a table lookup.
+    """
+    
+    def __init__(self, rates, seed, hang_ms, slow_bytes, slow_interval_ms, table_size=65536):
+        names = [name for name in FAULTS if rates.get(name)]
+        cum_rates = list(itertools.accumulate(rates[name] for name in names))
+        codes = [FAULTS.index(name) + 1 for name in names]
+        rng = random.Random(seed)
+        table = bytearray(table_size)
+        for i in range(table_size):
+            slot = bisect.bisect(cum_rates, rng.random())
+            if slot < len(codes):
+                table[i] = codes[slot]
+        self.table = bytes(table)
+        self.counter = itertools.count()
+        self.hang = hang_ms / 1000.0
+        self.slow_bytes = max(1, int(slow_bytes))
+        self.slow_interval = slow_interval_ms / 1000.0
+        self.description = ', '.join(f"{name} {rates[name] * 100:g}%" for name in names)
+    
+    def next(self):
+        """Fault code for the next request"""
+        return self.table[next(self.counter) % len(self.table)]
+
+
+def pick_fault(active, path):
+    """Draw the fault for one request from the active plan (which must be set)"""
+    fault = active.faults.next()
+    if fault:
+        log(f"💥 Injecting fault: {FAULTS[fault - 1]} on {path}")
+    return fault
+
+
+def truncate_body(body):
+    """First half of a response body, sent before the connection is reset"""
+    if isinstance(body, Payload):
+        return Payload(body.size // 2)
+    if isinstance(body, Stream):
+        return Stream(body.chunk, body.count // 2, body.interval)
+    return body[:len(body) // 2]
+
+
+def reset_connection(sock):
+    """Abort a connection with a TCP RST instead of an orderly FIN"""
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+    sock.close()
+
+
+class SlowWriter:
+    """Slowloris-style writer: passes data on a few bytes at a time with pauses in between"""
+    
+    def __init__(self, wfile, plan):
+        self.wfile = wfile
+        self.plan = plan
+        self.started = False
+    
+    def write(self, data):
+        view = memoryview(data)
+        for i in range(0, len(view), self.plan.slow_bytes):
+            if self.started:
+                time.sleep(self.plan.slow_interval)
+            self.started = True
+            self.wfile.write(view[i:i + self.plan.slow_bytes])
+        return len(view)
+    
+    def flush(self):
+        self.wfile.flush()
+
+
+class SlowStreamWriter:
+    """SlowWriter for the asyncio engine: write() queues data, drain() trickles it out"""
+    
+    def __init__(self, writer, plan):
+        self.writer = writer
+        self.plan = plan
+        self.pending = []
+        self.started = False
+    
+    def write(self, data):
+        self.pending.append(data)
+    
+    async def drain(self):
+        pending, self.pending = self.pending, []
+        for data in pending:
+            view = memoryview(data)
+            for i in range(0, len(view), self.plan.slow_bytes):
+                if self.started:
+                    await asyncio.sleep(self.plan.slow_interval)
+                self.started = True
+                self.writer.write(view[i:i + self.plan.slow_bytes])
+                await self.writer.drain()
+
+
+# Burn lengths (ms) measured at startup; short bursts pay relatively more loop overhead
+BURN_CALIBRATION_MS = (0.1, 1, 10)
+BURN_CALIBRATION_ROUNDS = 5
+
+# Iterations per ms for each BURN_CALIBRATION_MS entry, filled by calibrate_burn()
+burn_table = array('d', [20000.0] * len(BURN_CALIBRATION_MS))
+
+
+def burn_loop(iterations):
+    """CPU work: an integer LCG that the interpreter cannot skip"""
+    x = 1
+    for _ in range(iterations):
+        x = (x * 1103515245 + 12345) & 0x7fffffff
+    return x
+
+
+def calibrate_burn():
+    """
+    Measure this instance's iterations per ms of burn_loop() into burn_table
+    
+    Uses thread CPU time, so a preempted round does not skew the rate; each
+    entry is the median over BURN_CALIBRATION_ROUNDS rounds.
+    """
+    # Rough rate first, to size the measured rounds
+    iterations = 10000
+    started = time.thread_time_ns()
+    burn_loop(iterations)
+    rate = iterations / max((time.thread_time_ns() - started) / 1e6, 1e-3)
+    for slot, burn_ms in enumerate(BURN_CALIBRATION_MS):
+        iterations = max(1, int(rate * burn_ms))
+        rates = []
+        for _ in range(BURN_CALIBRATION_ROUNDS):
+            started = time.thread_time_ns()
+            burn_loop(iterations)
+            rates.append(iterations / max((time.thread_time_ns() - started) / 1e6, 1e-3))
+        burn_table[slot] = sorted(rates)[len(rates) // 2]
+
+
+def burn_cpu(burn_ms):
+    """Spend about burn_ms of CPU time (more wall time when the CPU is contended)"""
+    slot = max(0, bisect.bisect_right(BURN_CALIBRATION_MS, burn_ms) - 1)
+    burn_loop(int(burn_ms * burn_table[slot]))
+
+
+def checked_delay_ms(value, max_ms, name='latency'):
+    """
+    A requested delay in ms, capped at max_ms
+    
+    Raises:
+        ValueError: not a number, not finite or negative (sleep() and the CPU burn reject them)
+    """
+    delay_ms = float(value)
+    if not math.isfinite(delay_ms) or delay_ms < 0:
+        raise ValueError(f"{name} must be a finite, non-negative number of ms (got {value!r})")
+    return min(delay_ms, max_ms)
+
+
+class SimulatorConfig:
+    """Immutable snapshot of the runtime settings, swapped as a whole on update"""
+    
+    def __init__(self, settings, version=0):
+        self.settings = settings
+        self.version = version
+        self.latency_ms = int(settings['latency_ms'])
+        self.distribution = build_distribution(
+            settings['distribution'], self.latency_ms, settings.get('options', {})
+        )
+        self.error_rate = float(settings.get('error_rate', 0))
+        self.error_status = int(settings.get('error_status', 503))
+        # Injected delays are capped like the distribution's samples (LATENCY_MAX_MS)
+        self.max_latency_ms = float(settings.get('options', {}).get('max_ms', 60000))
+        self.path_latency_ms = {
+            path: checked_delay_ms(ms, self.max_latency_ms, f"path_latency_ms['{path}']")
+            for path, ms in settings.get('path_latency_ms', {}).items()
+        }
+        if not 0 <= self.error_rate <= 1:
+            raise ValueError("error_rate must be between 0 and 1")
+        if not 100 <= self.error_status <= 599:
+            raise ValueError("error_status must be an HTTP status code (100-599)")
+        
+        # ERROR_RATE is the 'error' fault unless FAULTS sets it explicitly
+        fault_rates = parse_faults(settings.get('faults', ''))
+        if self.error_rate and 'error' not in fault_rates:
+            fault_rates['error'] = self.error_rate
+        self.faults = None
+        if any(fault_rates.values()):
+            self.faults = FaultPlan(
+                parse_faults(fault_rates), int(settings.get('fault_seed', 1)),
+                float(settings.get('fault_hang_ms', 60000)),
+                int(settings.get('fault_slow_bytes', 16)),
+                float(settings.get('fault_slow_interval_ms', 500)),
+            )
+        
+        self.schedule = None
+        if settings.get('schedule'):
+            self.schedule = parse_schedule(settings['schedule'])
+        elif settings.get('trace_file'):
+            self.schedule = load_trace(settings['trace_file'], float(settings.get('trace_speed', 1)))
+        self.schedule_start = settings.get('schedule_start', 0.0)
+        self.schedule_segment = -1
+        
+        # Share of each injected delay spent burning CPU instead of sleeping
+        self.burn_ratio = float(settings.get('burn_ratio', 0))
+        if not 0 <= self.burn_ratio <= 1:
+            raise ValueError("burn_ratio must be between 0 and 1")
+        
+        # Downstream calls made by every simulated request, DOWNSTREAM_FANOUT spread round-robin
+        urls = settings.get('downstream_urls', '')
+        if isinstance(urls, str):
+            urls = [url.strip() for url in urls.split(',') if url.strip()]
+        targets = [urllib.parse.urlsplit(url) for url in urls]
+        for target in targets:
+            if target.scheme not in ('http', 'https') or not target.netloc:
+                raise ValueError(f"Invalid downstream URL '{target.geturl()}'")
+        fanout = int(settings.get('downstream_fanout', 0)) or len(targets)
+        self.downstream_targets = [targets[i % len(targets)] for i in range(fanout)] if targets else []
+        self.downstream_timeout = float(settings.get('downstream_timeout_ms', 10000)) / 1000
+        self.downstream_max_hops = int(settings.get('downstream_max_hops', 8))
+        
+        self.payload_sizes, self.payload_weights = parse_size_distribution(
+            str(settings.get('payload_size', '1k'))
+        )
+        self.payload_max = parse_size(str(settings.get('payload_max', '1g')))
+        
+        self.stream_interval_ms = checked_delay_ms(settings.get('stream_interval_ms', 100),
+                                                   self.max_latency_ms, 'stream_interval_ms')
+        self.stream_duration_ms = checked_delay_ms(settings.get('stream_duration_ms', 10000),
+                                                   STREAM_MAX_DURATION_MS, 'stream_duration_ms')
+        self.stream_chunk_size = settings.get('stream_chunk_size', '64')
+
+
+def settings_from_env():
+    """Initial runtime settings from the environment"""
+    return {
+        'latency_ms': int(os.getenv('LATENCY_MS', '100')),
+        'distribution': os.getenv('LATENCY_DIST', 'uniform').lower(),
+        'options': distribution_options_from_env(),
+        'error_rate': float(os.getenv('ERROR_RATE', '0')),
+        'error_status': int(os.getenv('ERROR_STATUS', '503')),
+        'faults': os.getenv('FAULTS', ''),
+        'fault_seed': int(os.getenv('FAULT_SEED', '1')),
+        'fault_hang_ms': float(os.getenv('FAULT_HANG_MS', '60000')),
+        'fault_slow_bytes': int(os.getenv('FAULT_SLOW_BYTES', '16')),
+        'fault_slow_interval_ms': float(os.getenv('FAULT_SLOW_INTERVAL_MS', '500')),
+        'path_latency_ms': {},
+        'burn_ratio': float(os.getenv('BURN_RATIO', '0')),
+        'downstream_urls': os.getenv('DOWNSTREAM_URLS', ''),
+        'downstream_fanout': int(os.getenv('DOWNSTREAM_FANOUT', '0')),
+        'downstream_timeout_ms': float(os.getenv('DOWNSTREAM_TIMEOUT_MS', '10000')),
+        'downstream_max_hops': int(os.getenv('DOWNSTREAM_MAX_HOPS', '8')),
+        'payload_size': os.getenv('PAYLOAD_SIZE', '1k'),
+        'payload_max': os.getenv('PAYLOAD_MAX_BYTES', '1g'),
+        'stream_interval_ms': float(os.getenv('STREAM_INTERVAL_MS', '100')),
+        'stream_duration_ms': float(os.getenv('STREAM_DURATION_MS', '10000')),
+        'stream_chunk_size': os.getenv('STREAM_CHUNK_SIZE', '64'),
+        'schedule': os.getenv('LATENCY_SCHEDULE', ''),
+        'trace_file': os.getenv('LATENCY_TRACE_FILE', ''),
+        'trace_speed': float(os.getenv('LATENCY_TRACE_SPEED', '1')),
+        # CLOCK_MONOTONIC is system-wide, so every worker process shares this origin
+        'schedule_start': time.monotonic(),
+    }
+
+
+class SharedConfigStore:
+    """
+    Runtime settings as JSON in shared memory
+    
+    Created before the worker pool forks, so an admin update received by any
+    worker is seen by all of them. Workers compare the version counter on each
+    request and rebuild their local SimulatorConfig only when it changed.
+    """
+    
+    def __init__(self, settings, size=256 * 1024):
+        self.lock = multiprocessing.RLock()
+        self.version = multiprocessing.RawValue('Q', 0)
+        self.length = multiprocessing.RawValue('I', 0)
+        self.buffer = multiprocessing.RawArray('c', size)
+        self.publish(settings)
+    
+    def publish(self, settings):
+        """Store new settings and bump the version"""
+        data = json.dumps(settings).encode('utf-8')
+        if len(data) > len(self.buffer):
+            raise ValueError(f"Settings too large ({len(data)} bytes)")
+        with self.lock:
+            self.buffer[:len(data)] = data
+            self.length.value = len(data)
+            self.version.value += 1
+            return self.version.value
+    
+    def read(self):
+        """Return (version, settings)"""
+        with self.lock:
+            return self.version.value, json.loads(self.buffer[:self.length.value])
+
+
+# Shared settings and this process's active config, set up by run_server()
+config_store = None
+config = SimulatorConfig({'latency_ms': 100, 'distribution': 'uniform', 'options': {'table_size': 1024}})
+config_rebuild_lock = threading.Lock()
+
+
+def current_config():
+    """Return the active config, rebuilding it if another worker published an update"""
+    global config
+    if config_store is not None and config_store.version.value != config.version:
+        with config_rebuild_lock:
+            if config_store.version.value != config.version:
+                version, settings = config_store.read()
+                config = SimulatorConfig(settings, version)
+    return config
+
+
+def update_config(changes):
+    """Merge changes into the shared settings, validating them first"""
+    global config
+    # Hold the shared lock across read-modify-publish so concurrent admin calls
+    # on different workers cannot lose each other's changes
+    with config_rebuild_lock, config_store.lock:
+        _, settings = config_store.read()
+        for key, value in changes.items():
+            if key == 'options':
+                settings['options'] = {**settings.get('options', {}), **value}
+            elif key in settings:
+                settings[key] = value
+            else:
+                raise ValueError(f"Unknown setting '{key}'")
+        if {'schedule', 'trace_file', 'trace_speed'} & changes.keys():
+            # A new schedule starts from its first segment
+            settings['schedule_start'] = time.monotonic()
+        # Building the config validates the distribution before other workers see it
+        candidate = SimulatorConfig(settings)
+        candidate.version = config_store.publish(settings)
+        config = candidate
+    return config
+
+
+def admin_response(method, path, headers, body):
+    """
+    Handle /admin/* requests, returns None for every other path
+    
+    Requires SIM_ADMIN_TOKEN, sent as 'Authorization: Bearer <token>' or 'X-Admin-Token'.
+    """
+    route = path.split('?', 1)[0]
+    if not route.startswith('/admin/'):
+        return None
+    
+    token = os.getenv('SIM_ADMIN_TOKEN')
+    if not token or config_store is None:
+        return 404, None, b''
+    supplied = headers.get('x-admin-token') or ''
+    authorization = headers.get('authorization') or ''
+    if authorization.startswith('Bearer '):
+        supplied = authorization[len('Bearer '):]
+    if not hmac.compare_digest(supplied.encode(), token.encode()):
+        return 401, 'application/json', b'{"error": "unauthorized"}'
+    
+    if route != '/admin/config':
+        return 404, None, b''
+    
+    if method == 'POST':
+        try:
+            changes = json.loads(body or b'{}')
+            if not isinstance(changes, dict):
+                raise ValueError("Body must be a JSON object")
+            updated = update_config(changes)
+        except (ValueError, TypeError, KeyError, OSError) as e:
+            return 400, 'application/json', json.dumps({'error': str(e)}).encode('utf-8')
+        log(f"🔧 Config updated (version {updated.version}): {json.dumps(changes)}")
+    
+    active = current_config()
+    response = {
+        'version': active.version,
+        'settings': active.settings,
+        'distribution': active.distribution.description,
+    }
+    return 200, 'application/json', json.dumps(response, indent=4).encode('utf-8')
+
+
+def pick_latency(path, headers):
+    """
+    Choose the delay for one request
+    
+    Precedence: X-Sim-Latency header (ms), ?ttfb_ms= on /stream, per-path override,
+    then the distribution (scaled to the schedule's current target when a schedule is active).
+    An invalid header (negative, nan, inf) is ignored; delays are capped at LATENCY_MAX_MS.
+    
+    Returns:
+        (config, target latency in ms, actual delay in seconds)
+    """
+    active = current_config()
+    header_ms = headers.get('x-sim-latency')
+    if header_ms:
+        try:
+            latency_ms = checked_delay_ms(header_ms, active.max_latency_ms, 'X-Sim-Latency')
+            return active, latency_ms, latency_ms / 1000.0
+        except ValueError:
+            pass
+    
+    route, _, query = path.partition('?')
+    if route == '/stream' and 'ttfb_ms=' in query:
+        try:
+            ttfb_ms = urllib.parse.parse_qs(query)['ttfb_ms'][0]
+        except KeyError:
+            pass
+        else:
+            try:
+                latency_ms = checked_delay_ms(ttfb_ms, active.max_latency_ms, 'ttfb_ms')
+            except ValueError:
+                # No delay: build_stream() answers 400 for it
+                return active, 0, 0.0
+            return active, latency_ms, latency_ms / 1000.0
+    
+    if route in active.path_latency_ms:
+        latency_ms = active.path_latency_ms[route]
+        return active, latency_ms, latency_ms / 1000.0
+    
+    if active.schedule is None:
+        return active, active.latency_ms, active.distribution.draw() / 1000.0
+    
+    segment, target_ms = active.schedule.evaluate(time.monotonic() - active.schedule_start)
+    if segment != active.schedule_segment:
+        active.schedule_segment = segment
+        if segment < len(active.schedule.segments):
+            log(f"📈 Schedule segment {segment + 1}/{len(active.schedule.segments)}: target {target_ms:.0f}ms")
+        else:
+            log(f"📈 Schedule finished: holding {target_ms:.0f}ms")
+    # Keep the distribution's shape, centred on the scheduled target
+    scale = target_ms / active.latency_ms if active.latency_ms else 0
+    sample_ms = active.distribution.draw() * scale if scale else target_ms
+    return active, round(target_ms), sample_ms / 1000.0
+
+
+# HDR-style log-linear buckets over microseconds: exact below 128us, then 64
+# sub-buckets per power of two (~1.6% precision) up to 2^36us (~19 hours)
+HIST_SUB_BITS = 7
+HIST_HALF = 1 << (HIST_SUB_BITS - 1)
+HIST_MAX_BITS = 36
+HIST_BUCKETS = (1 << HIST_SUB_BITS) + (HIST_MAX_BITS - HIST_SUB_BITS) * HIST_HALF
+HIST_MAX_US = (1 << HIST_MAX_BITS) - 1
+
+# Bucket boundaries (seconds) exported on /metrics
+PROMETHEUS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 3, 4, 5, 10, 30, 60)
+
+LATENCY_METRICS = {
+    'injected_delay': 'Delay injected by the simulator',
+    'handler_overhead': 'Server time spent outside the injected delay',
+    'queue_delay': 'Time from accepting a connection to handling its first request',
+    'request_duration': 'Total time from handling start to response written, concurrency wait excluded',
+    'concurrency_wait': 'Time spent waiting for a free concurrency slot (SIM_CONCURRENCY)',
+    'downstream_call': 'Duration of each downstream call (DOWNSTREAM_URLS)',
+}
+
+
+def histogram_index(value_us):
+    """Bucket index for a value in microseconds"""
+    if value_us < (1 << HIST_SUB_BITS):
+        return value_us
+    shift = value_us.bit_length() - HIST_SUB_BITS
+    return (1 << HIST_SUB_BITS) + (shift - 1) * HIST_HALF + (value_us >> shift) - HIST_HALF
+
+
+def histogram_bounds(index):
+    """(lowest, highest) microsecond value counted in a bucket"""
+    if index < (1 << HIST_SUB_BITS):
+        return index, index
+    offset = index - (1 << HIST_SUB_BITS)
+    shift = offset // HIST_HALF + 1
+    lowest = (offset % HIST_HALF + HIST_HALF) << shift
+    return lowest, lowest + (1 << shift) - 1
+
+
+class LatencyHistograms:
+    """
+    Per-worker latency histograms in shared memory
+    
+    Allocated before the worker pool forks. Each worker only writes its own
+    slice, so no lock is shared between processes; within a worker the
+    threaded engine's handler threads take that slot's lock, since += on a
+    RawArray element is a read and a write that threads can interleave.
+    Readers merge all slices by summing.
+    """
+    
+    def __init__(self, workers):
+        self.workers = workers
+        self.names = list(LATENCY_METRICS)
+        self.positions = {name: i for i, name in enumerate(self.names)}
+        self.counts = multiprocessing.RawArray('Q', workers * len(self.names) * HIST_BUCKETS)
+        self.sums = multiprocessing.RawArray('d', workers * len(self.names))
+        # Forked with the arrays: each worker process ends up with its own copies
+        self.locks = [threading.Lock() for _ in range(workers)]
+    
+    def record(self, worker, metric, seconds):
+        """Record one value for a metric name"""
+        slot = worker * len(self.names) + self.positions[metric]
+        value_us = min(HIST_MAX_US, max(0, int(seconds * 1000000)))
+        index = slot * HIST_BUCKETS + histogram_index(value_us)
+        with self.locks[worker]:
+            self.counts[index] += 1
+            self.sums[slot] += seconds
+    
+    def merged(self, metric):
+        """Return (bucket counts, sum of seconds) merged across workers"""
+        metric_index = self.positions[metric]
+        counts = [0] * HIST_BUCKETS
+        total = 0.0
+        for worker in range(self.workers):
+            slot = worker * len(self.names) + metric_index
+            for i, count in enumerate(self.counts[slot * HIST_BUCKETS:(slot + 1) * HIST_BUCKETS]):
+                if count:
+                    counts[i] += count
+            total += self.sums[slot]
+        return counts, total
+
+
+def histogram_percentiles(counts, quantiles):
+    """Values (seconds) at the given quantiles (0-1) of merged bucket counts"""
+    total = sum(counts)
+    results = {}
+    if not total:
+        return {q: 0.0 for q in quantiles}
+    targets = sorted(quantiles)
+    seen = 0
+    position = 0
+    for index, count in enumerate(counts):
+        if not count:
+            continue
+        seen += count
+        while position < len(targets) and seen >= targets[position] * total:
+            lowest, highest = histogram_bounds(index)
+            results[targets[position]] = (lowest + highest) / 2 / 1000000
+            position += 1
+        if position == len(targets):
+            break
+    return results
+
+
+# Shared histograms and this process's slice, set up by run_server() / serve()
+histograms = None
+worker_index = 0
+
+
+def record_request(queue_seconds, injected_seconds, total_seconds, concurrency_seconds=0.0):
+    """
+    Record the timings of one simulated request
+    
+    The concurrency wait is recorded on its own (record_concurrency_wait), so
+    it is taken out of the total to keep handler_overhead the server's own time.
+    """
+    if histograms is None:
+        return
+    total_seconds -= concurrency_seconds
+    if queue_seconds is not None:
+        histograms.record(worker_index, 'queue_delay', queue_seconds)
+    histograms.record(worker_index, 'injected_delay', injected_seconds)
+    histograms.record(worker_index, 'handler_overhead', max(0.0, total_seconds - injected_seconds))
+    histograms.record(worker_index, 'request_duration', total_seconds)
+
+
+def record_concurrency_wait(seconds):
+    """Record the time one request waited for a concurrency slot"""
+    if histograms is not None:
+        histograms.record(worker_index, 'concurrency_wait', seconds)
+
+
+def metrics_response(path):
+    """
+    Serve /metrics (Prometheus text) and /metrics/json, returns None for other paths
+    """
+    route = path.split('?', 1)[0]
+    if route not in ('/metrics', '/metrics/json') or histograms is None:
+        return None
+    
+    if route == '/metrics/json':
+        quantiles = (0.5, 0.9, 0.95, 0.99, 0.999)
+        report = {'workers': histograms.workers}
+        if concurrency_gauges is not None:
+            report['concurrency'] = concurrency_snapshot()
+        for name in LATENCY_METRICS:
+            counts, total = histograms.merged(name)
+            count = sum(counts)
+            values = histogram_percentiles(counts, quantiles + (1.0,))
+            report[name] = {
+                'count': count,
+                'mean_ms': round(total / count * 1000, 3) if count else 0.0,
+                **{f"p{q * 100:g}_ms": round(values[q] * 1000, 3) for q in quantiles},
+                'max_ms': round(values[1.0] * 1000, 3),
+            }
+        return 200, 'application/json', json.dumps(report, indent=4).encode('utf-8')
+    
+    lines = []
+    for name, description in LATENCY_METRICS.items():
+        metric = f"latency_simulator_{name}_seconds"
+        counts, total = histograms.merged(name)
+        lines.append(f"# HELP {metric} {description}.")
+        lines.append(f"# TYPE {metric} histogram")
+        cumulative = 0
+        index = 0
+        for bound in PROMETHEUS_BUCKETS:
+            bound_us = bound * 1000000
+            while index < HIST_BUCKETS and histogram_bounds(index)[1] <= bound_us:
+                cumulative += counts[index]
+                index += 1
+            lines.append(f'{metric}_bucket{{le="{bound:g}"}} {cumulative}')
+        count = sum(counts)
+        lines.append(f'{metric}_bucket{{le="+Inf"}} {count}')
+        lines.append(f"{metric}_sum {total:.6f}")
+        lines.append(f"{metric}_count {count}")
+    if concurrency_gauges is not None:
+        snapshot = concurrency_snapshot()
+        for name, kind, description in CONCURRENCY_METRICS:
+            metric = f"latency_simulator_concurrency_{name}"
+            lines.append(f"# HELP {metric} {description}.")
+            lines.append(f"# TYPE {metric} {kind}")
+            lines.append(f"{metric} {snapshot[name]}")
+    body = ('\n'.join(lines) + '\n').encode('utf-8')
+    return 200, 'text/plain; version=0.0.4; charset=utf-8', body
+
+
+# Per-worker gauges, in the order of CONCURRENCY_METRICS after 'limit'
+CONCURRENCY_METRICS = (
+    ('limit', 'gauge', 'Concurrent requests allowed (SIM_CONCURRENCY)'),
+    ('in_service', 'gauge', 'Requests holding a concurrency slot'),
+    ('queued', 'gauge', 'Requests waiting for a concurrency slot'),
+    ('rejected_total', 'counter', 'Requests rejected because the queue was full'),
+    ('timed_out_total', 'counter', 'Requests rejected after waiting SIM_QUEUE_TIMEOUT_MS'),
+)
+GAUGE_IN_SERVICE, GAUGE_QUEUED, GAUGE_REJECTED, GAUGE_TIMED_OUT = range(4)
+
+# Shared gauges (4 per worker) and this process's limiter, set up by run_server() / serve()
+concurrency_gauges = None
+concurrency_limit = 0
+limiter = None
+
+
+def concurrency_snapshot():
+    """Concurrency gauges summed across workers"""
+    snapshot = {'limit': concurrency_limit}
+    for position, (name, _, _) in enumerate(CONCURRENCY_METRICS[1:]):
+        snapshot[name] = sum(concurrency_gauges[position::4])
+    return snapshot
+
+
+class ConcurrencyLimiter:
+    """
+    Cloud Run containerConcurrency emulation for the threaded engines
+    
+    At most `limit` requests are in service; up to `queue_limit` more wait
+    for a slot (for at most `queue_timeout` seconds), the rest are rejected.
+    """
+    
+    def __init__(self, limit, queue_limit, queue_timeout, overload_status, gauge_base):
+        self.limit = limit
+        self.queue_limit = queue_limit
+        self.queue_timeout = queue_timeout
+        self.overload_status = overload_status
+        self.gauge_base = gauge_base
+        self.in_service = 0
+        self.queued = 0
+        self.condition = threading.Condition()
+    
+    def update_gauges(self):
+        concurrency_gauges[self.gauge_base + GAUGE_IN_SERVICE] = self.in_service
+        concurrency_gauges[self.gauge_base + GAUGE_QUEUED] = self.queued
+    
+    def acquire(self):
+        """Take a slot, returns None when admitted or the HTTP status to reject with"""
+        with self.condition:
+            if self.in_service >= self.limit:
+                if self.queued >= self.queue_limit:
+                    concurrency_gauges[self.gauge_base + GAUGE_REJECTED] += 1
+                    return self.overload_status
+                self.queued += 1
+                self.update_gauges()
+                admitted = self.condition.wait_for(
+                    lambda: self.in_service < self.limit, self.queue_timeout
+                )
+                self.queued -= 1
+                if not admitted:
+                    concurrency_gauges[self.gauge_base + GAUGE_TIMED_OUT] += 1
+                    self.update_gauges()
+                    return 503
+            self.in_service += 1
+            self.update_gauges()
+            return None
+    
+    def release(self):
+        with self.condition:
+            self.in_service -= 1
+            self.update_gauges()
+            self.condition.notify()
+
+
+class AsyncConcurrencyLimiter(ConcurrencyLimiter):
+    """ConcurrencyLimiter for the asyncio engine, waiters are admitted in FIFO order"""
+    
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.waiters = collections.deque()
+    
+    async def acquire(self):
+        if self.in_service < self.limit and not self.waiters:
+            self.in_service += 1
+            self.update_gauges()
+            return None
+        if len(self.waiters) >= self.queue_limit:
+            concurrency_gauges[self.gauge_base + GAUGE_REJECTED] += 1
+            return self.overload_status
+        
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        self.queued = len(self.waiters)
+        self.update_gauges()
+        try:
+            # release() hands its slot straight to the waiter
+            await asyncio.wait_for(waiter, self.queue_timeout)
+            return None
+        except asyncio.TimeoutError:
+            concurrency_gauges[self.gauge_base + GAUGE_TIMED_OUT] += 1
+            return 503
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+            self.queued = len(self.waiters)
+            self.update_gauges()
+    
+    def release(self):
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_service -= 1
+        self.update_gauges()
+
+
+def overload_response(status):
+    """Rejection sent when no concurrency slot is available"""
+    body = f'{{"status": "error", "code": {status}, "error": "no available concurrency slot"}}'
+    return status, 'application/json', body.encode('utf-8')
+
+
+def create_limiter(limiter_class):
+    """Build this worker's share of the SIM_CONCURRENCY limit"""
+    workers = len(concurrency_gauges) // 4
+    # SO_REUSEPORT spreads connections, so each worker enforces its share; the
+    # remainder goes to the first workers so the shares add up to the limit
+    # (run_server() keeps at most one worker per slot, so no share is 0)
+    share = concurrency_limit // workers + (1 if worker_index < concurrency_limit % workers else 0)
+    return limiter_class(
+        share,
+        int(os.getenv('SIM_QUEUE_LIMIT', '1000')),
+        float(os.getenv('SIM_QUEUE_TIMEOUT_MS', '10000')) / 1000,
+        int(os.getenv('SIM_OVERLOAD_STATUS', '429')),
+        worker_index * 4,
+    )
+
+
+class ConnectionPool:
+    """Keep-alive HTTP connections to downstream hosts, shared by all requests of a worker"""
+    
+    def __init__(self, max_idle):
+        self.max_idle = max_idle
+        self.idle = collections.defaultdict(list)
+        self.lock = threading.Lock()
+    
+    def request(self, target, headers, timeout):
+        """
+        GET a downstream URL (urlsplit result), reusing an idle connection if there is one
+        
+        Returns:
+            (status code, whether the connection was reused)
+        """
+        key = (target.scheme, target.netloc)
+        path = (target.path or '/') + (f"?{target.query}" if target.query else '')
+        with self.lock:
+            conn = self.idle[key].pop() if self.idle[key] else None
+        reused = conn is not None
+        while True:
+            if conn is None:
+                conn_class = http.client.HTTPSConnection if target.scheme == 'https' else http.client.HTTPConnection
+                conn = conn_class(target.netloc, timeout=timeout)
+            else:
+                conn.timeout = timeout
+                conn.sock.settimeout(timeout)
+            try:
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+                response.read()
+            except ConnectionError:
+                # RemoteDisconnected, ConnectionResetError, BrokenPipeError...
+                conn.close()
+                if not reused:
+                    raise
+                # The server closed or reset the idle keep-alive connection, retry once on a new one
+                conn, reused = None, False
+                continue
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                raise
+            break
+        
+        if not response.will_close:
+            with self.lock:
+                if len(self.idle[key]) < self.max_idle:
+                    self.idle[key].append(conn)
+                    conn = None
+        if conn is not None:
+            conn.close()
+        return response.status, reused
+
+
+# This worker's downstream connection pool and call threads, set up by serve()
+downstream_pool = None
+downstream_executor = None
+
+
+def downstream_hop(headers, active):
+    """Hop number for calls made by this request, None past DOWNSTREAM_MAX_HOPS (call loops)"""
+    try:
+        hop = int(headers.get('x-sim-hop') or 0) + 1
+    except ValueError:
+        hop = 1
+    if hop > active.downstream_max_hops:
+        log(f"⚠️  Skipping downstream calls: hop {hop} exceeds {active.downstream_max_hops}")
+        return None
+    return hop
+
+
+def call_downstream(target, hop, timeout):
+    """
+    One downstream call, run on the downstream executor
+    
+    Returns:
+        (url, status code or 0 on connection failure, seconds, connection reused)
+    """
+    start = time.perf_counter()
+    try:
+        status, reused = downstream_pool.request(target, {'X-Sim-Hop': str(hop)}, timeout)
+    except (OSError, http.client.HTTPException):
+        status, reused = 0, False
+    seconds = time.perf_counter() - start
+    if histograms is not None:
+        histograms.record(worker_index, 'downstream_call', seconds)
+    return target.geturl(), status, seconds, reused
+
+
+def fan_out(active, headers):
+    """Call every downstream target in parallel and wait, returns per-hop results or None"""
+    hop = downstream_hop(headers, active)
+    if hop is None:
+        return None
+    futures = [
+        downstream_executor.submit(call_downstream, target, hop, active.downstream_timeout)
+        for target in active.downstream_targets
+    ]
+    return [future.result() for future in futures]
+
+
+async def fan_out_async(active, headers):
+    """fan_out() for the asyncio engine"""
+    hop = downstream_hop(headers, active)
+    if hop is None:
+        return None
+    loop = asyncio.get_running_loop()
+    return await asyncio.gather(*(
+        loop.run_in_executor(downstream_executor, call_downstream, target, hop, active.downstream_timeout)
+        for target in active.downstream_targets
+    ))
+
+
+def server_timing(hops):
+    """Server-Timing header value with one entry per downstream call"""
+    return ', '.join(
+        f'hop{i};dur={seconds * 1000:.1f};desc="{url} {status}{" reused" if reused else ""}"'
+        for i, (url, status, seconds, reused) in enumerate(hops)
+    )
+
+
+def hops_json(hops):
+    """Downstream call results as a JSON list"""
+    return json.dumps([
+        {'url': url, 'status': status, 'duration_ms': round(seconds * 1000, 2), 'reused': reused}
+        for url, status, seconds, reused in hops
+    ]).encode('utf-8')
+
+
+class CompiledTemplate:
+    """
+    str.format template pre-rendered into bytes at startup
+    
+    Static fields are substituted once; rendering only formats the dynamic
+    fields and joins them with the pre-encoded literal chunks.
+    """
+    
+    def __init__(self, template, **static):
+        self.head = b''
+        self.slots = []  # (field name, format spec, literal bytes that follow)
+        for literal, field, spec, _ in string.Formatter().parse(template):
+            chunk = literal.encode('utf-8')
+            if field in static:
+                chunk += format(static[field], spec).encode('utf-8')
+                field = None
+            if self.slots:
+                name, field_spec, following = self.slots[-1]
+                self.slots[-1] = (name, field_spec, following + chunk)
+            else:
+                self.head += chunk
+            if field is not None:
+                self.slots.append((field, spec, b''))
+    
+    def render(self, **values):
+        """Return the template bytes with the dynamic fields filled in"""
+        parts = [self.head]
+        for field, spec, following in self.slots:
+            parts.append(format(values[field], spec).encode('utf-8'))
+            parts.append(following)
+        return b''.join(parts)
+
+
+DASHBOARD_TEMPLATE = """
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <title>Latency Simulator - {target_latency}ms</title>
+            <meta charset="utf-8">
+            <meta http-equiv="refresh" content="5">
+            <style>
+                body {{
+                    font-family: 'Segoe UI', Arial, sans-serif;
+                    max-width: 900px;
+                    margin: 50px auto;
+                    padding: 20px;
+                    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+                    color: white;
+                }}
+                .container {{
+                    background: rgba(255, 255, 255, 0.1);
+                    backdrop-filter: blur(10px);
+                    border-radius: 20px;
+                    padding: 40px;
+                    box-shadow: 0 8px 32px 0 rgba(31, 38, 135, 0.37);
+                }}
+                h1 {{
+                    font-size: 2.5em;
+                    margin-bottom: 10px;
+                    text-shadow: 2px 2px 4px rgba(0,0,0,0.3);
+                }}
+                .status {{
+                    background: rgba(76, 175, 80, 0.3);
+                    padding: 15px;
+                    border-radius: 10px;
+                    margin: 20px 0;
+                    border: 2px solid #4CAF50;
+                }}
+                .metric {{
+                    background: rgba(255, 255, 255, 0.2);
+                    padding: 20px;
+                    margin: 15px 0;
+                    border-radius: 10px;
+                    border-left: 5px solid #FFC107;
+                }}
+                .metric-label {{
+                    font-size: 0.9em;
+                    opacity: 0.8;
+                    margin-bottom: 5px;
+                }}
+                .metric-value {{
+                    font-size: 2em;
+                    font-weight: bold;
+                    color: #FFC107;
+                }}
+                .info {{
+                    font-size: 0.9em;
+                    opacity: 0.8;
+                    margin-top: 30px;
+                    text-align: center;
+                }}
+                .timestamp {{
+                    text-align: center;
+                    font-size: 0.9em;
+                    opacity: 0.7;
+                    margin-top: 20px;
+                }}
+            </style>
+        </head>
+        <body>
+            <div class="container">
+                <h1>🚀 Latency Simulator</h1>
+                
+                <div class="status">
+                    <h2>✅ Service is running</h2>
+                    <p>Hostname: {hostname}</p>
+                    <p>Port: {port}</p>
+                </div>
+                
+                <div class="metric">
+                    <div class="metric-label">Target Latency</div>
+                    <div class="metric-value">{target_latency} ms</div>
+                </div>
+                
+                <div class="metric">
+                    <div class="metric-label">Actual Response Time</div>
+                    <div class="metric-value">{response_time_ms:.2f} ms</div>
+                </div>
+                
+                <div class="metric">
+                    <div class="metric-label">Latency Distribution</div>
+                    <div class="metric-value">{distribution}</div>
+                </div>
+                
+                <div class="info">
+                    <p>💡 This page auto-refreshes every 5 seconds</p>
+                    <p>🔧 Configure latency via LATENCY_MS environment variable</p>
+                </div>
+                
+                <div class="timestamp">
+                    {timestamp}
+                </div>
+            </div>
+        </body>
+        </html>
+        """
+
+# Hostname and port never change while serving, so they are baked in
+dashboard = CompiledTemplate(
+    DASHBOARD_TEMPLATE, hostname=socket.gethostname(), port=os.getenv('PORT', '8080')
+)
+
+API_TEST_PREFIX = b'{\n    "status": "ok",\n    "target_latency_ms": '
+API_TEST_RESPONSE_TIME = b',\n    "actual_response_time_ms": '
+API_TEST_TIMESTAMP = b',\n    "timestamp": "'
+API_TEST_SUFFIX = b'"\n}'
+API_TEST_DOWNSTREAM = b'",\n    "downstream": '
+API_TEST_END = b'\n}'
+
+_timestamp_cache = (0, '')
+
+
+def dashboard_timestamp():
+    """Wall-clock 'YYYY-mm-dd HH:MM:SS', formatted at most once per second"""
+    global _timestamp_cache
+    now = int(time.time())
+    if _timestamp_cache[0] != now:
+        _timestamp_cache = (now, datetime.fromtimestamp(now).strftime('%Y-%m-%d %H:%M:%S'))
+    return _timestamp_cache[1]
+
+
+def render_response(path, start_time, active, latency_ms, fault=0, downstream=None):
+    """
+    Build the response for a request once its latency has elapsed
+    
+    Returns:
+        (status code, content type or None, body bytes)
+    """
+    if fault == FAULT_ERROR:
+        status = active.error_status
+        return status, 'application/json', f'{{"status": "error", "code": {status}}}'.encode('utf-8')
+    if downstream and any(status == 0 or status >= 500 for _, status, _, _ in downstream):
+        # A failed downstream call fails the request, like a real service would
+        return 502, 'application/json', b''.join((
+            b'{"status": "error", "code": 502, "downstream": ', hops_json(downstream), b'}'
+        ))
+    
+    route = path.split('?', 1)[0]
+    if route == '/health' or route == '/':
+        # Calculate actual response time
+        response_time_ms = (time.perf_counter() - start_time) * 1000
+        
+        html = dashboard.render(
+            target_latency=latency_ms,
+            response_time_ms=response_time_ms,
+            distribution=active.distribution.description,
+            timestamp=dashboard_timestamp(),
+        )
+        return 200, 'text/html; charset=utf-8', html
+    
+    elif route == '/api/test':
+        # Simple JSON endpoint for testing
+        response_time_ms = (time.perf_counter() - start_time) * 1000
+        
+        response = b''.join((
+            API_TEST_PREFIX, str(latency_ms).encode(),
+            API_TEST_RESPONSE_TIME, f"{response_time_ms:.2f}".encode(),
+            API_TEST_TIMESTAMP, datetime.now().isoformat().encode(),
+            API_TEST_DOWNSTREAM + hops_json(downstream) + API_TEST_END if downstream else API_TEST_SUFFIX,
+        ))
+        return 200, 'application/json', response
+    
+    elif route == '/payload':
+        # Body size from ?size= or the configured size distribution
+        query = urllib.parse.parse_qs(path.partition('?')[2])
+        if 'size' in query:
+            try:
+                size = parse_size(query['size'][0])
+            except ValueError:
+                return 400, 'application/json', b'{"error": "invalid size"}'
+        else:
+            size = random.choices(active.payload_sizes, cum_weights=active.payload_weights)[0]
+        return 200, 'application/octet-stream', Payload(min(size, active.payload_max))
+    
+    elif route == '/stream':
+        # Headers go out once the injected latency (time to first byte) has elapsed
+        try:
+            content_type, stream = build_stream(urllib.parse.parse_qs(path.partition('?')[2]), active)
+        except ValueError:
+            return 400, 'application/json', b'{"error": "invalid stream parameters"}'
+        return 200, content_type, stream
+    
+    return 404, None, b''
+
 
 class LatencyHandler(BaseHTTPRequestHandler):
     """HTTP handler that simulates network latency"""
     
+    # Connection handling, overridden by configure_connections()
+    protocol_version = 'HTTP/1.0'
+    timeout = 620
+    max_requests = 0
+    disable_nagle_algorithm = True
+    
+    def setup(self):
+        super().setup()
+        self.requests_served = 0
+    
     def log_message(self, format, *args):
         """Custom logging with timestamp"""
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        print(f"[{timestamp}] {format % args}")
+        log(format % args)
     
     def do_GET(self):
         """Handle GET requests with configurable latency"""
-        start_time = time.time()
-        
-        # Get latency from environment variable (in milliseconds)
-        latency_ms = int(os.getenv('LATENCY_MS', '100'))
-        latency_seconds = latency_ms / 1000.0
-        
-        # Add some variance to make it more realistic (±10%)
-        variance = random.uniform(-0.1, 0.1)
-        actual_latency = latency_seconds * (1 + variance)
+        self.handle_simulated(b'')
+    
+    def do_POST(self):
+        """Handle POST requests with latency"""
+        # Always read the request body so the next request on the connection parses cleanly
+        length = int(self.headers.get('Content-Length') or 0)
+        self.handle_simulated(self.rfile.read(length) if length else b'')
+    
+    def handle_simulated(self, request_body):
+        """Apply the simulated latency and send the response"""
+        start_time = time.perf_counter()
+        queue_seconds = None
+        if self.requests_served == 0:
+            accepted_at = getattr(self.client_address, 'accepted_at', None)
+            queue_seconds = start_time - accepted_at if accepted_at else None
         
-        # Simulate latency
-        time.sleep(actual_latency)
+        response = (
+            metrics_response(self.path)
+            or admin_response(self.command, self.path, self.headers, request_body)
+        )
+        slot_held = False
+        concurrency_seconds = 0.0
+        if response is None and limiter is not None:
+            wait_start = time.perf_counter()
+            rejected = limiter.acquire()
+            concurrency_seconds = time.perf_counter() - wait_start
+            record_concurrency_wait(concurrency_seconds)
+            if rejected:
+                response = overload_response(rejected)
+            else:
+                slot_held = True
         
-        if self.path == '/health' or self.path == '/':
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html; charset=utf-8')
-            self.end_headers()
+        try:
+            self.send_simulated(response, start_time, queue_seconds, concurrency_seconds)
+        finally:
+            if slot_held:
+                limiter.release()
+    
+    def send_simulated(self, response, start_time, queue_seconds, concurrency_seconds=0.0):
+        """Inject latency (and faults) if no response was decided yet, then send it"""
+        injected_seconds = None
+        fault = 0
+        timing = None
+        if response is None:
+            active, latency_ms, actual_latency = pick_latency(self.path, self.headers)
+            burn_ms = actual_latency * active.burn_ratio * 1000
+            actual_latency -= burn_ms / 1000
+            if active.faults is not None:
+                fault = pick_fault(active, self.path)
+                if fault == FAULT_HANG:
+                    actual_latency += active.faults.hang
             
-            # Calculate actual response time
-            response_time_ms = (time.time() - start_time) * 1000
+            downstream = None
+            if active.downstream_targets:
+                downstream = fan_out(active, self.headers)
             
-            # Get configuration
-            target_latency = os.getenv('LATENCY_MS', '100')
-            port = os.getenv('PORT', '8080')
-            hostname = socket.gethostname()
+            # Simulate latency, optionally as CPU work
+            sleep_start = time.perf_counter()
+            if burn_ms:
+                burn_cpu(burn_ms)
+            time.sleep(actual_latency)
+            injected_seconds = time.perf_counter() - sleep_start
             
-            html = f"""
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <title>Latency Simulator - {target_latency}ms</title>
-                <meta charset="utf-8">
-                <meta http-equiv="refresh" content="5">
-                <style>
-                    body {{
-                        font-family: 'Segoe UI', Arial, sans-serif;
-                        max-width: 900px;
-                        margin: 50px auto;
-                        padding: 20px;
-                        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                        color: white;
-                    }}
-                    .container {{
-                        background: rgba(255, 255, 255, 0.1);
-                        backdrop-filter: blur(10px);
-                        border-radius: 20px;
-                        padding: 40px;
-                        box-shadow: 0 8px 32px 0 rgba(31, 38, 135, 0.37);
-                    }}
-                    h1 {{
-                        font-size: 2.5em;
-                        margin-bottom: 10px;
-                        text-shadow: 2px 2px 4px rgba(0,0,0,0.3);
-                    }}
-                    .status {{
-                        background: rgba(76, 175, 80, 0.3);
-                        padding: 15px;
-                        border-radius: 10px;
-                        margin: 20px 0;
-                        border: 2px solid #4CAF50;
-                    }}
-                    .metric {{
-                        background: rgba(255, 255, 255, 0.2);
-                        padding: 20px;
-                        margin: 15px 0;
-                        border-radius: 10px;
-                        border-left: 5px solid #FFC107;
-                    }}
-                    .metric-label {{
-                        font-size: 0.9em;
-                        opacity: 0.8;
-                        margin-bottom: 5px;
-                    }}
-                    .metric-value {{
-                        font-size: 2em;
-                        font-weight: bold;
-                        color: #FFC107;
-                    }}
-                    .info {{
-                        font-size: 0.9em;
-                        opacity: 0.8;
-                        margin-top: 30px;
-                        text-align: center;
-                    }}
-                    .timestamp {{
-                        text-align: center;
-                        font-size: 0.9em;
-                        opacity: 0.7;
-                        margin-top: 20px;
-                    }}
-                </style>
-            </head>
-            <body>
-                <div class="container">
-                    <h1>🚀 Latency Simulator</h1>
-                    
-                    <div class="status">
-                        <h2>✅ Service is running</h2>
-                        <p>Hostname: {hostname}</p>
-                        <p>Port: {port}</p>
-                    </div>
-                    
-                    <div class="metric">
-                        <div class="metric-label">Target Latency</div>
-                        <div class="metric-value">{target_latency} ms</div>
-                    </div>
-                    
-                    <div class="metric">
-                        <div class="metric-label">Actual Response Time</div>
-                        <div class="metric-value">{response_time_ms:.2f} ms</div>
-                    </div>
+            if fault == FAULT_RESET:
+                self.abort_connection()
+                record_request(queue_seconds, injected_seconds, time.perf_counter() - start_time,
+                               concurrency_seconds)
+                return
+            response = render_response(self.path, start_time, active, latency_ms, fault, downstream)
+            if downstream:
+                timing = server_timing(downstream)
+        
+        status, content_type, body = response
+        self.requests_served += 1
+        self.send_response(status)
+        if content_type:
+            self.send_header('Content-type', content_type)
+        if timing:
+            self.send_header('Server-Timing', timing)
+        chunked = False
+        if isinstance(body, Stream):
+            self.send_header('Cache-Control', 'no-cache')
+            chunked = self.request_version == 'HTTP/1.1' and self.protocol_version == 'HTTP/1.1'
+            if chunked:
+                self.send_header('Transfer-Encoding', 'chunked')
+            else:
+                # HTTP/1.0 streams are delimited by closing the connection
+                self.send_header('Connection', 'close')
+        else:
+            self.send_header('Content-Length', str(len(body)))
+        if self.max_requests and self.requests_served >= self.max_requests:
+            # Sending this header also sets self.close_connection
+            self.send_header('Connection', 'close')
+        wfile = self.wfile
+        if fault == FAULT_SLOW:
+            self.wfile = SlowWriter(wfile, active.faults)
+        try:
+            self.end_headers()
+            if fault == FAULT_TRUNCATE:
+                body = truncate_body(body)
+            if isinstance(body, Payload) and fault == FAULT_SLOW:
+                # Through SlowWriter: send_payload() writes to the socket directly
+                for chunk in payload_chunks(body.size):
+                    self.wfile.write(chunk)
+            elif isinstance(body, Payload):
+                send_payload(self.connection, body.size)
+            elif isinstance(body, Stream):
+                injected_seconds += send_stream(self.wfile, body, chunked, fault != FAULT_TRUNCATE)
+            else:
+                self.wfile.write(body)
+        except ConnectionError:
+            self.close_connection = True
+            return
+        finally:
+            self.wfile = wfile
+        if fault == FAULT_TRUNCATE:
+            self.abort_connection()
+        
+        if injected_seconds is not None:
+            record_request(queue_seconds, injected_seconds, time.perf_counter() - start_time,
+                           concurrency_seconds)
+    
+    def abort_connection(self):
+        """Reset the connection, closing the buffered reader first so the RST goes out now"""
+        self.close_connection = True
+        self.rfile.close()
+        reset_connection(self.connection)
+
+def configure_connections(keepalive, idle_timeout, max_requests):
+    """Apply persistent-connection settings to every engine"""
+    LatencyHandler.protocol_version = 'HTTP/1.1' if keepalive else 'HTTP/1.0'
+    LatencyHandler.timeout = idle_timeout
+    LatencyHandler.max_requests = max_requests
+
+
+class AcceptedAddress(tuple):
+    """Client address tuple that also carries the accept timestamp"""
+    accepted_at = None
+
+
+class AcceptTimestampMixIn:
+    """Stamp each accepted connection so handlers can measure queueing delay"""
+    
+    def get_request(self):
+        request, client_address = super().get_request()
+        client_address = AcceptedAddress(client_address)
+        client_address.accepted_at = time.perf_counter()
+        return request, client_address
+
+
+class SimulatorHTTPServer(AcceptTimestampMixIn, HTTPServer):
+    """Single-threaded server (legacy engine)"""
+    request_queue_size = LISTEN_BACKLOG
+    allow_reuse_port = True
+
+
+class ThreadedSimulatorHTTPServer(AcceptTimestampMixIn, ThreadingHTTPServer):
+    """Thread-per-connection server, delayed requests never block each other"""
+    request_queue_size = LISTEN_BACKLOG
+    allow_reuse_port = True
+    daemon_threads = True
+
+
+async def read_request(reader):
+    """
+    Read one request head from the stream
+    
+    Returns:
+        (request line, headers dict with lower-case names), request line is '' on EOF
+    """
+    request_line = (await reader.readline()).decode('latin-1').rstrip('\r\n')
+    headers = {}
+    if not request_line:
+        return request_line, headers
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return request_line, headers
+
+
+def reason_phrase(status):
+    """Reason phrase of a status line; empty for codes HTTPStatus does not know (420, 599), like the threaded engine"""
+    try:
+        return HTTPStatus(status).phrase
+    except ValueError:
+        return ''
+
+
+def wants_keepalive(version, headers):
+    """Apply HTTP/1.0 and HTTP/1.1 persistent-connection defaults"""
+    connection = headers.get('connection', '').lower()
+    if version == 'HTTP/1.1':
+        return connection != 'close'
+    return connection == 'keep-alive'
+
+
+async def handle_connection(reader, writer):
+    """Serve the requests of one connection on the asyncio engine"""
+    peer = writer.get_extra_info('peername')
+    keepalive = LatencyHandler.protocol_version == 'HTTP/1.1'
+    requests_served = 0
+    accepted_at = time.perf_counter()
+    try:
+        while True:
+            try:
+                request_line, headers = await asyncio.wait_for(
+                    read_request(reader), LatencyHandler.timeout
+                )
+            except asyncio.TimeoutError:
+                break
+            if not request_line:
+                break
+            
+            parts = request_line.split()
+            keep_open = False
+            injected_seconds = None
+            slot_held = False
+            concurrency_seconds = 0.0
+            fault = 0
+            downstream = None
+            if len(parts) != 3:
+                status, content_type, body = 400, None, b''
+            elif parts[0] not in ('GET', 'POST'):
+                status, content_type, body = 501, None, b''
+            else:
+                # Always read the request body so the next request parses cleanly
+                length = int(headers.get('content-length', '0') or 0)
+                request_body = await reader.readexactly(length) if length else b''
+                
+                start_time = time.perf_counter()
+                queue_seconds = start_time - accepted_at if requests_served == 0 else None
+                response = (
+                    metrics_response(parts[1])
+                    or admin_response(parts[0], parts[1], headers, request_body)
+                )
+                if response is None and limiter is not None:
+                    wait_start = time.perf_counter()
+                    rejected = await limiter.acquire()
+                    concurrency_seconds = time.perf_counter() - wait_start
+                    record_concurrency_wait(concurrency_seconds)
+                    if rejected:
+                        response = overload_response(rejected)
+                    else:
+                        slot_held = True
+                if response is None:
+                    active, latency_ms, actual_latency = pick_latency(parts[1], headers)
+                    burn_ms = actual_latency * active.burn_ratio * 1000
+                    actual_latency -= burn_ms / 1000
+                    if active.faults is not None:
+                        fault = pick_fault(active, parts[1])
+                        if fault == FAULT_HANG:
+                            actual_latency += active.faults.hang
                     
-                    <div class="metric">
-                        <div class="metric-label">Latency Variance</div>
-                        <div class="metric-value">±10%</div>
-                    </div>
+                    if active.downstream_targets:
+                        downstream = await fan_out_async(active, headers)
                     
-                    <div class="info">
-                        <p>💡 This page auto-refreshes every 5 seconds</p>
-                        <p>🔧 Configure latency via LATENCY_MS environment variable</p>
-                    </div>
+                    # Simulate latency without blocking other requests; CPU work
+                    # runs on the executor so the loop keeps accepting connections
+                    sleep_start = time.perf_counter()
+                    if burn_ms:
+                        await asyncio.get_running_loop().run_in_executor(None, burn_cpu, burn_ms)
+                    await asyncio.sleep(actual_latency)
+                    injected_seconds = time.perf_counter() - sleep_start
                     
-                    <div class="timestamp">
-                        {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-                    </div>
-                </div>
-            </body>
-            </html>
-            """
-            
-            self.wfile.write(html.encode('utf-8'))
-            
-        elif self.path == '/api/test':
-            # Simple JSON endpoint for testing
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
+                    if fault == FAULT_RESET:
+                        if slot_held:
+                            limiter.release()
+                        record_request(queue_seconds, injected_seconds, time.perf_counter() - start_time,
+                                       concurrency_seconds)
+                        abort_connection(writer)
+                        break
+                    response = render_response(parts[1], start_time, active, latency_ms, fault, downstream)
+                status, content_type, body = response
+                requests_served += 1
+                keep_open = keepalive and wants_keepalive(parts[2], headers)
+                if LatencyHandler.max_requests and requests_served >= LatencyHandler.max_requests:
+                    keep_open = False
             
-            response_time_ms = (time.time() - start_time) * 1000
-            
-            response = f"""{{
-    "status": "ok",
-    "target_latency_ms": {latency_ms},
-    "actual_response_time_ms": {response_time_ms:.2f},
-    "timestamp": "{datetime.now().isoformat()}"
-}}"""
-            
-            self.wfile.write(response.encode('utf-8'))
+            chunked = isinstance(body, Stream) and keepalive and parts[2] == 'HTTP/1.1'
+            if isinstance(body, Stream) and not chunked:
+                # HTTP/1.0 streams are delimited by closing the connection
+                keep_open = False
+            head = [
+                f"HTTP/1.1 {status} {reason_phrase(status)}",
+                "Server: LatencySimulator",
+                f"Date: {formatdate(usegmt=True)}",
+                f"Connection: {'keep-alive' if keep_open else 'close'}",
+            ]
+            if isinstance(body, Stream):
+                head.append("Cache-Control: no-cache")
+                if chunked:
+                    head.append("Transfer-Encoding: chunked")
+            else:
+                head.append(f"Content-Length: {len(body)}")
+            if content_type:
+                head.append(f"Content-type: {content_type}")
+            if downstream:
+                head.append(f"Server-Timing: {server_timing(downstream)}")
+            head_bytes = ('\r\n'.join(head) + '\r\n\r\n').encode('latin-1')
+            body_size = '-' if isinstance(body, Stream) else len(body)
+            try:
+                out = writer
+                if fault == FAULT_SLOW:
+                    out = SlowStreamWriter(writer, active.faults)
+                elif fault == FAULT_TRUNCATE:
+                    body = truncate_body(body)
+                if isinstance(body, Payload) and fault == FAULT_SLOW:
+                    # Through SlowStreamWriter: sendfile() would bypass it
+                    out.write(head_bytes)
+                    for chunk in payload_chunks(body.size):
+                        out.write(chunk)
+                        await out.drain()
+                elif isinstance(body, Payload):
+                    writer.write(head_bytes)
+                    await send_payload_async(writer, body.size)
+                elif isinstance(body, Stream):
+                    out.write(head_bytes)
+                    injected_seconds += await send_stream_async(out, body, chunked, fault != FAULT_TRUNCATE)
+                else:
+                    out.write(head_bytes + body)
+                await out.drain()
+            finally:
+                if slot_held:
+                    limiter.release()
+            if injected_seconds is not None:
+                record_request(queue_seconds, injected_seconds, time.perf_counter() - start_time,
+                               concurrency_seconds)
+            log(f'{peer[0] if peer else "-"} "{request_line}" {status} {body_size}')
             
+            if fault == FAULT_TRUNCATE:
+                abort_connection(writer)
+                break
+            if not keep_open:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+def abort_connection(writer):
+    """Reset an asyncio connection with a TCP RST"""
+    writer.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+    writer.transport.abort()
+
+
+async def serve_asyncio(port, reuse_port):
+    """Run the asyncio engine until cancelled"""
+    global limiter
+    if concurrency_limit:
+        limiter = create_limiter(AsyncConcurrencyLimiter)
+    server = await asyncio.start_server(
+        handle_connection, host='', port=port,
+        backlog=LISTEN_BACKLOG, reuse_port=reuse_port
+    )
+    async with server:
+        await server.serve_forever()
+
+
+def serve(engine, port, reuse_port=False, index=0):
+    """Run one engine instance in the current process"""
+    global worker_index, limiter, downstream_pool, downstream_executor
+    worker_index = index
+    pool_size = int(os.getenv('DOWNSTREAM_POOL_SIZE', '64'))
+    downstream_pool = ConnectionPool(pool_size)
+    downstream_executor = concurrent.futures.ThreadPoolExecutor(pool_size, thread_name_prefix='downstream')
+    try:
+        if engine == 'asyncio':
+            asyncio.run(serve_asyncio(port, reuse_port))
+            return
+        
+        if engine == 'threaded':
+            threading.stack_size(THREAD_STACK_SIZE)
+            server_class = ThreadedSimulatorHTTPServer
         else:
-            self.send_response(404)
-            self.end_headers()
-    
-    def do_POST(self):
-        """Handle POST requests with latency"""
-        self.do_GET()
+            server_class = SimulatorHTTPServer
+        
+        if concurrency_limit:
+            limiter = create_limiter(ConcurrencyLimiter)
+        server_class.allow_reuse_port = reuse_port
+        httpd = server_class(('', port), LatencyHandler)
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
 
 def run_server():
     """Start HTTP server"""
     port = int(os.getenv('PORT', '8080'))
-    latency_ms = os.getenv('LATENCY_MS', '100')
+    global config, config_store, histograms, concurrency_gauges, concurrency_limit
+    settings = settings_from_env()
+    config_store = SharedConfigStore(settings)
+    config = SimulatorConfig(settings, config_store.version.value)
+    distribution = config.distribution
+    latency_ms = config.latency_ms
+    engine = os.getenv('SIM_ENGINE', 'threaded').lower()
+    workers = max(1, int(os.getenv('SIM_WORKERS', '1')))
+    keepalive = os.getenv('SIM_KEEPALIVE', 'true').lower() in ('1', 'true', 'yes')
+    idle_timeout = float(os.getenv('SIM_IDLE_TIMEOUT', '620'))
+    max_requests = int(os.getenv('SIM_MAX_REQUESTS_PER_CONN', '0'))
+    
+    if engine not in ENGINES:
+        raise SystemExit(f"❌ Unknown SIM_ENGINE '{engine}' (expected one of: {', '.join(ENGINES)})")
     
-    server_address = ('', port)
-    httpd = HTTPServer(server_address, LatencyHandler)
+    if engine == 'single' and keepalive:
+        # One idle persistent connection would block every other client
+        log("⚠️  Keep-alive disabled for the single engine")
+        keepalive = False
+    
+    configure_connections(keepalive, idle_timeout, max_requests)
+    concurrency_limit = int(os.getenv('SIM_CONCURRENCY', '0'))
+    if 0 < concurrency_limit < workers:
+        # A worker needs a slot of its own, or its connections could never be served
+        log(f"⚠️  SIM_CONCURRENCY={concurrency_limit} is below SIM_WORKERS={workers}, "
+            f"running {concurrency_limit} worker(s)")
+        workers = concurrency_limit
+    histograms = LatencyHistograms(workers)
+    if concurrency_limit:
+        concurrency_gauges = multiprocessing.RawArray('q', workers * 4)
+    if os.getenv('PAYLOAD_FILE'):
+        open_payload_file(os.getenv('PAYLOAD_FILE'))
+    # Calibrated even when BURN_RATIO=0, since the admin API can enable it later
+    calibrate_burn()
     
     print("=" * 60)
     print(f"🚀 Latency Simulator Started")
     print(f"📊 Target Latency: {latency_ms}ms")
+    print(f"🎲 Distribution: {distribution.description} "
+          f"(p50={distribution.percentile(50):.0f}ms, p95={distribution.percentile(95):.0f}ms, "
+          f"p99={distribution.percentile(99):.0f}ms)")
+    print(f"⚙️  Engine: {engine} x {workers} worker(s)")
+    if concurrency_limit:
+        print(f"🚦 Concurrency: {concurrency_limit} per instance, queue "
+              f"{os.getenv('SIM_QUEUE_LIMIT', '1000')} / {os.getenv('SIM_QUEUE_TIMEOUT_MS', '10000')}ms, "
+              f"overload → HTTP {os.getenv('SIM_OVERLOAD_STATUS', '429')}")
+    if config.downstream_targets:
+        print(f"🔀 Downstream: {len(config.downstream_targets)} parallel call(s) per request to "
+              f"{', '.join(sorted({target.geturl() for target in config.downstream_targets}))}")
+    if config.burn_ratio:
+        print(f"🔥 CPU burn: {config.burn_ratio * 100:g}% of each delay "
+              f"(calibrated {burn_table[1]:,.0f} iterations/ms)")
+    if config.faults is not None:
+        print(f"💥 Faults: {config.faults.description} (seed {config.settings['fault_seed']})")
+    print(f"🔗 Keep-alive: {'on' if keepalive else 'off'} (idle timeout {idle_timeout:g}s, "
+          f"max requests/conn {max_requests or 'unlimited'})")
     print(f"🌐 Server running on http://0.0.0.0:{port}")
     print(f"🏥 Health check: http://0.0.0.0:{port}/health")
+    if config.schedule:
+        print(f"📈 Schedule: {config.schedule.description} ({config.schedule.total:g}s"
+              f"{', repeating' if config.schedule.repeat else ''})")
+    if os.getenv('SIM_ADMIN_TOKEN'):
+        print(f"🔧 Admin API: http://0.0.0.0:{port}/admin/config")
     print(f"📡 API endpoint: http://0.0.0.0:{port}/api/test")
+    print(f"📦 Payload: http://0.0.0.0:{port}/payload?size=10m "
+          f"(default {config.settings['payload_size']}, "
+          f"{'sendfile ' + os.getenv('PAYLOAD_FILE') if payload_file else 'shared buffer'})")
+    print(f"🌊 Stream: http://0.0.0.0:{port}/stream?ttfb_ms=500&interval_ms=100&duration_ms=10000")
+    print(f"📏 Metrics: http://0.0.0.0:{port}/metrics (JSON: /metrics/json)")
     print(f"⏰ Started at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print("=" * 60)
     
-    try:
-        httpd.serve_forever()
-    except KeyboardInterrupt:
+    if workers == 1:
+        serve(engine, port)
         print("\n\n🛑 Server stopped by user")
-        httpd.shutdown()
+        return
+    
+    # Multi-process pool: every worker binds its own listening socket and the
+    # kernel load-balances new connections across them (SO_REUSEPORT)
+    processes = []
+    for i in range(workers):
+        p = multiprocessing.Process(target=serve, args=(engine, port, True, i), daemon=True)
+        p.start()
+        processes.append(p)
+        log(f"Started worker {i+1}/{workers} (PID: {p.pid})")
+    
+    def stop_workers(signum, frame):
+        # Containers are stopped with SIGTERM: take the workers down too, or
+        # they keep serving the port after the parent is gone
+        log(f"🛑 {signal.Signals(signum).name} received, stopping {len(processes)} worker(s)")
+        for p in processes:
+            p.terminate()
+        for p in processes:
+            p.join()
+        sys.exit(0)
+    
+    # Installed after forking, so the workers keep the default SIGTERM action
+    signal.signal(signal.SIGTERM, stop_workers)
+    signal.signal(signal.SIGINT, stop_workers)
+    for p in processes:
+        p.join()
 
 if __name__ == '__main__':
     run_server()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Mergeable HDR-style latency histogram for the load tooling
+Log-linear buckets over microseconds: exact below 256us, then 128 sub-buckets
+per power of two (~0.8% precision) up to 2^36us (~19 hours). Histograms from
+different workers, hosts or runs add up bucket by bucket, and serialize to a
+compact sparse encoding.
+
+Usage:
+  python3 histogram.py merge run1.hist run2.hist   # merged percentiles of saved runs
+"""
+import struct
+import sys
+from array import array
+
+HIST_SUB_BITS = 8
+HIST_HALF = 1 << (HIST_SUB_BITS - 1)
+HIST_MAX_BITS = 36
+HIST_BUCKETS = (1 << HIST_SUB_BITS) + (HIST_MAX_BITS - HIST_SUB_BITS) * HIST_HALF
+HIST_MAX_US = (1 << HIST_MAX_BITS) - 1
+
+# Encoding header: magic, sub-bucket bits, non-empty buckets, min, max, sum (us)
+ENCODING_MAGIC = b'LHG1'
+ENCODING_HEADER = struct.Struct('<4sBIQQQ')
+
+# Saved file: any number of (name length, name, encoded length, encoded histogram)
+FILE_ENTRY = struct.Struct('<HI')
+
+
+def histogram_index(value_us):
+    """Bucket index for a value in microseconds"""
+    if value_us < (1 << HIST_SUB_BITS):
+        return value_us
+    shift = value_us.bit_length() - HIST_SUB_BITS
+    return (1 << HIST_SUB_BITS) + (shift - 1) * HIST_HALF + (value_us >> shift) - HIST_HALF
+
+
+def histogram_bounds(index):
+    """(lowest, highest) microsecond value counted in a bucket"""
+    if index < (1 << HIST_SUB_BITS):
+        return index, index
+    offset = index - (1 << HIST_SUB_BITS)
+    shift = offset // HIST_HALF + 1
+    lowest = (offset % HIST_HALF + HIST_HALF) << shift
+    return lowest, lowest + (1 << shift) - 1
+
+
+def counts_percentiles(counts, total, quantiles):
+    """
+    Bucket midpoints (us) at the given quantiles (0-1) of bucket counts summing to total
+
+    counts is either dense (a sequence indexed by bucket) or sparse (a
+    {bucket index: count} mapping, such as a Counter).
+    """
+    results = {q: 0.0 for q in quantiles}
+    if not total:
+        return results
+    targets = sorted(quantiles)
+    seen = 0
+    position = 0
+    buckets = sorted(counts.items()) if isinstance(counts, dict) else enumerate(counts)
+    for index, count in buckets:
+        if not count:
+            continue
+        seen += count
+        while position < len(targets) and seen >= targets[position] * total:
+            lowest, highest = histogram_bounds(index)
+            results[targets[position]] = (lowest + highest) / 2
+            position += 1
+        if position == len(targets):
+            break
+    return results
+
+
+class LatencyHistogram:
+    """Latency counts per log-linear bucket, plus exact count, min, max and sum"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Drop every recorded value"""
+        self.counts = array('Q', bytes(8 * HIST_BUCKETS))
+        self.total = 0
+        self.min_us = 0
+        self.max_us = 0
+        self.sum_us = 0
+
+    def record(self, seconds):
+        """Record one latency"""
+        value_us = min(HIST_MAX_US, max(0, int(seconds * 1000000)))
+        self.counts[histogram_index(value_us)] += 1
+        if not self.total or value_us < self.min_us:
+            self.min_us = value_us
+        if value_us > self.max_us:
+            self.max_us = value_us
+        self.total += 1
+        self.sum_us += value_us
+
+    def merge(self, other):
+        """Add another histogram's counts into this one"""
+        if not other.total:
+            return self
+        counts = self.counts
+        for index, count in enumerate(other.counts):
+            if count:
+                counts[index] += count
+        if not self.total or other.min_us < self.min_us:
+            self.min_us = other.min_us
+        self.max_us = max(self.max_us, other.max_us)
+        self.total += other.total
+        self.sum_us += other.sum_us
+        return self
+
+    @property
+    def mean(self):
+        """Mean latency in seconds"""
+        return self.sum_us / self.total / 1000000 if self.total else 0.0
+
+    @property
+    def max(self):
+        """Exact largest latency in seconds"""
+        return self.max_us / 1000000
+
+    def percentiles(self, quantiles):
+        """Latencies (seconds) at the given quantiles (0-1)"""
+        values = counts_percentiles(self.counts, self.total, quantiles)
+        # Bucket midpoints, clamped to the exact extremes
+        return {
+            q: min(max(value_us, self.min_us), self.max_us) / 1000000 if self.total else 0.0
+            for q, value_us in values.items()
+        }
+
+    def percentile(self, q):
+        """Latency (seconds) at one quantile (0-1)"""
+        return self.percentiles((q,))[q]
+
+    def encode(self):
+        """Compact sparse encoding: only non-empty buckets are stored"""
+        indexes = array('I', (i for i, count in enumerate(self.counts) if count))
+        counts = array('Q', (self.counts[i] for i in indexes))
+        header = ENCODING_HEADER.pack(
+            ENCODING_MAGIC, HIST_SUB_BITS, len(indexes), self.min_us, self.max_us, self.sum_us
+        )
+        return header + indexes.tobytes() + counts.tobytes()
+
+    @classmethod
+    def decode(cls, data):
+        """Rebuild a histogram from encode() output"""
+        magic, sub_bits, buckets, min_us, max_us, sum_us = ENCODING_HEADER.unpack_from(data)
+        if magic != ENCODING_MAGIC or sub_bits != HIST_SUB_BITS:
+            raise ValueError("Not a latency histogram encoding")
+        offset = ENCODING_HEADER.size
+        indexes = array('I', data[offset:offset + 4 * buckets])
+        counts = array('Q', data[offset + 4 * buckets:offset + 12 * buckets])
+        if len(counts) != buckets:
+            raise ValueError("Truncated latency histogram encoding")
+        histogram = cls()
+        for index, count in zip(indexes, counts):
+            histogram.counts[index] = count
+        histogram.total = sum(counts)
+        histogram.min_us, histogram.max_us, histogram.sum_us = min_us, max_us, sum_us
+        return histogram
+
+
+def save_histograms(path, histograms):
+    """Write named histograms ({name: LatencyHistogram}) to a file"""
+    with open(path, 'wb') as f:
+        for name, histogram in histograms.items():
+            encoded_name = name.encode('utf-8')
+            encoded = histogram.encode()
+            f.write(FILE_ENTRY.pack(len(encoded_name), len(encoded)) + encoded_name + encoded)
+
+
+def load_histograms(path):
+    """Read a file written by save_histograms()"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    histograms = {}
+    offset = 0
+    while offset < len(data):
+        name_length, length = FILE_ENTRY.unpack_from(data, offset)
+        offset += FILE_ENTRY.size
+        name = data[offset:offset + name_length].decode('utf-8')
+        offset += name_length
+        histograms[name] = LatencyHistogram.decode(data[offset:offset + length])
+        offset += length
+    return histograms
+
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] != 'merge':
+        raise SystemExit(f"Usage: {sys.argv[0]} merge FILE [FILE ...]")
+    merged = {}
+    for path in sys.argv[2:]:
+        for name, histogram in load_histograms(path).items():
+            merged.setdefault(name, LatencyHistogram()).merge(histogram)
+    quantiles = (0.5, 0.9, 0.95, 0.99, 0.999)
+    for name, histogram in merged.items():
+        values = histogram.percentiles(quantiles)
+        print(f"{name}: {histogram.total} samples, mean {histogram.mean * 1000:.1f}ms, "
+              + ', '.join(f"p{q * 100:g} {values[q] * 1000:.1f}ms" for q in quantiles)
+              + f", max {histogram.max * 1000:.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Distributed driver for load_generator.py
+Splits the target rate across a pool of local generator processes and,
+optionally, agents on other hosts. Each worker streams histogram snapshots
+back over a framed TCP control channel; the coordinator merges them into one
+live progress line and one final summary.
+
+Usage:
+  python3 load_driver.py https://yourdomain.com/health --rate 20000 --processes 8
+
+  # On every extra load host (the token authenticates the coordinator)
+  LOAD_AGENT_TOKEN=s3cret python3 load_driver.py agent --listen 0.0.0.0:7700
+  # Coordinator
+  LOAD_AGENT_TOKEN=s3cret python3 load_driver.py https://yourdomain.com/health \
+      --rate 50000 --processes 4 --agents 10.0.0.2:7700,10.0.0.3:7700
+"""
+import argparse
+import asyncio
+import hmac
+import json
+import multiprocessing
+import os
+import socket
+import struct
+import sys
+import time
+
+from histogram import LatencyHistogram, save_histograms
+from load_generator import Results, build_parser, build_plan, generate, log, report_summary
+from scenario import load_scenario
+
+# Control frame: kind, payload length. Kinds: J job, S snapshot, D final snapshot, E error
+FRAME = struct.Struct('<cI')
+
+# Snapshot payload: JSON counters length, corrected and raw histogram lengths
+SNAPSHOT_HEADER = struct.Struct('<III')
+
+# Seconds between sending the jobs and the synchronized start
+START_DELAY = 1.0
+
+
+async def read_frame(reader):
+    """Read one control frame, returns (kind, payload)"""
+    kind, length = FRAME.unpack(await reader.readexactly(FRAME.size))
+    return kind, await reader.readexactly(length)
+
+
+def write_frame(writer, kind, payload):
+    writer.write(FRAME.pack(kind, len(payload)) + payload)
+
+
+def encode_snapshot(results, in_flight):
+    """
+    Counters plus cumulative corrected/raw histograms and the interval histogram
+
+    Sparse histogram encodings keep a snapshot to a few KB.
+    """
+    counters = json.dumps({
+        'sent': results.sent,
+        'in_flight': in_flight,
+        'statuses': results.statuses,
+        'errors': results.errors,
+        'bytes': results.bytes,
+        'connections': results.connections,
+        'send_seconds': results.send_seconds,
+        'elapsed': results.elapsed,
+    }).encode('utf-8')
+    corrected = results.corrected.encode()
+    raw = results.raw.encode()
+    return (SNAPSHOT_HEADER.pack(len(counters), len(corrected), len(raw))
+            + counters + corrected + raw + results.interval.encode())
+
+
+def decode_snapshot(data):
+    """Rebuild (Results, in-flight count) from encode_snapshot() output"""
+    counters_length, corrected_length, raw_length = SNAPSHOT_HEADER.unpack_from(data)
+    offset = SNAPSHOT_HEADER.size
+    counters = json.loads(data[offset:offset + counters_length])
+    offset += counters_length
+    results = Results()
+    results.corrected = LatencyHistogram.decode(data[offset:offset + corrected_length])
+    offset += corrected_length
+    results.raw = LatencyHistogram.decode(data[offset:offset + raw_length])
+    results.interval = LatencyHistogram.decode(data[offset + raw_length:])
+    results.statuses.update({int(status): count for status, count in counters['statuses'].items()})
+    results.errors.update(counters['errors'])
+    results.bytes = counters['bytes']
+    results.sent = counters['sent']
+    results.connections = counters['connections']
+    results.send_seconds = counters['send_seconds']
+    results.elapsed = counters['elapsed']
+    return results, counters['in_flight']
+
+
+async def serve_worker(reader, writer, token):
+    """Run one job received on a control connection, streaming snapshots back"""
+    kind, payload = await read_frame(reader)
+    job = json.loads(payload) if kind == b'J' else {}
+    if not hmac.compare_digest(str(job.pop('token', '')).encode(), token.encode()) or not job:
+        log("⛔ Rejected job: missing or wrong token")
+        write_frame(writer, b'E', b'unauthorized')
+        await writer.drain()
+        return
+
+    def on_report(results, in_flight, elapsed):
+        write_frame(writer, b'S', encode_snapshot(results, in_flight))
+        results.interval.reset()
+
+    log(f"🚀 Job: {job['url']} at {job['rate']:g} req/s for {job['duration']:g}s")
+    try:
+        args = argparse.Namespace(**job)
+        results = await generate(args, build_plan(args), on_report)
+    except ValueError as e:
+        write_frame(writer, b'E', str(e).encode('utf-8'))
+    else:
+        write_frame(writer, b'D', encode_snapshot(results, 0))
+        log(f"✅ Job done: {results.completed} completed")
+    await writer.drain()
+
+
+def local_worker(sock):
+    """Entry point of a local worker process, controlled over a socketpair"""
+    async def work():
+        reader, writer = await asyncio.open_connection(sock=sock)
+        try:
+            await serve_worker(reader, writer, '')
+        finally:
+            writer.close()
+
+    try:
+        asyncio.run(work())
+    except KeyboardInterrupt:
+        pass
+
+
+async def serve_agent(listen, token):
+    """Accept jobs from coordinators on other hosts"""
+    host, _, port = listen.rpartition(':')
+
+    async def handle(reader, writer):
+        peer = writer.get_extra_info('peername')
+        log(f"🔌 Coordinator connected from {peer[0] if peer else '-'}")
+        try:
+            await serve_worker(reader, writer, token)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            log("⚠️  Coordinator disconnected")
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host or '0.0.0.0', int(port))
+    log(f"🛰️  Load agent listening on {host or '0.0.0.0'}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+async def coordinate(args, local_socks):
+    """Send every worker its share of the rate, merge their snapshots and report"""
+    channels = []
+    for i, sock in enumerate(local_socks):
+        channels.append((f"local-{i + 1}", '', *await asyncio.open_connection(sock=sock)))
+    token = os.getenv('LOAD_AGENT_TOKEN', '')
+    for agent in args.agents:
+        host, _, port = agent.rpartition(':')
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, int(port)), 10)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise SystemExit(f"❌ Cannot reach agent {agent}: {e or 'timed out'}")
+        channels.append((agent, token, reader, writer))
+
+    workers = len(channels)
+    # Agents get the endpoints themselves, the scenario file may not exist on their host
+    try:
+        scenario = load_scenario(args.scenario) if args.scenario else None
+    except (OSError, ValueError) as e:
+        raise SystemExit(f"❌ {e}")
+    start_at = time.time() + START_DELAY
+    for i, (name, worker_token, _, writer) in enumerate(channels):
+        job = {
+            'url': args.url,
+            'rate': args.rate / workers,
+            'duration': args.duration,
+            'connections': args.connections,
+            'timeout': args.timeout,
+            'insecure': args.insecure,
+            'host': args.host,
+            'report_interval': args.report_interval,
+            'start_at': start_at,
+            # Interleave the workers' schedules so arrivals stay evenly spaced
+            'offset': i / args.rate,
+            'scenario': scenario,
+            # Each worker draws its own endpoint sequence
+            'seed': args.seed + i,
+            'token': worker_token,
+        }
+        write_frame(writer, b'J', json.dumps(job).encode('utf-8'))
+        await writer.drain()
+    log(f"🚀 {args.url}: {args.rate:g} req/s for {args.duration:g}s across {workers} worker(s) "
+        f"({', '.join(name for name, *_ in channels)})")
+
+    latest = [None] * workers
+    in_flight = [0] * workers
+    interval = LatencyHistogram()
+
+    async def follow(i):
+        name, _, reader, _ = channels[i]
+        try:
+            while True:
+                kind, payload = await read_frame(reader)
+                if kind == b'E':
+                    log(f"❌ {name}: {payload.decode('utf-8', 'replace')}")
+                    return latest[i]
+                results, in_flight[i] = decode_snapshot(payload)
+                interval.merge(results.interval)
+                latest[i] = results
+                if kind == b'D':
+                    return results
+        except (ConnectionError, asyncio.IncompleteReadError):
+            log(f"❌ {name}: connection lost, keeping its last snapshot")
+            return latest[i]
+
+    async def report():
+        next_report = start_at
+        while True:
+            next_report += args.report_interval
+            await asyncio.sleep(max(0.0, next_report - time.time()))
+            merged = Results()
+            for results in latest:
+                if results is not None:
+                    merged.merge(results)
+            window = interval.percentiles((0.5, 0.95))
+            log(f"📊 {time.time() - start_at:6.1f}s sent {merged.sent}, done {merged.completed}, "
+                f"in flight {sum(in_flight)}, errors {merged.failed} | interval p50 "
+                f"{window[0.5] * 1000:.0f}ms p95 {window[0.95] * 1000:.0f}ms max {interval.max * 1000:.0f}ms")
+            interval.reset()
+
+    reporter = asyncio.create_task(report())
+    finals = await asyncio.gather(*(follow(i) for i in range(workers)))
+    reporter.cancel()
+    for _, _, _, writer in channels:
+        writer.close()
+
+    total = Results()
+    for results in finals:
+        if results is not None:
+            total.merge(results)
+    lost = sum(1 for results in finals if results is None)
+    if lost:
+        log(f"⚠️  {lost} worker(s) reported nothing")
+    report_summary(total, args.threshold_ms)
+    if args.save_histograms:
+        save_histograms(args.save_histograms, {'corrected': total.corrected, 'raw': total.raw})
+        log(f"💾 Histograms saved to {args.save_histograms}")
+
+
+def agent_main(argv):
+    parser = argparse.ArgumentParser(description="Load agent: runs jobs sent by load_driver.py")
+    parser.add_argument('--listen', default='0.0.0.0:7700', help="Control address (default 0.0.0.0:7700)")
+    args = parser.parse_args(argv)
+    token = os.getenv('LOAD_AGENT_TOKEN')
+    if not token:
+        raise SystemExit("❌ LOAD_AGENT_TOKEN must be set, otherwise anyone could drive load through this host")
+    try:
+        asyncio.run(serve_agent(args.listen, token))
+    except KeyboardInterrupt:
+        print("\n\n🛑 Agent stopped by user")
+
+
+def main():
+    if sys.argv[1:2] == ['agent']:
+        agent_main(sys.argv[2:])
+        return
+
+    parser = build_parser("Distributed open-loop load driver")
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                        help="Local generator processes (default: one per CPU)")
+    parser.add_argument('--agents', type=lambda text: [a.strip() for a in text.split(',') if a.strip()],
+                        default=[], help="Remote agents, host:port,... (LOAD_AGENT_TOKEN must match)")
+    args = parser.parse_args()
+    if args.rate <= 0 or args.duration <= 0:
+        parser.error("--rate and --duration must be positive")
+    if args.processes < 0 or args.processes + len(args.agents) == 0:
+        parser.error("Need at least one local process or agent")
+    if args.samples:
+        parser.error("--samples is only supported by load_generator.py")
+
+    # Fork the local workers before the coordinator starts its event loop
+    local_socks = []
+    for _ in range(args.processes):
+        parent, child = socket.socketpair()
+        multiprocessing.Process(target=local_worker, args=(child,), daemon=True).start()
+        child.close()
+        local_socks.append(parent)
+
+    try:
+        asyncio.run(coordinate(args, local_socks))
+    except KeyboardInterrupt:
+        print("\n\n🛑 Load test stopped by user")
+        sys.exit(130)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,502 @@
+#!/usr/bin/env python3
+"""
+Open-loop HTTP load generator for the ALB / Cloud Run alert tests
+Starts requests at a constant arrival rate no matter how slowly the target
+answers (open loop), over a pool of keep-alive connections, all from one
+asyncio event loop.
+
+Latency is measured from each request's intended send time, so a stalled
+target cannot hide its tail (coordinated omission); the raw latency from the
+actual send is kept alongside for comparison. Both go into mergeable
+histograms (histogram.py) that --save-histograms writes out.
+
+The traffic is one URL, a weighted mix of endpoints (--scenario) or the
+requests of an access log at their original spacing (--replay), see scenario.py.
+
+Usage:
+  python3 load_generator.py https://yourdomain.com/health --rate 50 --duration 2m
+  python3 load_generator.py https://34.120.45.67/api/test --insecure --rate 2000
+  python3 load_generator.py https://yourdomain.com --scenario scenario.example.json --rate 100
+  python3 load_generator.py https://yourdomain.com --replay access.log --speed 5
+"""
+import argparse
+import asyncio
+import collections
+import random
+import re
+import ssl
+import sys
+import time
+import urllib.parse
+from array import array
+from datetime import datetime
+
+from histogram import LatencyHistogram, save_histograms
+from samples import SampleWriter
+from scenario import BODY_METHODS, describe_mix, load_access_log, load_scenario
+
+DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+# Quantiles printed in progress lines and the final report
+REPORT_QUANTILES = (0.5, 0.9, 0.95, 0.99, 0.999)
+
+# Weighted endpoint choices are drawn once into a table this long and cycled
+PICK_TABLE_SIZE = 65536
+
+
+def log(message):
+    """Print a log line with timestamp"""
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    print(f"[{timestamp}] {message}", flush=True)
+
+
+def parse_duration(text):
+    """Parse '90', '90s', '2m' or '500ms' into seconds"""
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)(ms|s|m|h)?', text.strip().lower())
+    if not match:
+        raise argparse.ArgumentTypeError(f"Invalid duration '{text}'")
+    return float(match.group(1)) * DURATION_UNITS[match.group(2) or 's']
+
+
+class ConnectionPool:
+    """
+    Keep-alive connections to one origin, shared by all in-flight requests
+
+    At most `size` connections are open; requests beyond that wait for one
+    to be released, which counts towards their latency.
+    """
+
+    def __init__(self, target, size, ssl_context):
+        self.host = target.hostname
+        self.port = target.port or (443 if target.scheme == 'https' else 80)
+        self.ssl_context = ssl_context
+        self.slots = asyncio.Semaphore(size)
+        self.idle = []
+        self.opened = 0
+
+    async def acquire(self):
+        """Return (reader, writer, reused) holding one of the pool's slots"""
+        await self.slots.acquire()
+        if self.idle:
+            return (*self.idle.pop(), True)
+        try:
+            reader, writer = await asyncio.open_connection(
+                self.host, self.port, ssl=self.ssl_context, limit=1024 * 1024
+            )
+        except BaseException:
+            self.slots.release()
+            raise
+        self.opened += 1
+        return reader, writer, False
+
+    def release(self, reader, writer, reusable):
+        """Give a connection back, closing it unless it can carry another request"""
+        if reusable:
+            self.idle.append((reader, writer))
+        else:
+            writer.close()
+        self.slots.release()
+
+    def close(self):
+        for _, writer in self.idle:
+            writer.close()
+        self.idle.clear()
+
+
+def build_request(target, host_header=None, method='GET', path=None, headers=None, body=''):
+    """Request bytes, built once per endpoint and reused for every request"""
+    if path is None:
+        path = (target.path or '/') + (f"?{target.query}" if target.query else '')
+    fields = {'Host': host_header or target.netloc, 'User-Agent': 'load-generator', 'Accept': '*/*'}
+    # Scenario headers replace the defaults whatever their case
+    for name, value in (headers or {}).items():
+        for default in [default for default in fields if default.lower() == name.lower()]:
+            del fields[default]
+        fields[name] = value
+    payload = body.encode('utf-8')
+    if payload or method in BODY_METHODS:
+        fields['Content-Length'] = str(len(payload))
+    head = f"{method} {path} HTTP/1.1\r\n" + ''.join(f"{name}: {value}\r\n" for name, value in fields.items())
+    return (head + "\r\n").encode('latin-1') + payload
+
+
+# One request target of a plan; `head` responses carry no body
+Endpoint = collections.namedtuple('Endpoint', 'name request head')
+
+
+class LoadPlan:
+    """
+    What to send and when
+
+    Request i goes out offset(i) seconds after the start, to
+    endpoints[endpoint(i)]. A rate plan spaces requests evenly and cycles
+    through a table of endpoints pre-drawn by weight; a replay plan follows
+    the offsets and order of an access log.
+    """
+
+    def __init__(self, target, endpoints, total, interval=None, offsets=None, picks=None):
+        self.target = target
+        self.endpoints = endpoints
+        self.total = total
+        self.interval = interval
+        self.offsets = offsets
+        self.picks = picks if picks is not None else array('H', [0])
+
+    def offset(self, i):
+        return i * self.interval if self.offsets is None else self.offsets[i]
+
+    def endpoint(self, i):
+        return self.picks[i % len(self.picks)]
+
+    @property
+    def names(self):
+        return [endpoint.name for endpoint in self.endpoints]
+
+
+def build_plan(args):
+    """
+    LoadPlan for args.url, or for args.scenario (a file or already loaded
+    endpoints) / args.replay on the URL's origin
+    """
+    target = urllib.parse.urlsplit(args.url)
+    if target.scheme not in ('http', 'https') or not target.hostname:
+        raise ValueError(f"Invalid URL '{args.url}'")
+
+    def endpoint(spec):
+        request = build_request(target, args.host, spec['method'], spec['path'], spec['headers'], spec['body'])
+        return Endpoint(spec['name'], request, spec['method'] == 'HEAD')
+
+    replay = getattr(args, 'replay', None)
+    if replay:
+        offsets, specs, picks = load_access_log(replay, args.speed)
+        return LoadPlan(target, [endpoint(spec) for spec in specs], len(offsets), offsets=offsets, picks=picks)
+
+    total = int(args.rate * args.duration)
+    scenario = getattr(args, 'scenario', None)
+    if not scenario:
+        request = build_request(target, args.host)
+        return LoadPlan(target, [Endpoint(target.path or '/', request, False)], total, 1.0 / args.rate)
+    specs = load_scenario(scenario) if isinstance(scenario, str) else scenario
+    draw = random.Random(getattr(args, 'seed', 1))
+    picks = array('H', draw.choices(range(len(specs)), [spec['weight'] for spec in specs], k=PICK_TABLE_SIZE))
+    return LoadPlan(target, [endpoint(spec) for spec in specs], total, 1.0 / args.rate, picks=picks)
+
+
+async def read_response(reader, head_only=False):
+    """
+    Read one response, discarding the body (there is none when head_only)
+
+    Returns:
+        (status code, body bytes, whether the connection can be reused)
+    """
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    version, status = lines[0].split(' ', 2)[:2]
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        if name:
+            headers[name.strip().lower()] = value.strip()
+
+    reusable = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+    size = 0
+    if head_only or status in ('204', '304'):
+        # No body, whatever Content-Length says
+        pass
+    elif 'content-length' in headers:
+        remaining = int(headers['content-length'])
+        while remaining:
+            chunk = await reader.read(min(remaining, 1024 * 1024))
+            if not chunk:
+                raise asyncio.IncompleteReadError(b'', remaining)
+            remaining -= len(chunk)
+            size += len(chunk)
+    elif headers.get('transfer-encoding', '').lower() == 'chunked':
+        while True:
+            chunk_size = int((await reader.readuntil(b'\r\n')).split(b';', 1)[0], 16)
+            if chunk_size == 0:
+                # Skip trailers up to the blank line
+                while await reader.readuntil(b'\r\n') != b'\r\n':
+                    pass
+                break
+            await reader.readexactly(chunk_size + 2)
+            size += chunk_size
+    else:
+        # Body delimited by the server closing the connection
+        while chunk := await reader.read(1024 * 1024):
+            size += len(chunk)
+        reusable = False
+    return int(status), size, reusable
+
+
+async def fetch(pool, request, head_only=False):
+    """
+    Send one request on a pooled connection
+
+    Returns:
+        (status, body bytes, monotonic time the request was written)
+    """
+    while True:
+        reader, writer, reused = await pool.acquire()
+        reusable = False
+        try:
+            sent_at = time.monotonic()
+            writer.write(request)
+            status, size, reusable = await read_response(reader, head_only)
+            return status, size, sent_at
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            if not reused or (isinstance(e, asyncio.IncompleteReadError) and e.partial):
+                raise
+            # The server closed an idle keep-alive connection; retry on a new one
+        finally:
+            pool.release(reader, writer, reusable)
+
+
+class Results:
+    """Outcome of every request in the run"""
+
+    def __init__(self):
+        # From the intended send time (coordinated-omission corrected)
+        self.corrected = LatencyHistogram()
+        # From the moment the request was actually written
+        self.raw = LatencyHistogram()
+        # Corrected latencies since the last progress report
+        self.interval = LatencyHistogram()
+        self.statuses = collections.Counter()
+        self.errors = collections.Counter()
+        self.bytes = 0
+        self.sent = 0
+        self.connections = 0
+        # Seconds spent sending on schedule, and including the final drain
+        self.send_seconds = 0.0
+        self.elapsed = 0.0
+        # Optional per-request SampleWriter
+        self.samples = None
+        # Epoch seconds at monotonic 0, to timestamp samples with their intended send time
+        self.wall_offset = time.time() - time.monotonic()
+
+    @property
+    def completed(self):
+        return self.corrected.total
+
+    @property
+    def failed(self):
+        """Errors plus 5xx responses"""
+        return sum(self.errors.values()) + sum(
+            count for status, count in self.statuses.items() if status >= 500
+        )
+
+    def record(self, intended, corrected, raw, status, size, endpoint=0):
+        """Record a response to the request scheduled for `intended` (monotonic)"""
+        self.corrected.record(corrected)
+        self.raw.record(raw)
+        self.interval.record(corrected)
+        self.statuses[status] += 1
+        self.bytes += size
+        if self.samples is not None:
+            self.samples.write(self.wall_offset + intended, corrected, status, size, endpoint)
+
+    def record_error(self, name, intended, corrected, endpoint=0):
+        self.errors[name] += 1
+        if self.samples is not None:
+            # Status 0 marks a failed request, latency is the time until it failed
+            self.samples.write(self.wall_offset + intended, corrected, 0, 0, endpoint)
+
+    def merge(self, other):
+        """Add another worker's results (runs side by side, so times take the max)"""
+        self.corrected.merge(other.corrected)
+        self.raw.merge(other.raw)
+        self.interval.merge(other.interval)
+        self.statuses.update(other.statuses)
+        self.errors.update(other.errors)
+        self.bytes += other.bytes
+        self.sent += other.sent
+        self.connections += other.connections
+        self.send_seconds = max(self.send_seconds, other.send_seconds)
+        self.elapsed = max(self.elapsed, other.elapsed)
+        return self
+
+
+async def one_request(pool, endpoint, endpoint_id, timeout, results, intended):
+    """Send one request scheduled for `intended` (monotonic) and record its outcome"""
+    try:
+        status, size, sent_at = await asyncio.wait_for(fetch(pool, endpoint.request, endpoint.head), timeout)
+    except asyncio.TimeoutError:
+        results.record_error('timeout', intended, time.monotonic() - intended, endpoint_id)
+    except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError) as e:
+        # LimitOverrunError: a response head (or chunk line) longer than the reader limit
+        results.record_error(type(e).__name__, intended, time.monotonic() - intended, endpoint_id)
+    else:
+        done = time.monotonic()
+        results.record(intended, done - intended, done - sent_at, status, size, endpoint_id)
+
+
+async def generate(args, plan, on_report, samples=None):
+    """
+    Send the requests of a LoadPlan, each at its scheduled time
+
+    on_report(results, in_flight, elapsed) is called every args.report_interval,
+    per-request samples go to the `samples` SampleWriter if given.
+    A distributed worker also gets args.start_at (wall clock) to start in step
+    with the others, and args.offset to interleave its schedule with theirs.
+    """
+    target = plan.target
+    ssl_context = None
+    if target.scheme == 'https':
+        ssl_context = ssl.create_default_context()
+        if args.insecure:
+            ssl_context.check_hostname = False
+            ssl_context.verify_mode = ssl.CERT_NONE
+    pool = ConnectionPool(target, args.connections, ssl_context)
+    results = Results()
+    results.samples = samples
+
+    total = plan.total
+    loop = asyncio.get_running_loop()
+    tasks = set()
+    sent = 0
+    start_at = getattr(args, 'start_at', None)
+    if start_at:
+        await asyncio.sleep(max(0.0, start_at - time.time()))
+    start = time.monotonic() + getattr(args, 'offset', 0.0)
+    next_report = start + args.report_interval
+
+    while sent < total:
+        now = time.monotonic()
+        # Start every request whose scheduled time has passed, so the rate holds
+        # even when the loop wakes up late or the rate exceeds timer resolution
+        while sent < total and start + plan.offset(sent) <= now:
+            intended = start + plan.offset(sent)
+            endpoint_id = plan.endpoint(sent)
+            task = loop.create_task(
+                one_request(pool, plan.endpoints[endpoint_id], endpoint_id, args.timeout, results, intended)
+            )
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            sent += 1
+        if now >= next_report:
+            results.sent = sent
+            on_report(results, len(tasks), now - start)
+            next_report += args.report_interval
+        if sent < total:
+            await asyncio.sleep(max(0.0, start + plan.offset(sent) - time.monotonic()))
+
+    results.sent = sent
+    results.send_seconds = time.monotonic() - start
+    if tasks:
+        log(f"⏳ Waiting for {len(tasks)} in-flight request(s)...")
+        await asyncio.gather(*tasks)
+    results.elapsed = time.monotonic() - start
+    results.connections = pool.opened
+    pool.close()
+    return results
+
+
+async def run(args):
+    """Single-process run with live progress and the final report"""
+    try:
+        plan = build_plan(args)
+    except (OSError, ValueError) as e:
+        raise SystemExit(f"❌ {e}")
+    if args.replay:
+        log(f"🚀 Replaying {args.replay} at {args.speed:g}x on {args.url}: {plan.total} requests "
+            f"over {plan.offsets[-1]:.0f}s, up to {args.connections} connections")
+    else:
+        log(f"🚀 {args.url}: {args.rate:g} req/s for {args.duration:g}s "
+            f"({plan.total} requests), up to {args.connections} connections")
+    if args.scenario:
+        for line in describe_mix(load_scenario(args.scenario)):
+            log(f"   {line}")
+    samples = None
+    if args.samples:
+        samples = SampleWriter(args.samples, plan.names)
+    try:
+        results = await generate(args, plan, report_progress, samples)
+    finally:
+        if samples is not None:
+            samples.close()
+    report_summary(results, args.threshold_ms)
+    if args.save_histograms:
+        save_histograms(args.save_histograms, {'corrected': results.corrected, 'raw': results.raw})
+        log(f"💾 Histograms saved to {args.save_histograms}")
+
+
+def report_progress(results, in_flight, elapsed):
+    """One progress line with the corrected percentiles of the last interval"""
+    window = results.interval.percentiles((0.5, 0.95))
+    log(f"📊 {elapsed:6.1f}s sent {results.sent}, done {results.completed}, in flight {in_flight}, "
+        f"errors {results.failed} | interval p50 {window[0.5] * 1000:.0f}ms "
+        f"p95 {window[0.95] * 1000:.0f}ms max {results.interval.max * 1000:.0f}ms")
+    results.interval.reset()
+
+
+def report_summary(results, threshold_ms):
+    """Final report: counts, achieved rate and corrected / raw latency percentiles"""
+    print()
+    print("=" * 60)
+    print("📈 Summary")
+    print(f"  Requests sent:    {results.sent} in {results.send_seconds:.1f}s "
+          f"({results.sent / max(results.send_seconds, 1e-9):.1f} req/s)")
+    print(f"  Completed:        {results.completed} ({results.elapsed:.1f}s including drain)")
+    for status, count in sorted(results.statuses.items()):
+        print(f"    HTTP {status}:       {count}")
+    for name, count in results.errors.most_common():
+        print(f"    {name}: {count}")
+    print(f"  Connections:      {results.connections} opened")
+    print(f"  Received:         {results.bytes / 1024 / 1024:.1f} MiB")
+    if results.completed:
+        corrected = results.corrected.percentiles(REPORT_QUANTILES)
+        raw = results.raw.percentiles(REPORT_QUANTILES)
+        print(f"  Latency (ms)  {'corrected':>12} {'raw':>12}")
+        for q in REPORT_QUANTILES:
+            label = f"p{q * 100:g}"
+            print(f"    {label:<10}{corrected[q] * 1000:12.1f} {raw[q] * 1000:12.1f}")
+        print(f"    {'max':<10}{results.corrected.max * 1000:12.1f} {results.raw.max * 1000:12.1f}")
+        print(f"    {'mean':<10}{results.corrected.mean * 1000:12.1f} {results.raw.mean * 1000:12.1f}")
+        if corrected[0.99] > raw[0.99] * 1.1:
+            print("  ⚠️  Corrected tail is well above raw: requests waited for connections or the")
+            print("     generator fell behind - raise --connections or spread load over more processes")
+        p95_ms = corrected[0.95] * 1000
+        verdict = "ABOVE" if p95_ms > threshold_ms else "below"
+        print(f"  p95 {p95_ms:.0f}ms is {verdict} the {threshold_ms:g}ms alert threshold")
+    print("=" * 60)
+
+
+def build_parser(description):
+    """Command-line options shared by the generator and the distributed driver"""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('url', help="Target URL, e.g. https://yourdomain.com/health")
+    parser.add_argument('--rate', type=float, default=10, help="Requests per second (default 10)")
+    parser.add_argument('--duration', type=parse_duration, default=120, help="Run time, e.g. 90s or 2m (default 2m)")
+    parser.add_argument('--connections', type=int, default=256, help="Max keep-alive connections (default 256)")
+    parser.add_argument('--timeout', type=parse_duration, default=30, help="Per-request timeout (default 30s)")
+    parser.add_argument('--insecure', action='store_true', help="Skip TLS certificate validation (ALB by IP)")
+    parser.add_argument('--host', help="Host header to send instead of the URL's host")
+    parser.add_argument('--report-interval', type=parse_duration, default=5, help="Progress line interval (default 5s)")
+    parser.add_argument('--threshold-ms', type=float, default=3000, help="Alert p95 threshold to compare with (default 3000)")
+    parser.add_argument('--save-histograms', metavar='FILE', help="Write corrected/raw histograms for merging later")
+    parser.add_argument('--samples', metavar='FILE', help="Write per-request samples (see samples.py) for analysis")
+    parser.add_argument('--scenario', metavar='FILE', help="Weighted endpoint mix on the URL's origin (see scenario.py)")
+    parser.add_argument('--seed', type=int, default=1, help="Seed of the scenario's endpoint draws (default 1)")
+    return parser
+
+
+def main():
+    parser = build_parser("Open-loop HTTP load generator")
+    parser.add_argument('--replay', metavar='LOG', help="Replay an access log on the URL's origin instead of --rate")
+    parser.add_argument('--speed', type=float, default=1.0, help="Replay speed, 2 = twice as fast (default 1)")
+    args = parser.parse_args()
+    if args.rate <= 0 or args.duration <= 0 or args.speed <= 0:
+        parser.error("--rate, --duration and --speed must be positive")
+    if args.replay and args.scenario:
+        parser.error("--replay and --scenario cannot be combined")
+
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        print("\n\n🛑 Load test stopped by user")
+        sys.exit(130)
+
+
+if __name__ == '__main__':
+    main()
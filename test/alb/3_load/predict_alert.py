@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Predict when the ALB latency alert policy fires and resolves, from local samples
+Replays per-request latency samples through the aggregation of the Cloud
+Monitoring condition in ../1_terraform/main.tf: ALIGN_DELTA of the latency
+distribution over each alignment period, reduced to a percentile
+(REDUCE_PERCENTILE_95), compared with the threshold, and required to stay in
+violation for the condition duration before the policy fires.
+
+Usage:
+  python3 load_generator.py https://yourdomain.com/health --rate 20 --duration 10m --samples run.lsmp
+  python3 predict_alert.py run.lsmp
+  python3 predict_alert.py run.lsmp --step 10s --threshold-ms 2000 --expect fire
+"""
+import argparse
+import collections
+import math
+import os
+import re
+import sys
+from array import array
+from datetime import datetime
+
+from histogram import counts_percentiles, histogram_index
+from load_generator import parse_duration
+from samples import SAMPLES_MAGIC, SampleFile
+
+DEFAULT_POLICY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '1_terraform', 'main.tf')
+
+# Used for anything the policy file does not set
+POLICY_DEFAULTS = {
+    'duration': 60.0,
+    'threshold_ms': 3000.0,
+    'comparison': 'COMPARISON_GT',
+    'alignment_period': 60.0,
+    'aligner': 'ALIGN_DELTA',
+    'reducer': 'REDUCE_PERCENTILE_95',
+    'auto_close': 1800.0,
+}
+
+COMPARISONS = {
+    'COMPARISON_GT': lambda value, threshold: value > threshold,
+    'COMPARISON_GE': lambda value, threshold: value >= threshold,
+    'COMPARISON_LT': lambda value, threshold: value < threshold,
+    'COMPARISON_LE': lambda value, threshold: value <= threshold,
+}
+
+
+def load_policy(path):
+    """Read the first alert policy condition of a Terraform file (plain regex, no HCL parser)"""
+    policy = dict(POLICY_DEFAULTS)
+    with open(path, 'r') as f:
+        text = f.read()
+    start = text.find('"google_monitoring_alert_policy"')
+    if start < 0:
+        raise ValueError(f"No google_monitoring_alert_policy in {path}")
+    text = text[start:]
+    patterns = {
+        'duration': (r'\bduration\s*=\s*"(\d+(?:\.\d+)?)s"', float),
+        'threshold_ms': (r'\bthreshold_value\s*=\s*(\d+(?:\.\d+)?)', float),
+        'comparison': (r'\bcomparison\s*=\s*"(\w+)"', str),
+        'alignment_period': (r'\balignment_period\s*=\s*"(\d+(?:\.\d+)?)s"', float),
+        'aligner': (r'\bper_series_aligner\s*=\s*"(\w+)"', str),
+        'reducer': (r'\bcross_series_reducer\s*=\s*"(\w+)"', str),
+        'auto_close': (r'\bauto_close\s*=\s*"(\d+(?:\.\d+)?)s"', float),
+    }
+    for key, (pattern, convert) in patterns.items():
+        match = re.search(pattern, text)
+        if match:
+            policy[key] = convert(match.group(1))
+    return policy
+
+
+def policy_statistic(policy):
+    """
+    What one aligned point reduces to, as ('percentile', q) or ('mean', None)
+
+    ALIGN_DELTA keeps each period's latency distribution, so the cross-series
+    reducer picks the statistic; ALIGN_PERCENTILE_nn / ALIGN_MEAN pick it directly.
+    """
+    aligner, reducer = policy['aligner'], policy['reducer']
+    if aligner.startswith('ALIGN_PERCENTILE_'):
+        return 'percentile', int(aligner.rsplit('_', 1)[1]) / 100
+    if aligner == 'ALIGN_MEAN':
+        return 'mean', None
+    if aligner in ('ALIGN_DELTA', 'ALIGN_SUM'):
+        if reducer.startswith('REDUCE_PERCENTILE_'):
+            return 'percentile', int(reducer.rsplit('_', 1)[1]) / 100
+        if reducer == 'REDUCE_MEAN':
+            return 'mean', None
+    raise ValueError(f"Unsupported aggregation {aligner} / {reducer}")
+
+
+def describe_policy(policy):
+    kind, q = policy_statistic(policy)
+    statistic = f"p{q * 100:g}" if kind == 'percentile' else 'mean'
+    operator = {'COMPARISON_GT': '>', 'COMPARISON_GE': '>=', 'COMPARISON_LT': '<', 'COMPARISON_LE': '<='}
+    return (f"{statistic} latency ({policy['aligner']} {policy['alignment_period']:g}s, {policy['reducer']}) "
+            f"{operator.get(policy['comparison'], policy['comparison'])} {policy['threshold_ms']:g}ms "
+            f"for {policy['duration']:g}s, auto-close {policy['auto_close']:g}s")
+
+
+def load_samples(path):
+    """
+    Read samples as parallel arrays (epoch seconds, latency in us), sorted by time
+
+    Samples are timestamped with their intended send time, so a request that
+    stalls lands in the window it was sent in, not the one it finished in.
+
+    Takes a samples file from load_generator.py --samples (failed requests,
+    status 0, are left out as they never reach backend_latencies) or CSV lines
+    'epoch_seconds,latency_ms[,status]' for hand-made traces.
+    """
+    with open(path, 'rb') as f:
+        binary = f.read(len(SAMPLES_MAGIC)) == SAMPLES_MAGIC
+    timestamps = array('d')
+    latencies = array('Q')
+    if binary:
+        samples = SampleFile(path)
+        for block in samples.blocks:
+            for timestamp_us, latency_us, status in zip(block['timestamp_us'], block['latency_us'], block['status']):
+                if status:
+                    timestamps.append(timestamp_us / 1000000)
+                    latencies.append(latency_us)
+        samples.close()
+    else:
+        timestamps, latencies = load_csv_samples(path)
+    if any(timestamps[i] > timestamps[i + 1] for i in range(len(timestamps) - 1)):
+        order = sorted(range(len(timestamps)), key=timestamps.__getitem__)
+        timestamps = array('d', (timestamps[i] for i in order))
+        latencies = array('Q', (latencies[i] for i in order))
+    return timestamps, latencies
+
+
+def load_csv_samples(path):
+    """Parallel arrays (epoch seconds, latency in us) from a CSV; a header line is skipped"""
+    timestamps = array('d')
+    latencies = array('Q')
+    with open(path, 'r') as f:
+        for line in f:
+            fields = line.split(',')
+            try:
+                timestamp, latency_ms = float(fields[0]), float(fields[1])
+            except (ValueError, IndexError):
+                continue
+            timestamps.append(timestamp)
+            latencies.append(max(0, int(latency_ms * 1000)))
+    return timestamps, latencies
+
+
+def aligned_points(timestamps, latencies, policy, step):
+    """
+    Yield (window end, samples, value in ms or None) every `step` seconds
+
+    Samples go once into per-step sparse histograms; each aligned window is then
+    a running sum of the last alignment_period / step of them (add the newest
+    step, subtract the expired one) instead of re-scanning the samples.
+    """
+    period = policy['alignment_period']
+    window_steps = max(1, round(period / step))
+    kind, q = policy_statistic(policy)
+
+    # Windows end on multiples of the step, like Cloud Monitoring's aligned points
+    origin = math.floor(timestamps[0] / step) * step
+    step_counts = collections.defaultdict(collections.Counter)
+    step_sums = collections.Counter()
+    for timestamp, latency_us in zip(timestamps, latencies):
+        slot = int((timestamp - origin) // step)
+        step_counts[slot][histogram_index(latency_us)] += 1
+        step_sums[slot] += latency_us
+    last_slot = int((timestamps[-1] - origin) // step)
+
+    window = collections.Counter()
+    window_total = 0
+    window_sum = 0
+    # Keep going one full window past the last sample so the data drains out
+    for slot in range(last_slot + window_steps + 1):
+        for index, count in step_counts.get(slot, {}).items():
+            window[index] += count
+            window_total += count
+        window_sum += step_sums.get(slot, 0)
+        expired = slot - window_steps
+        if expired >= 0:
+            for index, count in step_counts.get(expired, {}).items():
+                window[index] -= count
+                window_total -= count
+                if not window[index]:
+                    del window[index]
+            window_sum -= step_sums.get(expired, 0)
+
+        end = origin + (slot + 1) * step
+        if not window_total:
+            yield end, 0, None
+        elif kind == 'percentile':
+            yield end, window_total, counts_percentiles(window, window_total, (q,))[q] / 1000
+        else:
+            yield end, window_total, window_sum / window_total / 1000
+
+
+def evaluate(points, policy):
+    """
+    Run the condition state machine over aligned points
+
+    Returns:
+        (timeline rows of (time, samples, value, state), events of (time, kind, detail))
+    """
+    compare = COMPARISONS[policy['comparison']]
+    timeline = []
+    events = []
+    violating_since = None
+    firing = False
+    last_data = None
+    for end, samples, value in points:
+        if value is None:
+            # No data: the condition is not met, and an open incident only closes
+            # after auto_close without data
+            violating_since = None
+            if firing and last_data is not None and end - last_data >= policy['auto_close']:
+                firing = False
+                events.append((end, 'resolve', f"auto-close after {policy['auto_close']:g}s without data"))
+            timeline.append((end, samples, value, 'FIRING' if firing else 'no data'))
+            continue
+        last_data = end
+        if compare(value, policy['threshold_ms']):
+            if violating_since is None:
+                violating_since = end
+            if not firing and end - violating_since >= policy['duration']:
+                firing = True
+                events.append((end, 'fire', f"in violation since {clock(violating_since)}"))
+        else:
+            violating_since = None
+            if firing:
+                firing = False
+                events.append((end, 'resolve', f"{value:.0f}ms back within threshold"))
+        if firing:
+            state = 'FIRING'
+        elif violating_since is not None:
+            state = 'violating'
+        else:
+            state = 'ok'
+        timeline.append((end, samples, value, state))
+    return timeline, events
+
+
+def clock(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime('%H:%M:%S')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Predict alert policy firing from latency samples")
+    parser.add_argument('samples', help="Samples from load_generator.py --samples, or a CSV")
+    parser.add_argument('--policy', default=DEFAULT_POLICY_FILE, help="Terraform file with the alert policy")
+    parser.add_argument('--step', type=parse_duration, help="Evaluation step (default: the alignment period)")
+    parser.add_argument('--threshold-ms', type=float, help="Override the policy threshold")
+    parser.add_argument('--duration', type=parse_duration, help="Override the condition duration")
+    parser.add_argument('--alignment-period', type=parse_duration, help="Override the alignment period")
+    parser.add_argument('--events-only', action='store_true', help="Print only fire/resolve events")
+    parser.add_argument('--expect', choices=('fire', 'no-fire'), help="Exit 1 unless the prediction matches")
+    args = parser.parse_args()
+
+    try:
+        policy = load_policy(args.policy)
+    except (OSError, ValueError) as e:
+        print(f"⚠️  {e} - using the default policy", file=sys.stderr)
+        policy = dict(POLICY_DEFAULTS)
+    for key in ('threshold_ms', 'duration', 'alignment_period'):
+        if getattr(args, key) is not None:
+            policy[key] = getattr(args, key)
+    step = args.step or policy['alignment_period']
+
+    timestamps, latencies = load_samples(args.samples)
+    if not timestamps:
+        raise SystemExit(f"❌ No samples in {args.samples}")
+
+    print(f"📋 Policy: {describe_policy(policy)}")
+    print(f"📊 Samples: {len(timestamps)} from {clock(timestamps[0])} to {clock(timestamps[-1])} "
+          f"({timestamps[-1] - timestamps[0]:.0f}s), evaluated every {step:g}s")
+    timeline, events = evaluate(aligned_points(timestamps, latencies, policy, step), policy)
+
+    if not args.events_only:
+        print()
+        print(f"  {'Window end':<10} {'+s':>6} {'samples':>8} {'value ms':>10}  state")
+        for end, samples, value, state in timeline:
+            shown = f"{value:10.1f}" if value is not None else f"{'-':>10}"
+            print(f"  {clock(end):<10} {end - timestamps[0]:6.0f} {samples:8d} {shown}  {state}")
+    print()
+    if not events:
+        print("✅ Policy would not fire")
+    for end, kind, detail in events:
+        icon, verb = ('🔥', 'FIRES') if kind == 'fire' else ('✅', 'resolves')
+        print(f"{icon} Policy {verb} at {clock(end)} (+{end - timestamps[0]:.0f}s after the first sample): {detail}")
+    if events:
+        print("   Cloud Monitoring adds ingestion and evaluation delay (usually 1-3 minutes) on top")
+
+    fired = any(kind == 'fire' for _, kind, _ in events)
+    if args.expect and fired != (args.expect == 'fire'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
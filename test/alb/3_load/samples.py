@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Compact columnar file of per-request load-test samples
+Each sample is 20 bytes: intended send time (epoch us), latency (us), response
+bytes, HTTP status (0 = request failed) and endpoint id; a sample completed
+at its timestamp plus its latency. Samples are written in blocks of up to
+SAMPLES_PER_BLOCK, every block storing one column after the other, so
+readers mmap the file and view each column as a typed memoryview without
+parsing anything.
+
+Layout (little-endian, every block 8-byte aligned):
+  header   b'LSMP', version u16, 2 bytes padding, 8 bytes reserved
+  block    tag (4 bytes), count u32, payload padded to 8 bytes
+    b'ENDP' payload: JSON list of endpoint names, count = payload length
+    b'SMPL' payload: timestamp_us i64[count], latency_us u32[count],
+            bytes u32[count], status u16[count], endpoint u16[count]
+
+Usage:
+  python3 samples.py summary run.lsmp
+  python3 samples.py compare baseline.lsmp candidate.lsmp
+"""
+import json
+import mmap
+import struct
+import sys
+from array import array
+
+from histogram import LatencyHistogram
+
+SAMPLES_MAGIC = b'LSMP'
+SAMPLES_VERSION = 1
+FILE_HEADER = struct.Struct('<4sH2x8x')
+BLOCK_HEADER = struct.Struct('<4sI')
+SAMPLES_PER_BLOCK = 65536
+
+# Column name, array typecode; order is the on-disk order within a block
+COLUMNS = (
+    ('timestamp_us', 'q'),
+    ('latency_us', 'I'),
+    ('bytes', 'I'),
+    ('status', 'H'),
+    ('endpoint', 'H'),
+)
+UINT32_MAX = (1 << 32) - 1
+
+REPORT_QUANTILES = (0.5, 0.9, 0.95, 0.99, 0.999)
+
+
+def padding(length):
+    return -length % 8
+
+
+class SampleWriter:
+    """Buffers samples column by column and appends them as blocks"""
+
+    def __init__(self, path, endpoints):
+        self.file = open(path, 'wb')
+        self.file.write(FILE_HEADER.pack(SAMPLES_MAGIC, SAMPLES_VERSION))
+        names = json.dumps(list(endpoints)).encode('utf-8')
+        self.file.write(BLOCK_HEADER.pack(b'ENDP', len(names)) + names + bytes(padding(len(names))))
+        self.columns = {name: array(typecode) for name, typecode in COLUMNS}
+
+    def write(self, timestamp, latency, status, size, endpoint=0):
+        """Append one sample (intended send time in epoch seconds, latency seconds)"""
+        columns = self.columns
+        columns['timestamp_us'].append(int(timestamp * 1000000))
+        columns['latency_us'].append(min(UINT32_MAX, max(0, int(latency * 1000000))))
+        columns['bytes'].append(min(UINT32_MAX, size))
+        columns['status'].append(status)
+        columns['endpoint'].append(endpoint)
+        if len(columns['status']) >= SAMPLES_PER_BLOCK:
+            self.flush()
+
+    def flush(self):
+        count = len(self.columns['status'])
+        if not count:
+            return
+        self.file.write(BLOCK_HEADER.pack(b'SMPL', count))
+        written = 0
+        for name, _ in COLUMNS:
+            data = self.columns[name].tobytes()
+            self.file.write(data)
+            written += len(data)
+            del self.columns[name][:]
+        self.file.write(bytes(padding(written)))
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class SampleFile:
+    """
+    Read-only, memory-mapped view of a samples file
+
+    blocks holds one {column: memoryview} dict per block, straight into the
+    mapping; column() concatenates a column across blocks into an array.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = view = memoryview(self.map)
+        magic, version = FILE_HEADER.unpack_from(view)
+        if magic != SAMPLES_MAGIC or version != SAMPLES_VERSION:
+            raise ValueError(f"{path} is not a samples file")
+        self.endpoints = []
+        self.blocks = []
+        offset = FILE_HEADER.size
+        while offset + BLOCK_HEADER.size <= len(view):
+            tag, count = BLOCK_HEADER.unpack_from(view, offset)
+            offset += BLOCK_HEADER.size
+            if tag == b'ENDP':
+                self.endpoints = json.loads(bytes(view[offset:offset + count]))
+                offset += count + padding(count)
+            elif tag == b'SMPL':
+                block = {}
+                for name, typecode in COLUMNS:
+                    length = count * array(typecode).itemsize
+                    if offset + length > len(view):
+                        raise ValueError(f"{path} is truncated")
+                    with view[offset:offset + length] as raw:
+                        block[name] = raw.cast(typecode)
+                    offset += length
+                offset += padding(sum(count * array(t).itemsize for _, t in COLUMNS))
+                self.blocks.append(block)
+            else:
+                raise ValueError(f"{path}: unknown block {tag!r}")
+
+    def __len__(self):
+        return sum(len(block['status']) for block in self.blocks)
+
+    def column(self, name):
+        """One column across all blocks, as an array"""
+        typecode = dict(COLUMNS)[name]
+        values = array(typecode)
+        for block in self.blocks:
+            values.frombytes(block[name].cast('B'))
+        return values
+
+    def histograms(self):
+        """{endpoint name: LatencyHistogram} of successful requests, plus '*' for all"""
+        histograms = {'*': LatencyHistogram()}
+        for block in self.blocks:
+            for latency_us, status, endpoint in zip(block['latency_us'], block['status'], block['endpoint']):
+                if not status:
+                    continue
+                name = self.endpoints[endpoint] if endpoint < len(self.endpoints) else str(endpoint)
+                if name not in histograms:
+                    histograms[name] = LatencyHistogram()
+                seconds = latency_us / 1000000
+                histograms[name].record(seconds)
+                histograms['*'].record(seconds)
+        return histograms
+
+    def close(self):
+        # The mapping only closes once every view into it is released
+        for block in self.blocks:
+            for view in block.values():
+                view.release()
+        self.blocks.clear()
+        self.view.release()
+        self.map.close()
+
+
+def summary(path):
+    samples = SampleFile(path)
+    statuses = {}
+    for block in samples.blocks:
+        for status in block['status']:
+            statuses[status] = statuses.get(status, 0) + 1
+    timestamps = samples.column('timestamp_us')
+    span = (max(timestamps) - min(timestamps)) / 1000000 if timestamps else 0
+    print(f"📁 {path}: {len(samples)} samples over {span:.1f}s")
+    print("  " + ', '.join(f"{'failed' if not status else f'HTTP {status}'}: {count}"
+                           for status, count in sorted(statuses.items())))
+    print(f"  {'Endpoint':<24} {'count':>8} " + ' '.join(f"{f'p{q * 100:g}':>9}" for q in REPORT_QUANTILES))
+    for name, histogram in samples.histograms().items():
+        values = histogram.percentiles(REPORT_QUANTILES)
+        print(f"  {name:<24} {histogram.total:>8} " + ' '.join(f"{values[q] * 1000:9.1f}" for q in REPORT_QUANTILES))
+    samples.close()
+
+
+def compare(baseline_path, candidate_path):
+    """Percentiles of two runs side by side, per endpoint"""
+    baseline = SampleFile(baseline_path)
+    candidate = SampleFile(candidate_path)
+    before = baseline.histograms()
+    after = candidate.histograms()
+    print(f"📊 {baseline_path} → {candidate_path} (ms)")
+    for name in sorted(before.keys() | after.keys()):
+        print(f"  {name}")
+        old = before.get(name, LatencyHistogram()).percentiles(REPORT_QUANTILES)
+        new = after.get(name, LatencyHistogram()).percentiles(REPORT_QUANTILES)
+        for q in REPORT_QUANTILES:
+            change = f"{(new[q] / old[q] - 1) * 100:+7.1f}%" if old[q] else f"{'-':>8}"
+            print(f"    p{q * 100:<6g}{old[q] * 1000:10.1f} {new[q] * 1000:10.1f} {change}")
+    baseline.close()
+    candidate.close()
+
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == 'summary':
+        summary(sys.argv[2])
+    elif len(sys.argv) == 4 and sys.argv[1] == 'compare':
+        compare(sys.argv[2], sys.argv[3])
+    else:
+        raise SystemExit(f"Usage: {sys.argv[0]} summary FILE | compare BASELINE CANDIDATE")
+
+
+if __name__ == '__main__':
+    main()
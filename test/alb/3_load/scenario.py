@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Traffic mixes for load_generator.py: weighted scenarios and access-log replay
+
+A scenario is a JSON file of weighted endpoints on the target origin:
+
+  {"endpoints": [
+    {"path": "/health", "weight": 70},
+    {"name": "slow", "path": "/api/test?latency=2000", "weight": 25},
+    {"path": "/api/test", "method": "POST", "weight": 5,
+     "headers": {"X-Debug": "1"}, "body": {"user": 42}}
+  ]}
+
+An access log is replayed request by request from its timestamps, either a
+Common/Combined Log Format file (nginx, Apache) or Cloud Logging entries of
+the load balancer (`gcloud logging read ... --format=json`, a JSON array or
+one entry per line).
+
+Usage:
+  python3 scenario.py check scenario.json      # validate and show the mix
+  python3 scenario.py check access.log         # summary of a log before replaying it
+"""
+import collections
+import json
+import re
+import sys
+import urllib.parse
+from array import array
+from datetime import datetime
+
+BODY_METHODS = ('POST', 'PUT', 'PATCH')
+
+# Samples files store the endpoint as a u16
+MAX_ENDPOINTS = 65535
+
+# Common/Combined Log Format: ... [10/Oct/2026:13:55:36 +0000] "GET /path HTTP/1.1" ...
+CLF_PATTERN = re.compile(r'\[([^\]]+)\] "([A-Z]+) (\S+)[^"]*"')
+CLF_TIME_FORMAT = '%d/%b/%Y:%H:%M:%S %z'
+
+
+def load_scenario(path):
+    """
+    Read and validate a scenario file
+
+    Returns:
+        list of endpoint dicts with name, method, path, headers, body (str) and weight
+    """
+    with open(path, 'r') as f:
+        try:
+            spec = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"{path}: invalid JSON ({e})")
+    entries = spec.get('endpoints') if isinstance(spec, dict) else spec
+    if not isinstance(entries, list) or not entries:
+        raise ValueError(f"{path}: expected a non-empty 'endpoints' list")
+    if len(entries) > MAX_ENDPOINTS:
+        raise ValueError(f"{path}: at most {MAX_ENDPOINTS} endpoints")
+
+    endpoints = []
+    for i, entry in enumerate(entries):
+        if not isinstance(entry, dict) or not str(entry.get('path', '')).startswith('/'):
+            raise ValueError(f"{path}: endpoint {i + 1} needs a 'path' starting with '/'")
+        method = str(entry.get('method', 'GET')).upper()
+        headers = {str(name): str(value) for name, value in entry.get('headers', {}).items()}
+        body = entry.get('body', '')
+        if not isinstance(body, str):
+            body = json.dumps(body)
+            if not any(name.lower() == 'content-type' for name in headers):
+                headers['Content-Type'] = 'application/json'
+        weight = float(entry.get('weight', 1))
+        if weight < 0:
+            raise ValueError(f"{path}: endpoint {i + 1} has a negative weight")
+        endpoints.append({
+            'name': str(entry.get('name') or f"{method} {entry['path'].split('?', 1)[0]}"),
+            'method': method,
+            'path': entry['path'],
+            'headers': headers,
+            'body': body,
+            'weight': weight,
+        })
+    if not sum(endpoint['weight'] for endpoint in endpoints):
+        raise ValueError(f"{path}: all weights are zero")
+    return endpoints
+
+
+def parse_log_time(text):
+    """Epoch seconds of an RFC 3339 timestamp, nanosecond fractions included"""
+    match = re.fullmatch(r'(.+?)(?:\.(\d+))?(Z|[+-]\d\d:\d\d)', text.strip())
+    if not match:
+        raise ValueError(f"Invalid timestamp '{text}'")
+    zone = '+00:00' if match.group(3) == 'Z' else match.group(3)
+    seconds = datetime.fromisoformat(match.group(1) + zone).timestamp()
+    return seconds + float(f"0.{match.group(2)}") if match.group(2) else seconds
+
+
+def read_log_entries(path):
+    """Yield (epoch seconds, method, path with query, sub-second precision) from an access log"""
+    with open(path, 'r', errors='replace') as f:
+        text = f.read()
+    stripped = text.lstrip()
+    if stripped.startswith('['):
+        lines = (json.dumps(entry) for entry in json.loads(stripped))
+    else:
+        lines = text.splitlines()
+    for line in lines:
+        line = line.strip()
+        if line.startswith('{'):
+            entry = json.loads(line)
+            request = entry.get('httpRequest') or {}
+            if 'requestUrl' not in request or 'timestamp' not in entry:
+                continue
+            url = urllib.parse.urlsplit(request['requestUrl'])
+            target = (url.path or '/') + (f"?{url.query}" if url.query else '')
+            yield parse_log_time(entry['timestamp']), request.get('requestMethod', 'GET').upper(), target, True
+        else:
+            match = CLF_PATTERN.search(line)
+            if match:
+                timestamp = datetime.strptime(match.group(1), CLF_TIME_FORMAT).timestamp()
+                yield timestamp, match.group(2), match.group(3), False
+
+
+def load_access_log(path, speed=1.0):
+    """
+    Turn an access log into a replay schedule
+
+    Logs with whole-second timestamps (CLF) have their requests of each second
+    spread evenly over that second instead of all firing at once.
+
+    Returns:
+        (offsets: array of seconds from the first request, divided by speed,
+         endpoints: one dict per distinct method and path,
+         picks: array of endpoint indexes, one per request)
+    """
+    entries = sorted(read_log_entries(path), key=lambda entry: entry[0])
+    if not entries:
+        raise ValueError(f"{path}: no requests found (expected CLF lines or Cloud Logging entries)")
+
+    per_second = collections.Counter(int(timestamp) for timestamp, _, _, precise in entries if not precise)
+    seen_in_second = collections.Counter()
+    origin = entries[0][0]
+    offsets = array('d')
+    picks = array('H')
+    endpoints = []
+    indexes = {}
+    for timestamp, method, target, precise in entries:
+        if not precise:
+            second = int(timestamp)
+            timestamp += seen_in_second[second] / per_second[second]
+            seen_in_second[second] += 1
+        key = (method, target)
+        if key not in indexes:
+            if len(endpoints) == MAX_ENDPOINTS:
+                raise ValueError(f"{path}: more than {MAX_ENDPOINTS} distinct requests")
+            indexes[key] = len(endpoints)
+            endpoints.append({
+                'name': f"{method} {target.split('?', 1)[0]}",
+                'method': method,
+                'path': target,
+                'headers': {},
+                'body': '',
+                'weight': 0.0,
+            })
+        offsets.append((timestamp - origin) / speed)
+        picks.append(indexes[key])
+    return offsets, endpoints, picks
+
+
+def describe_mix(endpoints, counts=None):
+    """Lines of 'share name' for weights, or for per-endpoint request counts"""
+    values = counts if counts is not None else [endpoint['weight'] for endpoint in endpoints]
+    total = sum(values) or 1
+    # The same name (e.g. one path with different queries) is shown once
+    shares = collections.Counter()
+    for endpoint, value in zip(endpoints, values):
+        shares[endpoint['name']] += value
+    return [f"{value / total * 100:5.1f}%  {name}" for name, value in shares.most_common()]
+
+
+def main():
+    if len(sys.argv) != 3 or sys.argv[1] != 'check':
+        raise SystemExit(f"Usage: {sys.argv[0]} check SCENARIO.json|ACCESS.log")
+    path = sys.argv[2]
+    try:
+        try:
+            endpoints = load_scenario(path)
+        except ValueError:
+            # Not a scenario, try it as an access log
+            endpoints = None
+        if endpoints is not None:
+            print(f"📋 Scenario {path}: {len(endpoints)} endpoint(s)")
+            for line in describe_mix(endpoints):
+                print(f"  {line}")
+            return
+        offsets, endpoints, picks = load_access_log(path)
+    except (OSError, ValueError) as e:
+        raise SystemExit(f"❌ {e}")
+    counts = [0] * len(endpoints)
+    for index in picks:
+        counts[index] += 1
+    span = offsets[-1]
+    print(f"📜 Access log {path}: {len(picks)} requests over {span:.1f}s "
+          f"({len(picks) / span if span else 0:.1f} req/s average), {len(endpoints)} distinct requests")
+    for line in describe_mix(endpoints, counts)[:20]:
+        print(f"  {line}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Checks of load_generator.fetch / one_request against a local HTTP/1.1 server
+
+Usage:
+  python3 -m unittest test_load_generator.py
+"""
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import unittest
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from load_generator import ConnectionPool, Endpoint, Results, build_request, fetch, one_request
+from samples import SampleFile, SampleWriter
+
+BODY = b'x' * 5000
+
+# Larger than the 1 MiB StreamReader limit of the pool's connections
+HUGE_HEADER = 'y' * (2 * 1024 * 1024)
+
+
+class BodyHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == '/huge-header':
+            self.send_response(200)
+            self.send_header('X-Huge', HUGE_HEADER)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.path == '/chunked':
+            self.send_response(200)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for part in (BODY[:3000], BODY[3000:]):
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(part), part))
+            self.wfile.write(b'0\r\n\r\n')
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def do_HEAD(self):
+        # Content-Length of the body a GET would return, but no body
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class QuietServer(ThreadingHTTPServer):
+
+    def handle_error(self, request, client_address):
+        # A client dropping a connection mid-response is part of some tests
+        pass
+
+
+class ServerTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = QuietServer(('127.0.0.1', 0), BodyHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.target = urllib.parse.urlsplit(f"http://127.0.0.1:{cls.server.server_port}/")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+
+class KeepAliveTest(ServerTestCase):
+
+    def fetch_many(self, path, method='GET', count=20):
+        """Send count requests one after the other, returns (statuses, sizes, connections opened)"""
+        async def send():
+            pool = ConnectionPool(self.target, 1, None)
+            request = build_request(self.target, method=method, path=path)
+            responses = [await fetch(pool, request, head_only=method == 'HEAD') for _ in range(count)]
+            pool.close()
+            return responses, pool.opened
+
+        responses, opened = asyncio.run(send())
+        return [status for status, _, _ in responses], [size for _, size, _ in responses], opened
+
+    def test_get_bodies_on_one_connection(self):
+        statuses, sizes, opened = self.fetch_many('/')
+        self.assertEqual(statuses, [200] * 20)
+        self.assertEqual(sizes, [len(BODY)] * 20)
+        self.assertEqual(opened, 1)
+
+    def test_chunked_bodies_on_one_connection(self):
+        statuses, sizes, opened = self.fetch_many('/chunked')
+        self.assertEqual(statuses, [200] * 20)
+        self.assertEqual(sizes, [len(BODY)] * 20)
+        self.assertEqual(opened, 1)
+
+    def test_head_reads_no_body(self):
+        statuses, sizes, opened = self.fetch_many('/', method='HEAD')
+        self.assertEqual(statuses, [200] * 20)
+        self.assertEqual(sizes, [0] * 20)
+        self.assertEqual(opened, 1)
+
+
+class OneRequestTest(ServerTestCase):
+
+    def send_one(self, path, intended, samples=None):
+        async def send():
+            pool = ConnectionPool(self.target, 1, None)
+            endpoint = Endpoint(path, build_request(self.target, path=path), False)
+            results = Results()
+            results.samples = samples
+            await one_request(pool, endpoint, 0, 10, results, intended)
+            pool.close()
+            return results
+
+        return asyncio.run(send())
+
+    def test_oversized_header_is_recorded_as_error(self):
+        results = self.send_one('/huge-header', time.monotonic())
+        self.assertEqual(dict(results.errors), {'LimitOverrunError': 1})
+        self.assertEqual(results.completed, 0)
+
+    def test_sample_timestamp_is_intended_send_time(self):
+        # Scheduled 5s ago, as if the generator had stalled
+        scheduled_at = time.time() - 5
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'run.lsmp')
+            samples = SampleWriter(path, ['/'])
+            self.send_one('/', time.monotonic() - 5, samples)
+            samples.close()
+            sample_file = SampleFile(path)
+            timestamp_us = sample_file.column('timestamp_us')[0]
+            latency_us = sample_file.column('latency_us')[0]
+            sample_file.close()
+        self.assertAlmostEqual(timestamp_us / 1000000, scheduled_at, delta=0.5)
+        self.assertAlmostEqual(latency_us / 1000000, 5, delta=0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
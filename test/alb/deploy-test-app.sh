@@ -53,7 +53,7 @@ gcloud run deploy $SERVICE_NAME \
   --region $REGION \
   --project $PROJECT_ID \
   --allow-unauthenticated \
-  --set-env-vars LATENCY_MS=100 \
+  --set-env-vars LATENCY_MS=100${SIM_ADMIN_TOKEN:+,SIM_ADMIN_TOKEN=$SIM_ADMIN_TOKEN} \
   --cpu 1 \
   --memory 256Mi \
   --min-instances 1 \
@@ -84,5 +84,8 @@ echo -e "${YELLOW}Update latency (for testing alert):${NC}"
 echo "  # Set to 4 seconds to trigger alert"
 echo "  gcloud run services update $SERVICE_NAME --region $REGION --project $PROJECT_ID --set-env-vars LATENCY_MS=4000"
 echo ""
+echo "  # Or change it live without redeploying (requires SIM_ADMIN_TOKEN at deploy time)"
+echo "  curl -X POST $SERVICE_URL/admin/config -H \"Authorization: Bearer \$SIM_ADMIN_TOKEN\" -d '{\"latency_ms\": 4000}'"
+echo ""
 echo "  # Reset to normal (100ms)"
 echo "  gcloud run services update $SERVICE_NAME --region $REGION --project $PROJECT_ID --set-env-vars LATENCY_MS=100"
@@ -12,10 +12,19 @@ RED='\033[0;31m'
 BLUE='\033[0;34m'
 NC='\033[0m'
 
-# Configuration
+# Configuration (rate and duration can be overridden from the environment)
 DOMAIN=${1:-""}
-REQUESTS_PER_SECOND=10
-DURATION_MINUTES=2
+REQUESTS_PER_SECOND=${REQUESTS_PER_SECOND:-10}
+DURATION_MINUTES=${DURATION_MINUTES:-2}
+LOAD_PATH=${LOAD_PATH:-/health}
+# Production-like traffic instead of LOAD_PATH: a weighted endpoint mix
+# (see 3_load/scenario.example.json) or an access log replayed at REPLAY_SPEED
+SCENARIO_FILE=${SCENARIO_FILE:-""}
+REPLAY_LOG=${REPLAY_LOG:-""}
+REPLAY_SPEED=${REPLAY_SPEED:-1}
+SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
+# Per-request samples of the run, kept for predict_alert.py and comparisons
+SAMPLES_FILE=${SAMPLES_FILE:-"$PWD/load-test-$(date +%Y%m%d-%H%M%S).lsmp"}
 
 if [ -z "$DOMAIN" ]; then
     echo -e "${RED}❌ Error: Domain or IP required${NC}"
@@ -42,8 +51,14 @@ echo -e "${GREEN}========================================${NC}"
 echo ""
 echo -e "${YELLOW}Configuration:${NC}"
 echo "  Target:         $DOMAIN"
-echo "  Rate:           $REQUESTS_PER_SECOND req/s"
-echo "  Duration:       $DURATION_MINUTES minutes"
+if [ ! -z "$REPLAY_LOG" ]; then
+    echo "  Replay:         $REPLAY_LOG at ${REPLAY_SPEED}x"
+else
+    echo "  Rate:           $REQUESTS_PER_SECOND req/s"
+    echo "  Duration:       $DURATION_MINUTES minutes"
+    echo "  Traffic:        ${SCENARIO_FILE:-$LOAD_PATH}"
+fi
+echo "  Samples:        $SAMPLES_FILE"
 if [ ! -z "$SERVICE_URL" ]; then
     echo "  Backend URL:    $SERVICE_URL"
 fi
@@ -54,88 +69,54 @@ TOTAL_SECONDS=$((DURATION_MINUTES * 60))
 TOTAL_REQUESTS=$((REQUESTS_PER_SECOND * TOTAL_SECONDS))
 
 echo -e "${BLUE}📊 Test plan:${NC}"
-echo "  Total requests: $TOTAL_REQUESTS"
+if [ -z "$REPLAY_LOG" ]; then
+    echo "  Total requests: $TOTAL_REQUESTS"
+fi
 echo "  Expected to trigger alert when 95th percentile > 3s"
 echo ""
 
 # Determine protocol and URL
+BASE_URL="https://$DOMAIN"
+INSECURE_FLAG=""
 if [[ $DOMAIN =~ ^[0-9]+\.[0-9]+\.[0-9]+\.[0-9]+$ ]]; then
     # It's an IP address
-    BASE_URL="https://$DOMAIN"
     INSECURE_FLAG="--insecure"
     echo -e "${YELLOW}⚠️  Using IP address - SSL validation disabled${NC}"
-else
-    # It's a domain
-    BASE_URL="https://$DOMAIN"
-    INSECURE_FLAG=""
 fi
 
 echo ""
 echo -e "${BLUE}🔄 Sending requests...${NC}"
 echo ""
 
-counter=0
-success_count=0
-error_count=0
-start_time=$(date +%s)
-
-# Function to send request
-send_request() {
-    local endpoint=$1
-    local type=$2
-    
-    if curl -s -o /dev/null -w "%{http_code}" \
-        "${BASE_URL}${endpoint}" \
-        -H "Host: $DOMAIN" \
-        $INSECURE_FLAG \
-        --connect-timeout 10 \
-        --max-time 30 2>/dev/null | grep -q "200"; then
-        ((success_count++))
-    else
-        ((error_count++))
-    fi
-}
-
-# Send requests
-while [ $counter -lt $TOTAL_REQUESTS ]; do
-    # All requests go to /health endpoint
-    # The backend latency is controlled by LATENCY_MS env var set earlier
-    send_request "/health" "test" &
-    
-    ((counter++))
-    
-    # Print progress every 50 requests
-    if [ $((counter % 50)) -eq 0 ]; then
-        elapsed=$(($(date +%s) - start_time))
-        echo -e "${BLUE}Progress: $counter/$TOTAL_REQUESTS requests (${elapsed}s elapsed, $success_count success, $error_count errors)${NC}"
-    fi
-    
-    # Control request rate (requests per second)
-    sleep $(echo "scale=3; 1/$REQUESTS_PER_SECOND" | bc)
-done
-
-# Wait for all background requests to complete
-echo ""
-echo -e "${YELLOW}Waiting for all requests to complete...${NC}"
-wait
-
-total_time=$(($(date +%s) - start_time))
+# Open-loop generator: constant arrival rate over keep-alive connections,
+# reports the latency percentiles it actually produced
+TRAFFIC_ARGS=(--rate "$REQUESTS_PER_SECOND" --duration "${DURATION_MINUTES}m")
+TARGET_URL="${BASE_URL}${LOAD_PATH}"
+if [ ! -z "$REPLAY_LOG" ]; then
+    TRAFFIC_ARGS=(--replay "$REPLAY_LOG" --speed "$REPLAY_SPEED")
+    TARGET_URL="$BASE_URL"
+elif [ ! -z "$SCENARIO_FILE" ]; then
+    TRAFFIC_ARGS+=(--scenario "$SCENARIO_FILE")
+    TARGET_URL="$BASE_URL"
+fi
+python3 "$SCRIPT_DIR/3_load/load_generator.py" "$TARGET_URL" \
+    "${TRAFFIC_ARGS[@]}" \
+    --timeout 30s \
+    --samples "$SAMPLES_FILE" \
+    $INSECURE_FLAG
 
 echo ""
 echo -e "${GREEN}✅ Load test completed!${NC}"
 echo ""
-echo -e "${BLUE}📈 Summary:${NC}"
-echo "  Total requests:   $TOTAL_REQUESTS"
-echo "  Successful:       $success_count"
-echo "  Errors:           $error_count"
-echo "  Duration:         ${total_time}s"
-echo "  Actual rate:      $(echo "scale=2; $TOTAL_REQUESTS/$total_time" | bc) req/s"
-echo ""
 echo -e "${YELLOW}🔍 Next steps:${NC}"
 echo "  1. Wait 2-5 minutes for metrics to appear in Cloud Monitoring"
 echo "  2. Alert should trigger within 3-6 minutes if latency > 3s"
 echo "  3. Email notification within 5-10 minutes"
 echo ""
+echo -e "${BLUE}Predict the alert from this run's samples:${NC}"
+echo "  python3 $SCRIPT_DIR/3_load/predict_alert.py $SAMPLES_FILE"
+echo "  python3 $SCRIPT_DIR/3_load/samples.py compare <previous run>.lsmp $SAMPLES_FILE"
+echo ""
 echo -e "${BLUE}Check status with:${NC}"
 echo "  cd 1_terraform && ./verify-alert.sh"
 echo ""
@@ -3,6 +3,12 @@
 # Script để update latency của Cloud Run service và test alert policy
 # Usage: ./update-latency.sh <LATENCY_MS>
 # Example: ./update-latency.sh 4000  # Set to 4 seconds
+#
+# If SIM_ADMIN_TOKEN is exported (and the service was deployed with it), the
+# latency is changed live through the simulator's /admin/config endpoint in
+# about a second instead of redeploying the service.
+# Note: the admin call reaches the instance that serves it - keep
+# --max-instances 1 when sweeping latencies this way.
 
 set -e
 
@@ -34,6 +40,28 @@ echo "  Service:  $SERVICE_NAME"
 echo "  Latency:  ${LATENCY_MS}ms ($(echo "scale=1; $LATENCY_MS/1000" | bc)s)"
 echo ""
 
+if [ ! -z "$SIM_ADMIN_TOKEN" ]; then
+    SERVICE_URL=$(gcloud run services describe $SERVICE_NAME \
+      --region $REGION \
+      --project $PROJECT_ID \
+      --format="value(status.url)")
+    
+    # Change latency live through the admin API (no redeploy, no cold start)
+    curl -sf -X POST "$SERVICE_URL/admin/config" \
+      -H "Authorization: Bearer $SIM_ADMIN_TOKEN" \
+      -H "Content-Type: application/json" \
+      -d "{\"latency_ms\": $LATENCY_MS}" > /dev/null || {
+        echo -e "${RED}❌ Admin API update failed (is SIM_ADMIN_TOKEN set on the service?)${NC}"
+        exit 1
+    }
+    
+    echo -e "${GREEN}✅ Latency updated live via admin API!${NC}"
+    echo ""
+    echo -e "${YELLOW}Test the new latency:${NC}"
+    echo "  curl $SERVICE_URL/api/test"
+    exit 0
+fi
+
 # Update service
 gcloud run services update $SERVICE_NAME \
   --region $REGION \
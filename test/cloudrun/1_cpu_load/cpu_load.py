@@ -2,51 +2,405 @@
 """
 CPU Load Generator - Configurable CPU usage via environment variable
 Supports: 75%, 85%, 99% CPU targets
+
+By default a PID controller in the main process measures the CPU actually
+used (cgroup cpu.stat usage_usec) and adjusts the workers' duty cycles through
+shared memory, so the container holds CPU_TARGET despite throttling, the HTTP
+server's own CPU use and noisy neighbours. CPU_CONTROL=off runs open loop.
+
+CPU_PROFILE makes the target change over time (ramps, steps, sine waves,
+bursts, trace replay), see profiles.py.
 """
 import multiprocessing
 import time
 import os
+import math
 from datetime import datetime
 
-def cpu_load_worker(target_load=1.0, duration=None):
+from profiles import get_profile
+from workloads import KERNELS, describe_workload, get_workload, int_kernel, workload_schedule
+
+# Accepted distance (percentage points) between measured and target CPU usage
+CPU_CONTROL_TOLERANCE = 2.0
+
+# Time constant (seconds) of the averaged usage that is checked against the
+# tolerance; single samples are noisy and the alerts look at averages anyway
+CPU_CONTROL_SMOOTHING = 10.0
+
+# Default duty cycle length; cycles well under the 100ms CFS quota period keep
+# the load flat inside every period instead of aliasing with it (1-10ms)
+DEFAULT_CYCLE_MS = 10
+
+# Longest piece of uninterrupted work, bounds how far a busy phase overshoots
+CHUNK_US = 50
+
+def calibrate_work_units(kernel=int_kernel, rounds=5):
+    """
+    Measure how many kernel work units run per microsecond
+    
+    Grows one call to ~5ms, then takes the median of a few such calls.
+    """
+    units = 1
+    while True:
+        start = time.perf_counter_ns()
+        kernel(units)
+        elapsed = time.perf_counter_ns() - start
+        if elapsed >= 5000000:
+            break
+        units *= 2
+    
+    rates = []
+    for _ in range(rounds):
+        start = time.perf_counter_ns()
+        kernel(units)
+        rates.append(units * 1000 / max(1, time.perf_counter_ns() - start))
+    return sorted(rates)[len(rates) // 2]
+
+def calibrate_workload(mix):
+    """Work units per microsecond of every kernel in a workload mix"""
+    return {name: calibrate_work_units(KERNELS[name]) for name, _ in mix}
+
+def cpu_load_worker(target_load=1.0, duration=None, duties=None, index=0, work_rates=None):
     """
     Worker function that generates CPU load
     
+    Each cycle (CPU_CYCLE_MS) is busy for load x cycle, in chunks of the
+    CPU_WORKLOAD kernels sized from their calibrated work rates so the busy
+    phase ends within CHUNK_US of its deadline, then sleeps until the cycle
+    ends. Sleeps that overrun (common
+    in containers) and busy overshoot are carried into the next cycle's busy
+    time, so the average load stays exact.
+    
     Args:
         target_load: Target load for this worker (0.0 to 1.0, where 1.0 = 100%)
         duration: Optional duration in seconds
+        duties: Optional shared array of duty cycles, re-read every cycle
+            (overrides target_load, written by the controller)
+        index: This worker's slot in duties
+        work_rates: Calibrated {kernel name: units per microsecond}
+            (calibrated here if not given)
     """
-    print(f"[{datetime.now()}] Worker {os.getpid()} started (target load: {target_load*100:.0f}%)")
-    start_time = time.time()
-    
-    if target_load >= 0.99:
-        # If target is ~100%, just run continuously
-        while True:
-            for i in range(10000):
-                _ = i ** 2
-            
-            if duration and (time.time() - start_time) > duration:
-                break
-    else:
-        # For partial load, use busy-wait cycle
-        # busy_time / (busy_time + sleep_time) = target_load
-        cycle_time = 0.1  # 100ms cycle
-        busy_time = cycle_time * target_load
-        sleep_time = cycle_time * (1 - target_load)
+    cycle_ns = int(max(1.0, float(os.getenv('CPU_CYCLE_MS', DEFAULT_CYCLE_MS))) * 1000000)
+    mix = get_workload()
+    rates = dict(work_rates) if work_rates else calibrate_workload(mix)
+    schedule = [(name, KERNELS[name]) for name in workload_schedule(mix)]
+    position = 0
+    print(f"[{datetime.now()}] Worker {os.getpid()} started (target load: {target_load*100:.0f}%, "
+          f"cycle: {cycle_ns / 1000000:g}ms)")
+    deadline = time.perf_counter_ns() + int(duration * 1000000000) if duration else None
+    
+    carry = 0
+    cycle_start = time.perf_counter_ns()
+    while True:
+        load = duties[index] if duties is not None else target_load
+        if load < 0:
+            # STOP_DUTY: the pool is shrinking
+            break
         
-        while True:
-            # Busy period
-            busy_start = time.time()
-            while (time.time() - busy_start) < busy_time:
-                for i in range(1000):
-                    _ = i ** 2
+        # Busy period
+        busy_end = cycle_start + load * cycle_ns + carry
+        now = busy_start = time.perf_counter_ns()
+        while now < busy_end:
+            name, kernel = schedule[position]
+            position = (position + 1) % len(schedule)
+            units = max(1, int(min(CHUNK_US * 1000, busy_end - now) * rates[name] / 1000))
+            kernel(units)
+            chunk_end = time.perf_counter_ns()
+            # Follow the real work rate (frequency scaling, contention)
+            rates[name] += 0.05 * (units * 1000 / max(1, chunk_end - now) - rates[name])
+            now = chunk_end
+        busy = now - busy_start
+        
+        # Sleep period (skipped when fully loaded)
+        cycle_end = cycle_start + cycle_ns
+        if now < cycle_end:
+            time.sleep((cycle_end - now) / 1000000000)
+            now = time.perf_counter_ns()
+        
+        # Busy time owed for the cycle as it really ran, paid back next cycle
+        carry = max(-cycle_ns, min(cycle_ns, carry + load * (now - cycle_start) - busy))
+        cycle_start = now
+        
+        if deadline and now >= deadline:
+            break
+
+def get_container_cpu_usage():
+    """Get actual CPU usage from cgroup"""
+    try:
+        # Try cgroup v2
+        if os.path.exists('/sys/fs/cgroup/cpu.stat'):
+            with open('/sys/fs/cgroup/cpu.stat', 'r') as f:
+                for line in f:
+                    if line.startswith('usage_usec'):
+                        return int(line.split()[1]) / 1000000  # Convert to seconds
+        
+        # Try cgroup v1
+        if os.path.exists('/sys/fs/cgroup/cpuacct/cpuacct.usage'):
+            with open('/sys/fs/cgroup/cpuacct/cpuacct.usage', 'r') as f:
+                return int(f.read().strip()) / 1000000000  # Convert nanoseconds to seconds
+    except:
+        pass
+    return None
+
+def get_host_cpu_usage():
+    """Get busy CPU seconds of the whole host from /proc/stat (no cgroup)"""
+    try:
+        with open('/proc/stat', 'r') as f:
+            fields = f.readline().split()
+        # user, nice, system, idle, iowait, irq, softirq
+        user, nice, system, _, _, irq, softirq = (int(value) for value in fields[1:8])
+        return (user + nice + system + irq + softirq) / os.sysconf('SC_CLK_TCK')
+    except:
+        pass
+    return None
+
+def get_cpu_usage():
+    """CPU seconds used so far by the container, or by the host outside a container"""
+    usage = get_container_cpu_usage()
+    if usage is None:
+        usage = get_host_cpu_usage()
+    return usage
+
+class DutyCycleController:
+    """
+    PID controller from measured CPU usage to the workers' total duty cycle
+    
+    Works in cores: the output starts from the open-loop guess (the target
+    itself) and is corrected by the error, so any CPU the workers do not
+    account for is compensated. The integral only accumulates while the
+    output is not saturated (anti-windup).
+    """
+    
+    def __init__(self, target_cores, max_cores, kp=0.5, ki=0.5, kd=0.0):
+        self.target_cores = target_cores
+        self.max_cores = max_cores
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.integral = 0.0
+        self.previous_error = None
+    
+    def update(self, measured_cores, dt):
+        """Return the new total duty cycle (cores) for usage measured over dt seconds"""
+        error = self.target_cores - measured_cores
+        derivative = 0.0 if self.previous_error is None else (error - self.previous_error) / dt
+        self.previous_error = error
+        
+        integral = self.integral + error * dt
+        output = self.target_cores + self.kp * error + self.ki * integral + self.kd * derivative
+        saturated = (output >= self.max_cores and error > 0) or (output <= 0 and error < 0)
+        if not saturated:
+            self.integral = integral
+        return min(self.max_cores, max(0.0, output))
+
+# Duty written to a worker's slot to make it exit
+STOP_DUTY = -1.0
+
+class WorkerPool:
+    """
+    cpu_load_worker processes sharing one array of duty cycles
+    
+    The array has a slot for every worker the pool can ever need (capacity);
+    resize() starts workers in free slots or stops the highest ones by
+    writing STOP_DUTY, which they read at the start of their next cycle.
+    """
+    
+    def __init__(self, capacity, work_rates=None):
+        self.duties = multiprocessing.Array('d', capacity, lock=False)
+        self.processes = []
+        self.work_rates = work_rates
+    
+    @property
+    def size(self):
+        return len(self.processes)
+    
+    def resize(self, count, load):
+        """Run count workers (at most the capacity), new ones starting at load"""
+        count = max(0, min(count, len(self.duties)))
+        while len(self.processes) < count:
+            i = len(self.processes)
+            self.duties[i] = load
+            p = multiprocessing.Process(target=cpu_load_worker, args=(load, None, self.duties, i, self.work_rates))
+            p.start()
+            self.processes.append(p)
+            print(f"[{datetime.now()}] Started process {i+1}/{count} (PID: {p.pid})")
+        while len(self.processes) > count:
+            i = len(self.processes) - 1
+            self.duties[i] = STOP_DUTY
+            p = self.processes.pop()
+            p.join(timeout=1)
+            if p.is_alive():
+                p.terminate()
+                p.join()
+            print(f"[{datetime.now()}] Stopped process {i+1} (PID: {p.pid})")
+    
+    def set_total(self, total_cores):
+        """Spread a total duty cycle (cores) evenly over the running workers"""
+        for i in range(self.size):
+            self.duties[i] = min(1.0, total_cores / self.size)
+    
+    def alive(self):
+        return any(p.is_alive() for p in self.processes)
+    
+    def stop(self):
+        for p in self.processes:
+            p.terminate()
+        for p in self.processes:
+            p.join()
+        self.processes.clear()
+
+def workers_needed(target_cores):
+    """Worker processes for a load in cores, e.g. 1.7 cores = 2 (at 85% each)"""
+    return max(1, math.ceil(target_cores - 1e-9))
+
+class CpuLoad:
+    """
+    A running CPU load: the worker pool, its shared target and the control loop
+    
+    set_target() can be called from any thread (the HTTP control endpoint);
+    run() picks the change up within one control interval, resizes the pool
+    to the cores now needed and re-targets the controller. With a profile
+    (set_profile), run() sets the target from it every control interval,
+    until the profile is replaced or a fixed target is set.
+    
+    Unless CPU_CONTROL=off, a PID controller samples CPU usage every
+    CPU_CONTROL_INTERVAL seconds and writes its output to the shared duties
+    (gains: CPU_CONTROL_KP/KI/KD); otherwise the duties are the open-loop
+    target.
+    """
+    
+    def __init__(self, target_percentage, cpu_count, work_rates=None, profile=None):
+        self.cpu_count = cpu_count
+        # (LoadProfile, monotonic start), swapped as one reference between threads
+        self.schedule = None
+        if profile is not None:
+            target_percentage = profile.level(0)
+            self.set_profile(profile)
+        self.target = multiprocessing.Value('d', target_percentage, lock=False)
+        self.pool = WorkerPool(workers_needed(cpu_count), work_rates)
+        self.interval = float(os.getenv('CPU_CONTROL_INTERVAL', '1'))
+        self.closed_loop = os.getenv('CPU_CONTROL', 'pid').lower() != 'off'
+        self.controller = DutyCycleController(
+            0.0,
+            0,
+            kp=float(os.getenv('CPU_CONTROL_KP', '0.5')),
+            ki=float(os.getenv('CPU_CONTROL_KI', '0.5')),
+            kd=float(os.getenv('CPU_CONTROL_KD', '0')),
+        )
+        # Last measured and averaged usage (percent), None until measured
+        self.measured_percentage = None
+        self.average_percentage = None
+        self.apply_target()
+    
+    def set_target(self, percentage):
+        """Change the target CPU usage (percent of cpu_count), ending any profile"""
+        if not 0 < percentage <= 100:
+            raise ValueError("target must be in (0, 100]")
+        self.schedule = None
+        self.target.value = percentage
+    
+    def set_profile(self, profile):
+        """Follow a LoadProfile from now on, from its start"""
+        self.schedule = (profile, time.monotonic())
+    
+    def apply_target(self):
+        """Resize the pool and re-target the controller for target.value"""
+        target_cores = self.cpu_count * self.target.value / 100
+        workers = workers_needed(target_cores)
+        if workers != self.pool.size:
+            print(f"[{datetime.now()}] Target {self.target.value:g}% = {target_cores:.2f} cores: "
+                  f"{workers} process(es) at {target_cores / workers * 100:.1f}%")
+            self.pool.resize(workers, target_cores / workers)
+        self.controller.target_cores = target_cores
+        self.controller.max_cores = self.pool.size
+        # Jump to the open-loop duty at once, the controller corrects from there
+        self.pool.set_total(target_cores)
+    
+    def status(self):
+        schedule = self.schedule
+        return {
+            'target': self.target.value,
+            'profile': schedule[0].describe() if schedule else None,
+            'profile_elapsed': round(time.monotonic() - schedule[1], 1) if schedule else None,
+            'cpu_count': self.cpu_count,
+            'workers': self.pool.size,
+            'duties': [round(self.pool.duties[i], 4) for i in range(self.pool.size)],
+            'measured': self.measured_percentage,
+            'average': self.average_percentage,
+            'control': 'pid' if self.closed_loop else 'off',
+        }
+    
+    def run(self):
+        """Follow the target until the workers exit (or KeyboardInterrupt)"""
+        last_usage = get_cpu_usage() if self.closed_loop else None
+        last_time = time.monotonic()
+        if self.closed_loop and last_usage is None:
+            print(f"[{datetime.now()}] Warning: CPU usage unavailable, running open loop")
+            self.closed_loop = False
+            self.apply_target()
+        if self.closed_loop:
+            print(f"[{datetime.now()}] CPU controller: every {self.interval:g}s, "
+                  f"kp={self.controller.kp:g} ki={self.controller.ki:g} kd={self.controller.kd:g}")
+        
+        applied = self.target.value
+        in_band = False
+        next_status = last_time + 30
+        followed = None
+        while self.pool.alive():
+            time.sleep(self.interval)
+            # The profile is evaluated on the monotonic clock, not by counting
+            # intervals, so slow iterations never stretch it
+            schedule = self.schedule
+            profiling = False
+            if schedule is not None:
+                profile, started = schedule
+                elapsed = time.monotonic() - started
+                level = profile.level(elapsed)
+                if schedule is not followed:
+                    print(f"[{datetime.now()}] 📈 Following profile {profile.describe()}")
+                    followed, announced = schedule, False
+                if profile.finished(elapsed) and not announced:
+                    print(f"[{datetime.now()}] 📈 Profile finished, holding {level:g}%")
+                    announced = True
+                # set_target() may have ended the profile meanwhile
+                if self.schedule is schedule:
+                    self.target.value = level
+                profiling = not profile.finished(elapsed)
+            target_percentage = self.target.value
+            if target_percentage != applied:
+                if schedule is None:
+                    print(f"[{datetime.now()}] 🎯 Target changed: {applied:g}% -> {target_percentage:g}%")
+                applied = target_percentage
+                in_band = False
+                self.apply_target()
+            if not self.closed_loop:
+                continue
             
-            # Sleep period
-            if sleep_time > 0:
-                time.sleep(sleep_time)
+            usage = get_cpu_usage()
+            now = time.monotonic()
+            if usage is None or now <= last_time:
+                continue
+            dt = now - last_time
+            measured_cores = (usage - last_usage) / dt
+            self.pool.set_total(self.controller.update(measured_cores, dt))
+            last_usage, last_time = usage, now
             
-            if duration and (time.time() - start_time) > duration:
-                break
+            measured_percentage = measured_cores / self.cpu_count * 100
+            average = self.average_percentage
+            if average is None:
+                average = measured_percentage
+            average += min(1.0, dt / CPU_CONTROL_SMOOTHING) * (measured_percentage - average)
+            self.measured_percentage, self.average_percentage = measured_percentage, average
+            status = (f"CPU {average:.1f}% avg, {measured_percentage:.1f}% now (target {target_percentage:g}%), "
+                      f"duty {self.pool.duties[0]*100:.1f}% x {self.pool.size} worker(s)")
+            # A moving target is always ahead of the average, only report the band when it holds still
+            if not profiling and (abs(average - target_percentage) <= CPU_CONTROL_TOLERANCE) != in_band:
+                in_band = not in_band
+                print(f"[{datetime.now()}] {'✅ Within' if in_band else '⚠️  Outside'} ±{CPU_CONTROL_TOLERANCE:g}%: {status}")
+            elif now >= next_status:
+                print(f"[{datetime.now()}] {status}")
+            if now >= next_status:
+                next_status = now + 30
 
 def get_container_cpu_quota():
     """Get container CPU quota from cgroup"""
@@ -121,20 +475,21 @@ def main():
     """Main function to start CPU load generator"""
     # Get target CPU percentage from environment variable (default: 100%)
     target_percentage = int(os.getenv('CPU_TARGET', '100'))
+    profile = get_profile()
     
     print(f"[{datetime.now()}] ===== CPU Load Generator Started =====")
-    print(f"[{datetime.now()}] Target: {target_percentage}% CPU utilization")
+    if profile is not None:
+        target_percentage = profile.level(0)
+        print(f"[{datetime.now()}] Profile: {profile.describe()}")
+    print(f"[{datetime.now()}] Target: {target_percentage:g}% CPU utilization")
     
     # Get system CPU count (considering container limits)
     cpu_count = get_cpu_count()
     target_processes_float = cpu_count * target_percentage / 100
-    target_processes = max(1, int(cpu_count))  # At least 1 full process
+    target_processes = workers_needed(target_processes_float)
     
     # Calculate load per process
-    if target_processes > 0:
-        load_per_process = target_processes_float / target_processes
-    else:
-        load_per_process = target_percentage / 100
+    load_per_process = target_processes_float / target_processes
     
     print(f"[{datetime.now()}] Target CPU usage: {target_percentage}%")
     print(f"[{datetime.now()}] CPU count: {cpu_count:.2f}")
@@ -142,26 +497,25 @@ def main():
     print(f"[{datetime.now()}] Spawning {target_processes} process(es)")
     print(f"[{datetime.now()}] Load per process: {load_per_process*100:.1f}%")
     
-    # Create and start worker processes
-    processes = []
-    for i in range(target_processes):
-        p = multiprocessing.Process(target=cpu_load_worker, args=(load_per_process,))
-        p.start()
-        processes.append(p)
-        print(f"[{datetime.now()}] Started process {i+1}/{target_processes} (PID: {p.pid})")
+    # Calibrate the work rates once, before the workers compete for the CPU
+    workload = get_workload()
+    work_rates = calibrate_workload(workload)
+    print(f"[{datetime.now()}] Workload: {describe_workload(workload)}")
+    print(f"[{datetime.now()}] Calibrated work rates: "
+          + ', '.join(f"{name} {rate:.2f} units/µs" for name, rate in work_rates.items()))
+    
+    # Create and start worker processes, with their duty cycles in shared memory
+    load = CpuLoad(target_percentage, cpu_count, work_rates, profile)
     
     print(f"[{datetime.now()}] ===== All processes started successfully =====")
     print(f"[{datetime.now()}] Press Ctrl+C to stop")
     
     try:
-        # Keep main process alive
-        for p in processes:
-            p.join()
+        # Keep main process alive, adjusting the duty cycles
+        load.run()
     except KeyboardInterrupt:
         print(f"\n[{datetime.now()}] Stopping all processes...")
-        for p in processes:
-            p.terminate()
-            p.join()
+        load.pool.stop()
         print(f"[{datetime.now()}] All processes stopped")
 
 if __name__ == "__main__":
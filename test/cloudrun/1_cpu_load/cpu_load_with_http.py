@@ -2,110 +2,160 @@
 """
 CPU Load Generator with HTTP server for Cloud Run compatibility
 Supports: 75%, 85%, 95% CPU targets via CPU_TARGET env variable
+
+The target can be changed at runtime, without a redeploy (requires CPU_ADMIN_TOKEN):
+  curl -H "Authorization: Bearer $TOKEN" -d '{"target": 85}' https://SERVICE/admin/cpu
+  curl -H "Authorization: Bearer $TOKEN" -d '{"profile": "ramp:20-90:10m"}' https://SERVICE/admin/cpu
+
+CPU_PROFILE runs a load profile from the start instead of a constant target,
+see profiles.py.
+
+The status page only renders what a background sampler (telemetry.py) has
+already measured, so health checks answer at once even under full load.
 """
 import multiprocessing
 import time
 import os
-import math
+import hmac
+import json
 from datetime import datetime
 from http.server import HTTPServer, BaseHTTPRequestHandler
 import threading
 import socket
-import psutil
 
 # Import the existing CPU load logic
-from cpu_load import get_container_cpu_quota, cpu_load_worker
+from cpu_load import get_container_cpu_quota, calibrate_workload, workers_needed, CpuLoad
+from profiles import LoadProfile, get_profile
+from telemetry import TelemetrySampler
+from workloads import describe_workload, get_workload
 
 # Global flag to track if CPU load should start
 cpu_load_ready = threading.Event()
 
-def get_container_cpu_usage():
-    """Get actual CPU usage from cgroup"""
-    try:
-        # Try cgroup v2
-        if os.path.exists('/sys/fs/cgroup/cpu.stat'):
-            with open('/sys/fs/cgroup/cpu.stat', 'r') as f:
-                for line in f:
-                    if line.startswith('usage_usec'):
-                        return int(line.split()[1]) / 1000000  # Convert to seconds
-        
-        # Try cgroup v1
-        if os.path.exists('/sys/fs/cgroup/cpuacct/cpuacct.usage'):
-            with open('/sys/fs/cgroup/cpuacct/cpuacct.usage', 'r') as f:
-                return int(f.read().strip()) / 1000000000  # Convert nanoseconds to seconds
-    except:
-        pass
-    return None
+# The running CpuLoad, set once the workers have started
+running_load = None
 
-def calculate_cpu_percent(interval=1.0):
-    """Calculate CPU percentage over an interval using cgroup data"""
-    usage1 = get_container_cpu_usage()
-    if usage1 is None:
-        # Fallback to psutil if cgroup not available
-        return psutil.cpu_percent(interval=interval)
-    
-    time.sleep(interval)
-    
-    usage2 = get_container_cpu_usage()
-    if usage2 is None:
-        return psutil.cpu_percent(interval=0)
-    
-    # Calculate CPU percentage
-    cpu_quota = get_container_cpu_quota()
-    if cpu_quota:
-        cpu_cores = cpu_quota
-    else:
-        cpu_cores = multiprocessing.cpu_count()
+def detect_cpu_count():
+    """
+    CPU cores available: CPU_LIMIT, else the container quota, else the host count
     
-    # Calculate percentage
-    usage_diff = usage2 - usage1
-    cpu_percent = (usage_diff / interval / cpu_cores) * 100
-    
-    return min(100, max(0, cpu_percent))
+    Returns:
+        (cpu_count, where it came from: 'env', 'container' or 'host')
+    """
+    cpu_limit_env = os.getenv('CPU_LIMIT')
+    if cpu_limit_env:
+        return float(cpu_limit_env), 'env'
+    container_cpu_quota = get_container_cpu_quota()
+    if container_cpu_quota:
+        return container_cpu_quota, 'container'
+    return multiprocessing.cpu_count(), 'host'
+
+# The background sampler, started before the HTTP server, and where cpu_count came from
+telemetry = None
+cpu_source = None
+
+def format_percent(value):
+    return 'N/A' if value is None else f"{value:.1f}%"
 
 class HealthCheckHandler(BaseHTTPRequestHandler):
     """Simple HTTP handler for Cloud Run health checks"""
     
+    def send_json(self, status, data):
+        body = json.dumps(data, indent=4).encode()
+        self.send_response(status)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def handle_admin(self, body=None):
+        """
+        GET/POST /admin/cpu: show or change the running target
+        
+        Requires CPU_ADMIN_TOKEN, sent as 'Authorization: Bearer <token>' or 'X-Admin-Token'.
+        POST body: {"target": 85}, or {"profile": "sine:20-80:10m", "loop": true, "speed": 2}
+        """
+        token = os.getenv('CPU_ADMIN_TOKEN')
+        if not token:
+            self.send_response(404)
+            self.end_headers()
+            return
+        supplied = self.headers.get('X-Admin-Token') or ''
+        authorization = self.headers.get('Authorization') or ''
+        if authorization.startswith('Bearer '):
+            supplied = authorization[len('Bearer '):]
+        if not hmac.compare_digest(supplied.encode(), token.encode()):
+            self.send_json(401, {'error': 'unauthorized'})
+            return
+        if running_load is None:
+            self.send_json(503, {'error': 'CPU load not started yet'})
+            return
+        
+        if body is not None:
+            try:
+                changes = json.loads(body or b'{}')
+                if not isinstance(changes, dict) or not ('target' in changes or 'profile' in changes):
+                    raise ValueError("Body must be a JSON object with 'target' or 'profile'")
+                if 'profile' in changes:
+                    profile = LoadProfile(
+                        str(changes['profile']),
+                        loop=bool(changes.get('loop', False)),
+                        speed=float(changes.get('speed', 1)),
+                    )
+                    running_load.set_profile(profile)
+                    print(f"[{datetime.now()}] 🔧 Profile set to {profile.describe()} via /admin/cpu")
+                else:
+                    running_load.set_target(float(changes['target']))
+                    print(f"[{datetime.now()}] 🔧 Target set to {running_load.target.value:g}% via /admin/cpu")
+            except (OSError, ValueError, TypeError) as e:
+                self.send_json(400, {'error': str(e)})
+                return
+        self.send_json(200, running_load.status())
+    
+    def do_POST(self):
+        """Handle POST requests"""
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if self.path.split('?', 1)[0] == '/admin/cpu':
+            self.handle_admin(body)
+        else:
+            self.send_response(404)
+            self.end_headers()
+    
     def do_GET(self):
         """Handle GET requests"""
-        if self.path == '/health' or self.path == '/':
+        if self.path.split('?', 1)[0] == '/admin/cpu':
+            self.handle_admin()
+        elif self.path == '/health' or self.path == '/':
             self.send_response(200)
             self.send_header('Content-type', 'text/html; charset=utf-8')
             self.end_headers()
             
             # Get current status
-            target_percentage = int(os.getenv('CPU_TARGET', '50'))
-            
-            # Get CPU info
-            cpu_limit_env = os.getenv('CPU_LIMIT')
-            container_cpu = None
-            if cpu_limit_env:
-                cpu_count = float(cpu_limit_env)
+            profile_text = 'none (constant target)'
+            if running_load is not None:
+                target_percentage = running_load.target.value
+                schedule = running_load.schedule
+                if schedule is not None:
+                    profile_text = f"{schedule[0].describe()}, {time.monotonic() - schedule[1]:.0f}s in"
             else:
-                container_cpu = get_container_cpu_quota()
-                cpu_count = container_cpu if container_cpu else multiprocessing.cpu_count()
+                target_percentage = int(os.getenv('CPU_TARGET', '50'))
             
-            # Calculate target load
+            # Everything below comes from the sampler's cache, nothing is measured here
+            cpu_count = telemetry.cpu_count
             target_processes_float = cpu_count * target_percentage / 100
             
-            # Get memory info
+            latest = telemetry.latest()
             mem_limit = "N/A"
             mem_usage = "N/A"
-            try:
-                mem_info = psutil.virtual_memory()
-                mem_limit = f"{mem_info.total / (1024**3):.2f} GB"
-                mem_usage = f"{mem_info.percent:.1f}%"
-            except:
-                pass
-            
-            # Get actual CPU usage (average over 1 second)
-            cpu_usage_percent = "N/A"
-            try:
-                # Get CPU percentage over 1 second interval from cgroup
-                cpu_percent_val = calculate_cpu_percent(interval=1.0)
-                cpu_usage_percent = f"{cpu_percent_val:.1f}%"
-            except:
-                pass
+            if latest is not None and latest.memory_limit:
+                mem_limit = f"{latest.memory_limit / (1024**3):.2f} GB"
+                mem_usage = f"{latest.memory_used / latest.memory_limit * 100:.1f}%"
+            cpu_usage_percent = format_percent(latest.cpu_percent if latest else None)
+            cpu_average_1m = format_percent(telemetry.average('cpu_percent', 60))
+            cpu_average_10m = format_percent(telemetry.average('cpu_percent', 600))
+            throttled_1m = format_percent(telemetry.average('throttled_percent', 60))
+            python_processes = telemetry.python_processes if telemetry.python_processes is not None else 'N/A'
             
             # Get environment variables
             startup_delay = os.getenv('STARTUP_DELAY', 'Not set')
@@ -114,57 +164,11 @@ class HealthCheckHandler(BaseHTTPRequestHandler):
             k_revision = os.getenv('K_REVISION', 'N/A')
             k_configuration = os.getenv('K_CONFIGURATION', 'N/A')
             
-            # Try to get metadata from Cloud Run metadata server
-            project_id = "N/A"
-            region = "N/A"
-            service_url = "N/A"
-            instance_id = "N/A"
-            try:
-                import urllib.request
-                import json
-                
-                # Set metadata server headers
-                headers = {'Metadata-Flavor': 'Google'}
-                
-                # Get project ID
-                try:
-                    req = urllib.request.Request(
-                        'http://metadata.google.internal/computeMetadata/v1/project/project-id',
-                        headers=headers
-                    )
-                    with urllib.request.urlopen(req, timeout=1) as response:
-                        project_id = response.read().decode()
-                except:
-                    pass
-                
-                # Get instance ID
-                try:
-                    req = urllib.request.Request(
-                        'http://metadata.google.internal/computeMetadata/v1/instance/id',
-                        headers=headers
-                    )
-                    with urllib.request.urlopen(req, timeout=1) as response:
-                        instance_id = response.read().decode()
-                except:
-                    pass
-                
-                # Get region from zone
-                try:
-                    req = urllib.request.Request(
-                        'http://metadata.google.internal/computeMetadata/v1/instance/region',
-                        headers=headers
-                    )
-                    with urllib.request.urlopen(req, timeout=1) as response:
-                        region_path = response.read().decode()
-                        region = region_path.split('/')[-1] if '/' in region_path else region_path
-                except:
-                    # Try to extract from K_SERVICE env
-                    if k_service != 'Not in Cloud Run':
-                        # Region might be in service URL
-                        pass
-                
-            except Exception as e:
-                pass
+            # Fetched once from the metadata server, in the background
+            metadata = telemetry.metadata or {}
+            project_id = metadata.get('project_id', 'N/A')
+            region = metadata.get('region', 'N/A')
+            instance_id = metadata.get('instance_id', 'N/A')
             
             # Build HTML response
             html = f"""<!DOCTYPE html>
@@ -186,15 +190,17 @@ class HealthCheckHandler(BaseHTTPRequestHandler):
     
     <div class="section">
         <h2>🎯 Target Configuration</h2>
-        <p><span class="label">CPU Target:</span> <span class="highlight">{target_percentage}%</span></p>
+        <p><span class="label">CPU Target:</span> <span class="highlight">{target_percentage:g}%</span></p>
+        <p><span class="label">Profile:</span> <span class="value">{profile_text}</span></p>
         <p><span class="label">Target Load:</span> <span class="value">{target_processes_float:.2f} cores</span></p>
-        <p><span class="label">Actual CPU Usage:</span> <span class="highlight">{cpu_usage_percent}</span></p>
+        <p><span class="label">Actual CPU Usage:</span> <span class="highlight">{cpu_usage_percent}</span> <span class="value">(1m avg {cpu_average_1m}, 10m avg {cpu_average_10m})</span></p>
+        <p><span class="label">CPU Throttled:</span> <span class="value">{throttled_1m} of CFS periods (1m avg)</span></p>
     </div>
     
     <div class="section">
         <h2>💻 Resource Limits</h2>
         <p><span class="label">CPU Cores:</span> <span class="value">{cpu_count:.2f} cores</span></p>
-        <p><span class="label">CPU Type:</span> <span class="value">{"Container (cgroup limited)" if container_cpu else "Host (no limit)"}</span></p>
+        <p><span class="label">CPU Type:</span> <span class="value">{"CPU_LIMIT env" if cpu_source == "env" else "Container (cgroup limited)" if cpu_source == "container" else "Host (no limit)"}</span></p>
         <p><span class="label">Memory Limit:</span> <span class="value">{mem_limit}</span></p>
         <p><span class="label">Memory Usage:</span> <span class="value">{mem_usage}</span></p>
     </div>
@@ -217,7 +223,7 @@ class HealthCheckHandler(BaseHTTPRequestHandler):
     
     <div class="section">
         <h2>📊 Process Information</h2>
-        <p><span class="label">Active Processes:</span> <span class="value">{len([p for p in psutil.process_iter() if 'python' in p.name().lower()])} Python processes</span></p>
+        <p><span class="label">Active Processes:</span> <span class="value">{python_processes} Python processes</span></p>
         <p><span class="label">Main PID:</span> <span class="value">{os.getpid()}</span></p>
     </div>
     
@@ -264,16 +270,26 @@ def wait_for_port(port, timeout=10):
 
 def main():
     """Main function"""
+    global running_load, telemetry, cpu_source
     # Get target CPU percentage from environment variable (default: 100%)
     target_percentage = int(os.getenv('CPU_TARGET', '100'))
+    profile = get_profile()
     
     print(f"[{datetime.now()}] ===== CPU Load Generator Started (Cloud Run Mode) =====")
-    print(f"[{datetime.now()}] Target: {target_percentage}% CPU utilization")
+    if profile is not None:
+        target_percentage = profile.level(0)
+        print(f"[{datetime.now()}] Profile: {profile.describe()}")
+    print(f"[{datetime.now()}] Target: {target_percentage:g}% CPU utilization")
     
     # Get PORT from environment (Cloud Run sets this)
     port = int(os.environ.get('PORT', 8080))
     print(f"[{datetime.now()}] Port: {port}")
     
+    # Start sampling before serving, so the status page has data to render
+    cpu_count, cpu_source = detect_cpu_count()
+    telemetry = TelemetrySampler(cpu_count)
+    telemetry.start()
+    
     # Start HTTP server in background thread (MUST be ready immediately)
     http_thread = threading.Thread(target=start_http_server, args=(port,), daemon=True)
     http_thread.start()
@@ -295,37 +311,31 @@ def main():
         print(f"[{datetime.now()}] (This ensures Cloud Run health check passes first)")
         time.sleep(startup_delay)
     
-    # Get CPU count (prioritize env variable, then container limits)
-    cpu_limit_env = os.getenv('CPU_LIMIT')
-    if cpu_limit_env:
-        cpu_count = float(cpu_limit_env)
+    # CPU count (prioritize env variable, then container limits), detected at startup
+    if cpu_source == 'env':
         print(f"[{datetime.now()}] Running in: CLOUD RUN (CPU_LIMIT env)")
         print(f"[{datetime.now()}] CPU limit from env: {cpu_count:.2f} cores")
+    elif cpu_source == 'container':
+        print(f"[{datetime.now()}] Running in: CONTAINER (with CPU limit)")
+        print(f"[{datetime.now()}] Container CPU quota: {cpu_count:.2f} cores")
     else:
-        container_cpu_quota = get_container_cpu_quota()
-        if container_cpu_quota:
-            cpu_count = container_cpu_quota
-            print(f"[{datetime.now()}] Running in: CONTAINER (with CPU limit)")
-            print(f"[{datetime.now()}] Container CPU quota: {cpu_count:.2f} cores")
-        else:
-            cpu_count = multiprocessing.cpu_count()
-            print(f"[{datetime.now()}] Running in: HOST (no container limit)")
-            print(f"[{datetime.now()}] Detected {cpu_count} CPU cores")
+        print(f"[{datetime.now()}] Running in: HOST (no container limit)")
+        print(f"[{datetime.now()}] Detected {cpu_count} CPU cores")
     
     # Calculate target load
     target_processes_float = cpu_count * target_percentage / 100
     
     # Calculate number of processes needed
     # Round up to ensure we can reach the target
-    # Example: 1.7 cores = 2 processes (1 at 100%, 1 at 70%)
-    target_processes = max(1, math.ceil(target_processes_float))
+    # Example: 1.7 cores = 2 processes (at 85% each)
+    target_processes = workers_needed(target_processes_float)
     
     # Calculate load per process
     # Distribute the target load across processes
     # Example: 1.7 cores / 2 processes = 0.85 load per process
     load_per_process = target_processes_float / target_processes
     
-    print(f"[{datetime.now()}] Target CPU usage: {target_percentage}%")
+    print(f"[{datetime.now()}] Target CPU usage: {target_percentage:g}%")
     print(f"[{datetime.now()}] CPU count: {cpu_count:.2f}")
     print(f"[{datetime.now()}] Target load: {target_processes_float:.2f} cores")
     print(f"[{datetime.now()}] Spawning {target_processes} process(es)")
@@ -333,27 +343,26 @@ def main():
     
     print(f"[{datetime.now()}] ===== Starting CPU Load Workers =====")
     
-    # Create and start worker processes
-    processes = []
-    for i in range(target_processes):
-        p = multiprocessing.Process(target=cpu_load_worker, args=(load_per_process,))
-        p.start()
-        processes.append(p)
-        print(f"[{datetime.now()}] Started process {i+1}/{target_processes} (PID: {p.pid})")
+    # Calibrate the work rates once, before the workers compete for the CPU
+    workload = get_workload()
+    work_rates = calibrate_workload(workload)
+    print(f"[{datetime.now()}] Workload: {describe_workload(workload)}")
+    print(f"[{datetime.now()}] Calibrated work rates: "
+          + ', '.join(f"{name} {rate:.2f} units/µs" for name, rate in work_rates.items()))
+    
+    # Create and start worker processes, with their duty cycles in shared memory
+    running_load = CpuLoad(target_percentage, cpu_count, work_rates, profile)
     
     print(f"[{datetime.now()}] ===== All processes started successfully =====")
     print(f"[{datetime.now()}] HTTP server listening on port {port}")
     print(f"[{datetime.now()}] Press Ctrl+C to stop")
     
     try:
-        # Keep main process alive
-        for p in processes:
-            p.join()
+        # Keep main process alive, adjusting the duty cycles and following /admin/cpu
+        running_load.run()
     except KeyboardInterrupt:
         print(f"\n[{datetime.now()}] Stopping all processes...")
-        for p in processes:
-            p.terminate()
-            p.join()
+        running_load.pool.stop()
         print(f"[{datetime.now()}] All processes stopped")
 
 if __name__ == "__main__":
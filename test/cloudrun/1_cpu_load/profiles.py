@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+CPU load profiles for CpuLoad: the target CPU usage as a function of time
+A profile is a sequence of segments separated by ';', each run for its own
+duration, and is evaluated by the control loop on a monotonic clock.
+
+  hold:LEVEL:DURATION                    constant level
+  ramp:FROM-TO:DURATION                  linear ramp
+  steps:L1,L2,...:STEP                   staircase, each level held for STEP
+  sine:MIN-MAX:PERIOD[:DURATION]         sine wave starting at its midpoint, e.g. a 24h diurnal cycle
+  burst:BASE-PEAK:PERIOD:LENGTH[:DURATION]  BASE, with a LENGTH burst at PEAK every PERIOD
+  trace:FILE.csv[:SPEED]                 recorded utilization (seconds,percent rows), SPEED x faster
+
+Levels are percentages of the container's CPUs, durations are seconds or
+take a unit (500ms, 90s, 10m, 2h). Examples:
+
+  CPU_PROFILE="ramp:20-90:10m;hold:90:5m;ramp:90-20:10m"
+  CPU_PROFILE="sine:20-80:24h" CPU_PROFILE_SPEED=96      # one day in 15 minutes
+  CPU_PROFILE="burst:30-95:2m:20s"
+  CPU_PROFILE="trace:prod-cpu.csv:60"
+
+A sine or burst without DURATION runs forever and must be the last segment.
+After the last segment the level stays at its final value, or the profile
+starts over with CPU_PROFILE_LOOP=1.
+"""
+import bisect
+import csv
+import math
+import os
+import re
+from datetime import datetime
+
+DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+# Levels are clamped into (0, 100], like CpuLoad.set_target()
+MIN_LEVEL = 1.0
+
+def parse_duration(text):
+    """Seconds from '90', '90s', '500ms', '10m' or '2h'"""
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*(ms|s|m|h)?\s*', text)
+    if not match:
+        raise ValueError(f"Invalid duration '{text}'")
+    seconds = float(match.group(1)) * DURATION_UNITS[match.group(2) or 's']
+    if seconds <= 0:
+        raise ValueError(f"Duration '{text}' must be positive")
+    return seconds
+
+def parse_level(text):
+    try:
+        level = float(text)
+    except ValueError:
+        raise ValueError(f"Invalid level '{text}'")
+    if not 0 < level <= 100:
+        raise ValueError(f"Level {text} must be in (0, 100]")
+    return level
+
+def parse_range(text):
+    """(low, high) from 'LOW-HIGH'"""
+    low, separator, high = text.partition('-')
+    if not separator:
+        raise ValueError(f"Expected FROM-TO, got '{text}'")
+    return parse_level(low), parse_level(high)
+
+def load_trace(path):
+    """
+    Read a utilization trace: CSV rows of (seconds, percent)
+
+    The first column may also be an epoch timestamp; offsets are taken from
+    the first row. A header row is skipped.
+
+    Returns:
+        (offsets, levels) sorted by offset
+    """
+    rows = []
+    with open(path, 'r', newline='') as f:
+        for row in csv.reader(f):
+            if len(row) < 2 or row[0].lstrip().startswith('#'):
+                continue
+            try:
+                rows.append((float(row[0]), float(row[1])))
+            except ValueError:
+                if rows:
+                    raise ValueError(f"{path}: invalid row {row}")
+                # Header
+    if len(rows) < 2:
+        raise ValueError(f"{path}: need at least 2 rows of seconds,percent")
+    rows.sort()
+    origin = rows[0][0]
+    return [t - origin for t, _ in rows], [min(100.0, max(MIN_LEVEL, level)) for _, level in rows]
+
+def trace_level(offsets, levels, t):
+    """Linear interpolation of the trace at offset t"""
+    i = bisect.bisect_right(offsets, t)
+    if i == 0:
+        return levels[0]
+    if i == len(offsets):
+        return levels[-1]
+    t0, t1 = offsets[i - 1], offsets[i]
+    return levels[i - 1] + (levels[i] - levels[i - 1]) * (t - t0) / (t1 - t0)
+
+def parse_segment(text):
+    """
+    Parse one segment into (duration or None, level function of seconds into the segment)
+
+    Raises:
+        ValueError: unknown segment kind or invalid arguments
+    """
+    kind, _, rest = text.strip().partition(':')
+    kind = kind.lower()
+    args = rest.split(':') if rest else []
+
+    def expect(low, high=None):
+        if not low <= len(args) <= (high or low):
+            raise ValueError(f"'{text.strip()}': wrong number of arguments for {kind}")
+
+    if kind == 'hold':
+        expect(2)
+        level = parse_level(args[0])
+        return parse_duration(args[1]), lambda t: level
+    if kind == 'ramp':
+        expect(2)
+        start, end = parse_range(args[0])
+        duration = parse_duration(args[1])
+        return duration, lambda t: start + (end - start) * min(1.0, t / duration)
+    if kind == 'steps':
+        expect(2)
+        levels = [parse_level(level) for level in args[0].split(',')]
+        step = parse_duration(args[1])
+        return step * len(levels), lambda t: levels[min(len(levels) - 1, int(t / step))]
+    if kind == 'sine':
+        expect(2, 3)
+        low, high = parse_range(args[0])
+        period = parse_duration(args[1])
+        duration = parse_duration(args[2]) if len(args) == 3 else None
+        middle, amplitude = (low + high) / 2, (high - low) / 2
+        return duration, lambda t: middle + amplitude * math.sin(2 * math.pi * t / period)
+    if kind == 'burst':
+        expect(3, 4)
+        base, peak = parse_range(args[0])
+        period = parse_duration(args[1])
+        length = parse_duration(args[2])
+        if length >= period:
+            raise ValueError(f"'{text.strip()}': burst length must be shorter than its period")
+        duration = parse_duration(args[3]) if len(args) == 4 else None
+        return duration, lambda t: peak if t % period < length else base
+    if kind == 'trace':
+        expect(1, 2)
+        speed = float(args[1]) if len(args) == 2 else 1.0
+        if speed <= 0:
+            raise ValueError(f"'{text.strip()}': speed must be positive")
+        offsets, levels = load_trace(args[0])
+        return offsets[-1] / speed, lambda t: trace_level(offsets, levels, t * speed)
+    raise ValueError(f"Unknown profile segment '{kind}' (hold, ramp, steps, sine, burst, trace)")
+
+class LoadProfile:
+    """
+    Target CPU usage over time, built from CPU_PROFILE-style text
+
+    level(elapsed) is the target (percent) at elapsed seconds from the
+    start; speed compresses time for every segment.
+    """
+
+    def __init__(self, spec, loop=False, speed=1.0):
+        self.spec = spec
+        self.loop = loop
+        self.speed = speed
+        if speed <= 0:
+            raise ValueError("Profile speed must be positive")
+        self.segments = [parse_segment(part) for part in spec.split(';') if part.strip()]
+        if not self.segments:
+            raise ValueError("Empty CPU profile")
+        if any(duration is None for duration, _ in self.segments[:-1]):
+            raise ValueError("Only the last profile segment can run forever")
+        self.duration = None
+        if self.segments[-1][0] is not None:
+            self.duration = sum(duration for duration, _ in self.segments)
+
+    def level(self, elapsed):
+        """Target percentage at elapsed seconds (monotonic) since the start"""
+        t = elapsed * self.speed
+        if self.duration is not None and t >= self.duration:
+            if not self.loop:
+                duration, function = self.segments[-1]
+                return self.clamp(function(duration))
+            t %= self.duration
+        for duration, function in self.segments:
+            if duration is None or t < duration:
+                return self.clamp(function(t))
+            t -= duration
+        # Rounding at the very end of the last segment
+        duration, function = self.segments[-1]
+        return self.clamp(function(duration))
+
+    def finished(self, elapsed):
+        """True once a non-looping profile is holding its final level"""
+        return not self.loop and self.duration is not None and elapsed * self.speed >= self.duration
+
+    @staticmethod
+    def clamp(level):
+        return min(100.0, max(MIN_LEVEL, level))
+
+    def describe(self):
+        if self.duration is None:
+            length = 'runs forever'
+        else:
+            length = f"{self.duration / self.speed:g}s{', looping' if self.loop else ''}"
+        speed = f" at {self.speed:g}x" if self.speed != 1 else ''
+        return f"{self.spec} ({length}{speed})"
+
+def get_profile():
+    """The CPU_PROFILE profile, None if unset or invalid (the constant CPU_TARGET is used)"""
+    spec = os.getenv('CPU_PROFILE', '').strip()
+    if not spec:
+        return None
+    try:
+        return LoadProfile(
+            spec,
+            loop=os.getenv('CPU_PROFILE_LOOP', '0').lower() in ('1', 'true', 'yes'),
+            speed=float(os.getenv('CPU_PROFILE_SPEED', '1')),
+        )
+    except (OSError, ValueError) as e:
+        print(f"[{datetime.now()}] Warning: Invalid CPU_PROFILE ({e}), holding CPU_TARGET")
+        return None
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Background telemetry for the status page of cpu_load_with_http.py
+A sampler thread reads CPU usage, memory and CFS throttling every
+TELEMETRY_INTERVAL seconds into a ring buffer, and fetches the Cloud Run
+metadata once. Request handlers only read what is already there, so a
+health check never waits on a measurement or the metadata server, even
+with every core saturated.
+"""
+import collections
+import os
+import threading
+import time
+import urllib.request
+from datetime import datetime
+
+import psutil
+
+from cpu_load import get_cpu_usage
+
+# Samples kept: 10 minutes at the default 1s interval
+TELEMETRY_HISTORY = 600
+
+METADATA_URL = 'http://metadata.google.internal/computeMetadata/v1/'
+
+# Seconds between sampling the number of Python processes (walks /proc)
+PROCESS_COUNT_INTERVAL = 10
+
+Sample = collections.namedtuple('Sample', [
+    'time',             # monotonic seconds
+    'cpu_percent',      # of cpu_count, over the last interval
+    'memory_used',      # bytes
+    'memory_limit',     # bytes
+    'throttled_percent',  # of CFS periods in the last interval that were throttled
+    'throttled_seconds',  # throttled time in the last interval
+])
+
+def get_container_memory():
+    """(used bytes, limit bytes) of the container from cgroup, None outside one or without a limit"""
+    for current_path, limit_path in (('/sys/fs/cgroup/memory.current', '/sys/fs/cgroup/memory.max'),
+                                     ('/sys/fs/cgroup/memory/memory.usage_in_bytes',
+                                      '/sys/fs/cgroup/memory/memory.limit_in_bytes')):
+        try:
+            with open(current_path, 'r') as f:
+                used = int(f.read().strip())
+            with open(limit_path, 'r') as f:
+                limit = f.read().strip()
+        except (OSError, ValueError):
+            continue
+        # v2 writes 'max', v1 a huge number when there is no limit
+        if limit == 'max' or int(limit) >= 1 << 60:
+            return None
+        return used, int(limit)
+    return None
+
+def get_container_throttling():
+    """(CFS periods, throttled periods, throttled seconds) so far from cgroup cpu.stat, None if unavailable"""
+    # cgroup v2 reports throttled_usec, v1 throttled_time in nanoseconds
+    for path, key, scale in (('/sys/fs/cgroup/cpu.stat', 'throttled_usec', 1e-6),
+                             ('/sys/fs/cgroup/cpu/cpu.stat', 'throttled_time', 1e-9)):
+        try:
+            with open(path, 'r') as f:
+                stats = dict(line.split() for line in f if line.strip())
+            return int(stats['nr_periods']), int(stats['nr_throttled']), int(stats[key]) * scale
+        except (OSError, KeyError, ValueError):
+            continue
+    return None
+
+def fetch_metadata(timeout=1.0):
+    """Project ID, region and instance ID from the metadata server, 'N/A' for whatever is unavailable"""
+    metadata = {}
+    for key, path in (('project_id', 'project/project-id'),
+                      ('instance_id', 'instance/id'),
+                      ('region', 'instance/region')):
+        try:
+            request = urllib.request.Request(METADATA_URL + path, headers={'Metadata-Flavor': 'Google'})
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                value = response.read().decode()
+        except Exception:
+            metadata[key] = 'N/A'
+            continue
+        # The region comes as projects/NUMBER/regions/REGION
+        metadata[key] = value.rsplit('/', 1)[-1]
+    return metadata
+
+class TelemetrySampler(threading.Thread):
+    """
+    Daemon thread sampling the container into a ring buffer
+
+    samples is a deque of Sample, newest last; appends and reads of a deque
+    are atomic, so handlers read it without a lock. metadata is None until
+    the one metadata fetch completes.
+    """
+
+    def __init__(self, cpu_count, interval=None, history=TELEMETRY_HISTORY):
+        super().__init__(name='telemetry', daemon=True)
+        self.cpu_count = cpu_count
+        self.interval = interval or float(os.getenv('TELEMETRY_INTERVAL', '1'))
+        self.samples = collections.deque(maxlen=history)
+        self.metadata = None
+        self.python_processes = None
+
+    def run(self):
+        # In its own thread: outside GCP the lookups can take their full timeouts
+        threading.Thread(target=self.load_metadata, name='metadata', daemon=True).start()
+        last_usage = get_cpu_usage()
+        last_throttling = get_container_throttling()
+        last_time = time.monotonic()
+        next_process_count = last_time
+        while True:
+            time.sleep(self.interval)
+            now = time.monotonic()
+            usage = get_cpu_usage()
+            throttling = get_container_throttling()
+            dt = now - last_time
+
+            cpu_percent = None
+            if usage is not None and last_usage is not None and dt > 0:
+                cpu_percent = min(100.0, max(0.0, (usage - last_usage) / dt / self.cpu_count * 100))
+            throttled_percent = throttled_seconds = None
+            if throttling is not None and last_throttling is not None:
+                periods = throttling[0] - last_throttling[0]
+                throttled_percent = (throttling[1] - last_throttling[1]) / periods * 100 if periods else 0.0
+                throttled_seconds = throttling[2] - last_throttling[2]
+            memory = get_container_memory()
+            if memory is None:
+                try:
+                    virtual = psutil.virtual_memory()
+                    memory = virtual.total - virtual.available, virtual.total
+                except Exception:
+                    memory = None, None
+
+            self.samples.append(Sample(now, cpu_percent, *memory, throttled_percent, throttled_seconds))
+            last_usage, last_throttling, last_time = usage, throttling, now
+
+            if now >= next_process_count:
+                next_process_count = now + PROCESS_COUNT_INTERVAL
+                try:
+                    self.python_processes = sum(1 for p in psutil.process_iter(['name'])
+                                                if 'python' in (p.info['name'] or '').lower())
+                except Exception:
+                    pass
+
+    def load_metadata(self):
+        self.metadata = fetch_metadata()
+        if self.metadata['project_id'] != 'N/A':
+            print(f"[{datetime.now()}] Metadata: project {self.metadata['project_id']}, "
+                  f"region {self.metadata['region']}, instance {self.metadata['instance_id'][:12]}...")
+
+    def latest(self):
+        """The newest Sample, None before the first interval"""
+        try:
+            return self.samples[-1]
+        except IndexError:
+            return None
+
+    def average(self, field, seconds):
+        """Mean of a Sample field over the last seconds, None without data"""
+        since = time.monotonic() - seconds
+        values = []
+        for sample in reversed(list(self.samples)):
+            if sample.time < since:
+                break
+            if getattr(sample, field) is not None:
+                values.append(getattr(sample, field))
+        return sum(values) / len(values) if values else None
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+CPU workload kernels for cpu_load_worker
+Each kernel does `units` units of one kind of work; the worker calibrates
+units per microsecond for every kernel and mixes them by weight.
+
+Select with CPU_WORKLOAD, a kernel name or a weighted mix:
+  CPU_WORKLOAD=int                       # default, squares small ints (L1 only)
+  CPU_WORKLOAD=float:2,memory:1,hash:1   # time shares 50% / 25% / 25%
+  CPU_WORKLOAD=all                       # every kernel, equal shares
+
+hash and zlib run in C with the GIL released, the rest hold it.
+"""
+import hashlib
+import math
+import os
+import zlib
+from array import array
+from datetime import datetime
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Elements per vector unit
+VECTOR_LENGTH = 256
+
+# Memory kernel: working set per worker and stride between touched bytes;
+# one page plus one cache line defeats both the prefetcher and the cache
+MEMORY_WORKING_SET_MB = int(os.getenv('CPU_MEMORY_WORKING_SET_MB', '32'))
+MEMORY_STRIDE = 4096 + 64
+MEMORY_TOUCHES_PER_UNIT = 256
+
+# Bytes hashed / compressed per unit
+HASH_BLOCK = 4096
+ZLIB_BLOCK = 2048
+
+# Per-process state, created on first use (after the worker process starts)
+_state = {}
+
+def int_kernel(units):
+    """Square small ints: stays in L1 cache, interpreter bound"""
+    for i in range(units):
+        _ = i ** 2
+
+def float_kernel(units):
+    """Dependent floating-point math (sqrt, sin, multiply-add)"""
+    x = _state.get('float', 0.5)
+    for _ in range(units):
+        x = math.sqrt(x * 1.0001 + 0.25) + math.sin(x) * 0.001
+    _state['float'] = x
+
+def vector_kernel(units):
+    """Element-wise array math with NumPy (requirements.txt), C loops of array without it"""
+    if 'vector' not in _state:
+        if numpy is not None:
+            a = numpy.linspace(0.0, 1.0, VECTOR_LENGTH)
+            _state['vector'] = (a, a[::-1].copy(), numpy.empty(VECTOR_LENGTH))
+        else:
+            a = array('d', (i / VECTOR_LENGTH for i in range(VECTOR_LENGTH)))
+            _state['vector'] = (a, array('d', reversed(a)), None)
+    a, b, out = _state['vector']
+    for _ in range(units):
+        if out is not None:
+            numpy.multiply(a, b, out=out)
+            numpy.add(out, a, out=out)
+            out.sum()
+        else:
+            sum(map(float.__mul__, a, b))
+
+def memory_kernel(units):
+    """Strided walk over a working set much larger than the caches"""
+    if 'memory' not in _state:
+        # Written once so every page is really backed by memory
+        _state['memory'] = [bytearray(os.urandom(1024) * (MEMORY_WORKING_SET_MB * 1024)), 0]
+    buffer, offset = _state['memory']
+    span = MEMORY_STRIDE * MEMORY_TOUCHES_PER_UNIT
+    for _ in range(units):
+        # A strided slice copies every touched byte in one C loop
+        buffer[offset:offset + span:MEMORY_STRIDE]
+        offset = (offset + span + 64) % (len(buffer) - span)
+    _state['memory'][1] = offset
+
+def branch_kernel(units):
+    """Unpredictable data-dependent branches on a pseudo-random sequence"""
+    x, acc = _state.get('branch', (12345, 0))
+    for _ in range(units):
+        x = (x * 1103515245 + 12345) & 0x7fffffff
+        if x & 0x10:
+            acc += 1
+        elif x & 0x20:
+            acc -= 3
+        elif x & 0x40:
+            acc ^= x
+        else:
+            acc >>= 1
+    _state['branch'] = (x, acc)
+
+def hash_kernel(units):
+    """SHA-256 of 4KB blocks (releases the GIL)"""
+    block = _state.setdefault('hash', os.urandom(HASH_BLOCK))
+    for _ in range(units):
+        hashlib.sha256(block).digest()
+
+def zlib_kernel(units):
+    """zlib level 6 compression of half-compressible 2KB blocks (releases the GIL)"""
+    block = _state.setdefault('zlib', os.urandom(ZLIB_BLOCK // 2) + bytes(range(256)) * (ZLIB_BLOCK // 512))
+    for _ in range(units):
+        zlib.compress(block, 6)
+
+KERNELS = {
+    'int': int_kernel,
+    'float': float_kernel,
+    'vector': vector_kernel,
+    'memory': memory_kernel,
+    'branch': branch_kernel,
+    'hash': hash_kernel,
+    'zlib': zlib_kernel,
+}
+
+def parse_workload(text):
+    """
+    Parse CPU_WORKLOAD into [(kernel name, integer weight), ...]
+
+    Raises:
+        ValueError: unknown kernel or invalid weight
+    """
+    if text.strip().lower() == 'all':
+        return [(name, 1) for name in KERNELS]
+    mix = []
+    for part in text.split(','):
+        name, _, weight = part.strip().lower().partition(':')
+        if name not in KERNELS:
+            raise ValueError(f"Unknown CPU workload '{name}' (choose from {', '.join(KERNELS)} or all)")
+        if weight and (not weight.isdigit() or int(weight) == 0):
+            raise ValueError(f"Invalid weight '{weight}' for CPU workload '{name}'")
+        mix.append((name, int(weight or 1)))
+    return mix
+
+def get_workload():
+    """The CPU_WORKLOAD mix, falling back to 'int' if it is invalid"""
+    try:
+        mix = parse_workload(os.getenv('CPU_WORKLOAD', 'int'))
+    except ValueError as e:
+        print(f"[{datetime.now()}] Warning: {e}, using int")
+        return [('int', 1)]
+    if numpy is None and any(name == 'vector' for name, _ in mix):
+        # Still a valid load, but not SIMD array math: say so instead of silently differing
+        print(f"[{datetime.now()}] Warning: NumPy is not installed, the vector kernel runs "
+              "pure-Python array loops (pip install -r requirements.txt)")
+    return mix
+
+def workload_schedule(mix):
+    """
+    Kernel names in the order chunks run them, interleaved by weight
+
+    Chunks all last about the same time, so chunk counts are time shares.
+    """
+    schedule = []
+    credits = {name: 0 for name, _ in mix}
+    total = sum(weight for _, weight in mix)
+    for _ in range(total):
+        # Smooth weighted round robin: no kernel runs in long streaks
+        for name, weight in mix:
+            credits[name] += weight
+        chosen = max(credits, key=credits.get)
+        credits[chosen] -= total
+        schedule.append(chosen)
+    return schedule
+
+def describe_workload(mix):
+    total = sum(weight for _, weight in mix)
+    return ', '.join(f"{name} {weight / total * 100:.0f}%" for name, weight in mix)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for the latency simulator endpoints
+Reports requests/s per CPU core for each endpoint, with no injected latency
+
+Modes:
+  render - call render_response() in-process (pure response-building cost)
+  http   - start latency_simulator.py with LATENCY_MS=0 and drive it with
+           keep-alive clients; server CPU time comes from /proc/<pid>/stat
+
+Usage:
+  python3 bench_latency_simulator.py [render|http] [--engine threaded] [--seconds 5]
+"""
+import argparse
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import timeit
+
+ENDPOINTS = ('/health', '/api/test', '/metrics', '/missing')
+
+
+def bench_render(seconds):
+    """Time render_response() for each endpoint in this process"""
+    os.environ.setdefault('LATENCY_MS', '0')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import latency_simulator as sim
+
+    active = sim.current_config()
+    print(f"{'Endpoint':<12} {'renders/s/core':>16} {'µs/render':>10}")
+    for path in ('/health', '/api/test', '/missing'):
+        timer = timeit.Timer(lambda: sim.render_response(path, time.perf_counter(), active, 0))
+        # Calibrate the loop count to roughly the requested duration
+        number, elapsed = timer.autorange()
+        number = max(number, int(number * seconds / max(elapsed, 1e-9)))
+        elapsed = timer.timeit(number)
+        print(f"{path:<12} {number / elapsed:>16,.0f} {elapsed / number * 1e6:>10.2f}")
+
+
+def process_cpu_seconds(pid):
+    """User + system CPU seconds of a process (Linux /proc)"""
+    with open(f'/proc/{pid}/stat', 'r') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def wait_for_port(port, timeout=10):
+    """Wait until the simulator accepts connections"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+
+def drive(port, path, seconds, clients):
+    """Send keep-alive requests from several threads, return the request count"""
+    counts = [0] * clients
+    deadline = time.time() + seconds
+
+    def client(i):
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        while time.time() < deadline:
+            conn.request('GET', path)
+            conn.getresponse().read()
+            counts[i] += 1
+        conn.close()
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sum(counts)
+
+
+def bench_http(seconds, engine, clients, port):
+    """Benchmark each endpoint over HTTP against one simulator process"""
+    env = dict(
+        os.environ, PORT=str(port), LATENCY_MS='0', LATENCY_DIST='fixed',
+        SIM_ENGINE=engine, SIM_WORKERS='1', SIM_KEEPALIVE='true',
+    )
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'latency_simulator.py')
+    server = subprocess.Popen(
+        [sys.executable, script], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        if not wait_for_port(port):
+            raise SystemExit("❌ Simulator did not start")
+
+        print(f"Engine: {engine}, {clients} keep-alive client(s), {seconds}s per endpoint")
+        print(f"{'Endpoint':<12} {'req/s':>10} {'req/s/core':>12} {'server CPU':>11}")
+        for path in ENDPOINTS:
+            cpu_before = process_cpu_seconds(server.pid)
+            started = time.time()
+            count = drive(port, path, seconds, clients)
+            elapsed = time.time() - started
+            cpu = process_cpu_seconds(server.pid) - cpu_before
+            per_core = count / cpu if cpu else float('inf')
+            print(f"{path:<12} {count / elapsed:>10,.0f} {per_core:>12,.0f} {cpu / elapsed * 100:>10.0f}%")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency simulator endpoint micro-benchmark")
+    parser.add_argument('mode', nargs='?', choices=('render', 'http'), default='render')
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--engine', default='threaded')
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--port', type=int, default=18080)
+    args = parser.parse_args()
+
+    if args.mode == 'render':
+        bench_render(args.seconds)
+    else:
+        bench_http(args.seconds, args.engine, args.clients, args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Process-level checks of latency_simulator.py (run as a real server)
+
+Usage:
+  python3 -m unittest test_latency_simulator.py
+"""
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import time
+import unittest
+
+SIMULATOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'latency_simulator.py')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def accepts(port):
+    try:
+        with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+            return True
+    except OSError:
+        return False
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    # A zombie still answers kill(0); it no longer serves anything
+    with open(f'/proc/{pid}/stat') as f:
+        return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+
+
+def start_simulator(**env):
+    """Start the simulator, returns (process, port)"""
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, '-u', SIMULATOR],
+        env={**os.environ, 'PORT': str(port), 'LATENCY_MS': '1', **env},
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+    )
+    return process, port
+
+
+class WorkerPoolShutdownTest(unittest.TestCase):
+
+    def check_signal_stops_pool(self, signum):
+        process, port = start_simulator(SIM_WORKERS='3')
+        pids = []
+        try:
+            # Worker PIDs come from the startup log
+            for line in process.stdout:
+                match = re.search(r'Started worker \d+/3 \(PID: (\d+)\)', line)
+                if match:
+                    pids.append(int(match.group(1)))
+                if len(pids) == 3:
+                    break
+            self.assertEqual(len(pids), 3)
+            self.assertTrue(wait_until(lambda: accepts(port)), "pool never started serving")
+
+            process.send_signal(signum)
+            process.wait(timeout=10)
+            self.assertTrue(wait_until(lambda: not any(alive(pid) for pid in pids)),
+                            f"workers still running after {signal.Signals(signum).name}")
+            self.assertFalse(accepts(port))
+        finally:
+            process.kill()
+            process.wait()
+            for pid in pids:
+                if alive(pid):
+                    os.kill(pid, signal.SIGKILL)
+            process.stdout.close()
+
+    def test_sigterm_stops_workers(self):
+        self.check_signal_stops_pool(signal.SIGTERM)
+
+    def test_sigint_stops_workers(self):
+        self.check_signal_stops_pool(signal.SIGINT)
+
+
+class ConcurrencySharesTest(unittest.TestCase):
+
+    def test_limit_below_workers_runs_one_worker_per_slot(self):
+        # Each worker would otherwise get a slot, raising the limit to SIM_WORKERS
+        process, port = start_simulator(SIM_WORKERS='3', SIM_CONCURRENCY='2')
+        try:
+            self.assertTrue(wait_until(lambda: accepts(port)), "simulator never started serving")
+        finally:
+            process.terminate()
+            output = process.communicate(timeout=10)[0]
+        self.assertIn('running 2 worker(s)', output)
+        self.assertEqual(re.findall(r'Started worker \d+/(\d+)', output), ['2', '2'])
+
+
+def timed_get(port, path):
+    """HTTP/1.0 GET read to EOF, returns (body, seconds from the end of the head to EOF)"""
+    with socket.create_connection(('127.0.0.1', port), timeout=30) as sock:
+        sock.sendall(f"GET {path} HTTP/1.0\r\n\r\n".encode('latin-1'))
+        data = b''
+        head_done = None
+        while chunk := sock.recv(65536):
+            data += chunk
+            if head_done is None and b'\r\n\r\n' in data:
+                head_done = time.monotonic()
+        return data.split(b'\r\n\r\n', 1)[1], time.monotonic() - head_done
+
+
+class SlowFaultTest(unittest.TestCase):
+    """FAULTS=slow trickles payload and stream bodies too, 16 bytes every 100ms"""
+
+    def check_engine(self, engine):
+        process, port = start_simulator(SIM_ENGINE=engine, FAULTS='slow:1',
+                                        FAULT_SLOW_BYTES='16', FAULT_SLOW_INTERVAL_MS='100')
+        try:
+            self.assertTrue(wait_until(lambda: accepts(port)), "simulator never started serving")
+            for path in ('/payload?size=64', '/stream?duration_ms=0&chunk_size=64&format=raw'):
+                with self.subTest(engine=engine, path=path):
+                    body, seconds = timed_get(port, path)
+                    self.assertEqual(len(body), 64)
+                    # 4 pieces of body, at least 3 pauses after the head
+                    self.assertGreaterEqual(seconds, 0.25)
+        finally:
+            process.kill()
+            process.wait()
+            process.stdout.close()
+
+    def test_threaded(self):
+        self.check_engine('threaded')
+
+    def test_asyncio(self):
+        self.check_engine('asyncio')
+
+
+if __name__ == '__main__':
+    unittest.main()